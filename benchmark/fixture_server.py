@@ -0,0 +1,426 @@
+"""
+本地小红书替身站点，供基准测试离线使用
+
+按关键词和笔记ID确定性地生成搜索页、笔记页、评论区以及对应的 XHR 接口数据，
+页面结构和接口字段与网页端保持一致，工具通过 XHS_BASE_URL / XHS_API_BASE_URL 指向本服务即可运行。
+
+单独启动：
+    python benchmark/fixture_server.py --port 8900
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import hashlib
+import html
+import json
+import random
+import re
+import threading
+import time
+
+# 生成正文和评论使用的词表，包含部分领域词，便于 analyze_note 命中领域
+VOCABULARY = [
+    "今天", "分享", "一下", "最近", "真的", "超级", "推荐", "大家", "感觉", "这个",
+    "口红", "护肤", "穿搭", "搭配", "美食", "餐厅", "旅行", "攻略", "酒店", "打卡",
+    "宝宝", "育儿", "手机", "相机", "装修", "收纳", "健身", "减肥", "AI", "编程"
+]
+NICKNAMES = ["小红薯", "momo", "阿狸", "橘子汽水", "Lynn", "小鹿", "Coco", "大白", "可乐", "阿秋"]
+LOCATIONS = ["上海", "北京", "广东", "浙江", "四川", "江苏"]
+
+# 1x1 透明 PNG，用作笔记图片
+PIXEL_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+NOTE_PATH_PATTERN = re.compile(r"^/(?:explore|search_result|discovery/item)/([0-9a-zA-Z]{24})$")
+
+SEARCH_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{keyword} - 小红书搜索</title>
+<style>section.note-item {{ display: inline-block; width: 240px; height: 320px; margin: 8px; }}</style>
+</head><body>
+<div class="feeds-container"></div>
+<script>
+const keyword = {keyword_json};
+let page = 0, loading = false, hasMore = true;
+async function loadMore() {{
+    if (loading || !hasMore) return;
+    loading = true;
+    page += 1;
+    const response = await fetch('/api/sns/web/v1/search/notes', {{
+        method: 'POST',
+        headers: {{'Content-Type': 'application/json'}},
+        body: JSON.stringify({{keyword: keyword, page: page, page_size: 20}})
+    }});
+    const payload = await response.json();
+    const container = document.querySelector('.feeds-container');
+    for (const item of payload.data.items) {{
+        const card = document.createElement('section');
+        card.className = 'note-item';
+        card.innerHTML = `<a class="cover" href="/search_result/${{item.id}}?xsec_token=${{item.xsec_token}}"></a>
+            <div class="footer"><a class="title"><span></span></a>
+            <div class="author-wrapper"><span class="name"></span></div></div>`;
+        card.querySelector('a.title span').textContent = item.note_card.display_title;
+        card.querySelector('span.name').textContent = item.note_card.user.nickname;
+        container.appendChild(card);
+    }}
+    hasMore = payload.data.has_more;
+    loading = false;
+}}
+window.addEventListener('scroll', () => {{
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 200) loadMore();
+}});
+loadMore();
+</script>
+</body></html>
+"""
+
+NOTE_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title} - 小红书</title>
+<style>.note-scroller {{ height: 100vh; overflow-y: auto; }} .comment-item {{ min-height: 80px; }}</style>
+</head><body>
+<div class="note-container">
+<div class="author-wrapper"><span class="username">{author}</span></div>
+<div class="note-scroller">
+    <div class="note-content">
+        <div id="detail-title" class="title">{title}</div>
+        <div id="detail-desc" class="desc"><span class="note-text">{desc}</span></div>
+        <div class="bottom-container"><span class="date">{date}</span></div>
+    </div>
+    <div class="comments-el">
+        <div class="comments-container">
+            <div class="total">共 {comment_count} 条评论</div>
+            <div class="list-container"></div>
+        </div>
+    </div>
+</div>
+</div>
+<script>window.__INITIAL_STATE__ = {state_json};</script>
+<script>
+const noteId = {note_id_json};
+let cursor = '', loading = false, hasMore = true;
+const escape = value => value.replace(/[&<>"]/g, c => ({{'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}}[c]));
+const renderComment = (comment, sub) => `<div class="comment-item${{sub ? ' comment-item-sub' : ''}}" id="comment-${{comment.id}}">
+    <div class="author"><a class="name" href="/user/profile/${{comment.user_info.user_id}}">${{escape(comment.user_info.nickname)}}</a></div>
+    <div class="content"><span class="note-text">${{escape(comment.content)}}</span></div>
+    <div class="info"><span class="date">${{new Date(comment.create_time).toLocaleDateString()}}</span></div>
+</div>`;
+function renderShowMore(thread, rootId, remaining, subCursor) {{
+    const old = thread.querySelector('.show-more');
+    if (old) old.remove();
+    if (remaining <= 0) return;
+    const button = document.createElement('div');
+    button.className = 'show-more';
+    button.textContent = `展开 ${{remaining}} 条回复`;
+    button.addEventListener('click', async () => {{
+        button.remove();
+        const response = await fetch(`/api/sns/web/v2/comment/sub/page?note_id=${{noteId}}&root_comment_id=${{rootId}}&cursor=${{subCursor}}`);
+        const payload = await response.json();
+        const list = thread.querySelector('.reply-container .list-container');
+        list.insertAdjacentHTML('beforeend', payload.data.comments.map(c => renderComment(c, true)).join(''));
+        renderShowMore(thread, rootId, remaining - payload.data.comments.length, payload.data.cursor);
+    }});
+    thread.querySelector('.reply-container').appendChild(button);
+}}
+async function loadComments() {{
+    if (loading || !hasMore) return;
+    loading = true;
+    const response = await fetch(`/api/sns/web/v2/comment/page?note_id=${{noteId}}&cursor=${{cursor}}`);
+    const payload = await response.json();
+    const list = document.querySelector('.comments-container > .list-container');
+    for (const comment of payload.data.comments) {{
+        const thread = document.createElement('div');
+        thread.className = 'parent-comment';
+        const subs = comment.sub_comments || [];
+        thread.innerHTML = renderComment(comment, false)
+            + `<div class="reply-container"><div class="list-container">${{subs.map(c => renderComment(c, true)).join('')}}</div></div>`;
+        list.appendChild(thread);
+        renderShowMore(thread, comment.id, comment.sub_comment_count - subs.length, comment.sub_comment_cursor);
+    }}
+    cursor = payload.data.cursor;
+    hasMore = payload.data.has_more;
+    if (!hasMore) {{
+        document.querySelector('.comments-container').insertAdjacentHTML('beforeend', '<div class="end-container">- THE END -</div>');
+    }}
+    loading = false;
+}}
+const scroller = document.querySelector('.note-scroller');
+scroller.addEventListener('scroll', () => {{
+    if (scroller.scrollTop + scroller.clientHeight >= scroller.scrollHeight - 200) loadComments();
+}});
+loadComments();
+</script>
+</body></html>
+"""
+
+HOME_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>小红书 - 基准测试替身站点</title></head>
+<body><div class="side-bar"><a href="/explore">发现</a></div></body></html>
+"""
+
+
+def stable_id(*parts: Any) -> str:
+    """由输入确定性地生成 24 位十六进制ID，与网页端笔记ID格式一致"""
+    return hashlib.md5("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:24]
+
+
+class FixtureData:
+    """按笔记ID确定性地生成笔记、评论和搜索结果，同一参数下每次运行的数据完全相同"""
+
+    def __init__(self, notes_per_keyword: int = 200, comments_per_note: int = 60,
+                 max_replies: int = 8, page_size: int = 10, seed: int = 0):
+        self.notes_per_keyword = notes_per_keyword
+        self.comments_per_note = comments_per_note
+        self.max_replies = max_replies
+        self.page_size = page_size
+        self.seed = seed
+
+    def _rng(self, *parts: Any) -> random.Random:
+        return random.Random(stable_id(self.seed, *parts))
+
+    def _sentence(self, rng: random.Random, words: int) -> str:
+        return "".join(rng.choice(VOCABULARY) for _ in range(words))
+
+    def note_ids(self, keyword: str) -> List[str]:
+        return [stable_id(self.seed, "note", keyword, index) for index in range(self.notes_per_keyword)]
+
+    def note(self, note_id: str) -> Dict[str, Any]:
+        rng = self._rng("note", note_id)
+        published = 1700000000000 + rng.randint(0, 3600 * 24 * 365) * 1000
+        return {
+            "noteId": note_id,
+            "title": self._sentence(rng, 4),
+            "desc": "，".join(self._sentence(rng, 6) for _ in range(8)) + " #" + rng.choice(VOCABULARY) + "[话题]#",
+            "time": published,
+            "ipLocation": rng.choice(LOCATIONS),
+            "user": {"userId": stable_id("user", note_id), "nickname": rng.choice(NICKNAMES)},
+            "interactInfo": {
+                "likedCount": str(rng.randint(0, 5000)),
+                "collectedCount": str(rng.randint(0, 2000)),
+                "commentCount": str(self.total_comments(note_id)),
+                "shareCount": str(rng.randint(0, 300))
+            },
+            "imageList": [{"urlDefault": f"/img/{note_id}-{index}.png"} for index in range(3)]
+        }
+
+    def _comment(self, note_id: str, comment_id: str, root_id: Optional[str] = None) -> Dict[str, Any]:
+        rng = self._rng("comment", comment_id)
+        comment = {
+            "id": comment_id,
+            "note_id": note_id,
+            "content": self._sentence(rng, rng.randint(3, 10)),
+            "create_time": 1700000000000 + rng.randint(0, 3600 * 24 * 30) * 1000,
+            "like_count": str(rng.randint(0, 300)),
+            "ip_location": rng.choice(LOCATIONS),
+            "user_info": {"user_id": stable_id("user", comment_id), "nickname": rng.choice(NICKNAMES)}
+        }
+        if root_id:
+            comment["root_comment_id"] = root_id
+        return comment
+
+    def reply_ids(self, note_id: str, root_id: str) -> List[str]:
+        count = self._rng("replies", root_id).randint(0, self.max_replies)
+        return [stable_id(self.seed, "reply", root_id, index) for index in range(count)]
+
+    def comment_page(self, note_id: str, cursor: str) -> Dict[str, Any]:
+        """一级评论分页，与 /api/sns/web/v2/comment/page 的返回结构一致，每条附带第一条回复"""
+        # 评论总数按"一级评论 + 回复"计算，与页面显示的评论数一致
+        roots = self._root_ids(note_id)
+        start = int(cursor or 0)
+        comments = []
+        for root_id in roots[start:start + self.page_size]:
+            replies = self.reply_ids(note_id, root_id)
+            comment = self._comment(note_id, root_id)
+            comment["sub_comment_count"] = len(replies)
+            comment["sub_comments"] = [self._comment(note_id, reply_id, root_id) for reply_id in replies[:1]]
+            comment["sub_comment_cursor"] = "1"
+            comments.append(comment)
+        end = start + len(comments)
+        return {"comments": comments, "cursor": str(end), "has_more": end < len(roots)}
+
+    def sub_comment_page(self, note_id: str, root_id: str, cursor: str) -> Dict[str, Any]:
+        """回复分页，与 /api/sns/web/v2/comment/sub/page 的返回结构一致"""
+        replies = self.reply_ids(note_id, root_id)
+        start = int(cursor or 0)
+        page = replies[start:start + self.page_size]
+        end = start + len(page)
+        return {
+            "comments": [self._comment(note_id, reply_id, root_id) for reply_id in page],
+            "cursor": str(end),
+            "has_more": end < len(replies)
+        }
+
+    def _root_ids(self, note_id: str) -> List[str]:
+        roots = []
+        total = 0
+        index = 0
+        while total < self.comments_per_note:
+            root_id = stable_id(self.seed, "comment", note_id, index)
+            roots.append(root_id)
+            total += 1 + len(self.reply_ids(note_id, root_id))
+            index += 1
+        return roots
+
+    def total_comments(self, note_id: str) -> int:
+        return sum(1 + len(self.reply_ids(note_id, root_id)) for root_id in self._root_ids(note_id))
+
+    def search_page(self, keyword: str, page: int, page_size: int) -> Dict[str, Any]:
+        """搜索分页，与 /api/sns/web/v1/search/notes 的返回结构一致"""
+        ids = self.note_ids(keyword)
+        start = (max(page, 1) - 1) * page_size
+        items = []
+        for note_id in ids[start:start + page_size]:
+            note = self.note(note_id)
+            items.append({
+                "id": note_id,
+                "model_type": "note",
+                "xsec_token": stable_id("token", note_id),
+                "note_card": {
+                    "display_title": note["title"],
+                    "user": {"nickname": note["user"]["nickname"]},
+                    "interact_info": {"liked_count": note["interactInfo"]["likedCount"]}
+                }
+            })
+        return {"items": items, "has_more": start + page_size < len(ids)}
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    server_version = "XhsFixture/1.0"
+
+    @property
+    def data(self) -> FixtureData:
+        return self.server.fixture_data
+
+    def log_message(self, format, *args):
+        # 基准测试时不输出访问日志
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_html(self, text: str):
+        self._send(200, text.encode("utf-8"), "text/html; charset=utf-8")
+
+    def _send_json(self, data: Dict[str, Any]):
+        # 模拟接口的网络延迟
+        if self.server.api_latency > 0:
+            time.sleep(self.server.api_latency)
+        body = json.dumps({"code": 0, "success": True, "msg": "成功", "data": data}, ensure_ascii=False)
+        self._send(200, body.encode("utf-8"), "application/json; charset=utf-8")
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        path = parsed.path
+
+        if path == "/":
+            self._send_html(HOME_PAGE)
+        elif path == "/search_result":
+            keyword = query.get("keyword", "")
+            self._send_html(SEARCH_PAGE.format(
+                keyword=html.escape(keyword),
+                keyword_json=json.dumps(keyword, ensure_ascii=False)
+            ))
+        elif NOTE_PATH_PATTERN.match(path):
+            self._send_html(self._note_page(NOTE_PATH_PATTERN.match(path).group(1)))
+        elif path.startswith("/img/"):
+            self._send(200, PIXEL_PNG, "image/png")
+        elif path == "/api/sns/web/v2/user/me":
+            self._send_json({"guest": False, "user_id": "benchmark", "nickname": "benchmark"})
+        elif path == "/api/sns/web/v2/comment/page":
+            self._send_json(self.data.comment_page(query.get("note_id", ""), query.get("cursor", "")))
+        elif path == "/api/sns/web/v2/comment/sub/page":
+            self._send_json(self.data.sub_comment_page(
+                query.get("note_id", ""), query.get("root_comment_id", ""), query.get("cursor", "")
+            ))
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = {}
+
+        if urlparse(self.path).path == "/api/sns/web/v1/search/notes":
+            self._send_json(self.data.search_page(
+                body.get("keyword", ""), int(body.get("page", 1)), int(body.get("page_size", 20))
+            ))
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def _note_page(self, note_id: str) -> str:
+        note = self.data.note(note_id)
+        state = {"note": {"noteDetailMap": {note_id: {"note": note}}}}
+        return NOTE_PAGE.format(
+            title=html.escape(note["title"]),
+            author=html.escape(note["user"]["nickname"]),
+            desc=html.escape(note["desc"]),
+            date=time.strftime("%m-%d", time.localtime(note["time"] / 1000)),
+            comment_count=self.data.total_comments(note_id),
+            state_json=json.dumps(state, ensure_ascii=False).replace("</", "<\\/"),
+            note_id_json=json.dumps(note_id)
+        )
+
+
+class FixtureServer:
+    """在后台线程中运行的替身站点"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, api_latency: float = 0.0, **data_options):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fixture_data = FixtureData(**data_options)
+        self.httpd.api_latency = api_latency
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def data(self) -> FixtureData:
+        return self.httpd.fixture_data
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FixtureServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动本地小红书替身站点")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--notes-per-keyword", type=int, default=200)
+    parser.add_argument("--comments-per-note", type=int, default=60)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="每个接口请求附加的延迟（秒）")
+    args = parser.parse_args()
+
+    server = FixtureServer(
+        args.host, args.port, api_latency=args.api_latency,
+        notes_per_keyword=args.notes_per_keyword, comments_per_note=args.comments_per_note
+    )
+    print(f"替身站点已启动: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+离线基准测试：在本地替身站点上运行 MCP 工具，统计延迟、浏览器协议调用次数和内存
+
+    python benchmark/run_benchmark.py --iterations 5 --concurrency 2 --output results.json
+    python benchmark/run_benchmark.py --baseline baseline.json --max-regression 0.25
+
+指定 --baseline 时，任一工具的 p95 延迟或平均协议调用次数比基线高出 --max-regression 以上，
+进程以非零状态退出，可直接用于 CI。
+"""
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fixture_server import FixtureServer  # noqa: E402
+
+TOOLS = ["search_notes", "get_note_content", "get_note_comments", "analyze_note"]
+
+
+class ProtocolCallCounter:
+    """统计 Playwright 发往浏览器的协议调用次数
+
+    每次 page.goto、page.evaluate、locator 操作等都是一次往返，
+    通过包装 Playwright 内部的 Channel 发送方法计数，各版本方法名不同时依次尝试。
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.by_method: Dict[str, int] = {}
+        self._original = None
+        self._target = None
+
+    def install(self) -> bool:
+        from playwright._impl import _connection
+
+        for name in ("_inner_send", "inner_send", "send"):
+            original = getattr(_connection.Channel, name, None)
+            if original is not None:
+                break
+        else:
+            return False
+
+        counter = self
+
+        async def counting_send(channel, method, *args, **kwargs):
+            counter.total += 1
+            counter.by_method[method] = counter.by_method.get(method, 0) + 1
+            return await original(channel, method, *args, **kwargs)
+
+        self._original = original
+        self._target = name
+        setattr(_connection.Channel, name, counting_send)
+        return True
+
+    def uninstall(self):
+        if self._original is not None:
+            from playwright._impl import _connection
+            setattr(_connection.Channel, self._target, self._original)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """线性插值的百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def memory_snapshot() -> Dict[str, Optional[float]]:
+    """当前进程和浏览器子进程的内存占用（MB），没有 psutil 时只统计本进程峰值"""
+    snapshot: Dict[str, Optional[float]] = {"python_peak_mb": None, "browser_rss_mb": None}
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 下单位为 KB，macOS 下为字节
+        snapshot["python_peak_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    if psutil is not None:
+        children = psutil.Process().children(recursive=True)
+        rss = 0
+        for child in children:
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                continue
+        snapshot["browser_rss_mb"] = round(rss / (1024 * 1024), 1)
+    return snapshot
+
+
+def tool_function(xhs, name: str) -> Callable:
+    """取出被 @mcp.tool() 装饰的原始函数，兼容装饰器返回工具对象的 FastMCP 版本"""
+    tool = getattr(xhs, name)
+    return getattr(tool, "fn", tool)
+
+
+def is_error(result: Any) -> bool:
+    if isinstance(result, dict):
+        return "error" in result
+    return isinstance(result, str) and ("出错" in result or result.startswith("请先登录"))
+
+
+async def run_tool(xhs, counter: ProtocolCallCounter, name: str, targets: List[Dict[str, Any]],
+                   iterations: int, concurrency: int) -> Dict[str, Any]:
+    """以固定并发执行若干轮同一工具，每轮的调用参数按顺序从 targets 中取"""
+    func = tool_function(xhs, name)
+    latencies: List[float] = []
+    errors = 0
+    calls_before = counter.total
+    tracemalloc.reset_peak()
+
+    async def timed_call(kwargs: Dict[str, Any]):
+        nonlocal errors
+        started = time.perf_counter()
+        result = await func(**kwargs)
+        latencies.append(time.perf_counter() - started)
+        if is_error(result):
+            errors += 1
+            print(f"  {name} 调用失败: {str(result)[:200]}")
+
+    index = 0
+    for _ in range(iterations):
+        batch = []
+        for _ in range(concurrency):
+            batch.append(targets[index % len(targets)])
+            index += 1
+        await asyncio.gather(*(timed_call(kwargs) for kwargs in batch))
+
+    calls = counter.total - calls_before
+    _, traced_peak = tracemalloc.get_traced_memory()
+    return {
+        "calls": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+        "protocol_calls_per_call": round(calls / len(latencies), 1) if latencies else 0.0,
+        "python_alloc_peak_mb": round(traced_peak / (1024 * 1024), 1),
+        **memory_snapshot()
+    }
+
+
+def build_targets(server: FixtureServer, keyword: str, count: int, search_limit: int) -> Dict[str, List[Dict[str, Any]]]:
+    urls = [f"{server.url}/explore/{note_id}" for note_id in server.data.note_ids(keyword)[:count]]
+    return {
+        "search_notes": [{"keywords": keyword, "limit": search_limit}],
+        "get_note_content": [{"url": url, "refresh": True} for url in urls],
+        "get_note_comments": [{"url": url, "refresh": True} for url in urls],
+        "analyze_note": [{"url": url, "refresh": True} for url in urls],
+    }
+
+
+def compare_with_baseline(results: Dict[str, Dict[str, Any]], baseline_path: str, max_regression: float) -> List[str]:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric in ("p95_ms", "protocol_calls_per_call"):
+            if previous.get(metric) and current[metric] > previous[metric] * (1 + max_regression):
+                regressions.append(f"{name} {metric}: {previous[metric]} -> {current[metric]}")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, Any]]):
+    header = f"{'工具':<20}{'次数':>6}{'失败':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'协议调用/次':>12}{'浏览器RSS(MB)':>16}"
+    print(header)
+    print("-" * len(header))
+    for name, row in results.items():
+        browser_rss = row["browser_rss_mb"] if row["browser_rss_mb"] is not None else "-"
+        print(f"{name:<20}{row['calls']:>6}{row['errors']:>6}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+              f"{row['protocol_calls_per_call']:>12}{browser_rss:>16}")
+
+
+async def run(args) -> Dict[str, Any]:
+    import xiaohongshu_mcp as xhs
+
+    counter = ProtocolCallCounter()
+    if not counter.install():
+        print("警告: 当前 Playwright 版本不支持统计协议调用次数")
+
+    # 替身站点不走扫码登录，直接写入登录 Cookie
+    await xhs.ensure_browser()
+    await xhs.browser_context.add_cookies([
+        {"name": xhs.LOGIN_COOKIE_NAME, "value": "benchmark", "url": xhs.BASE_URL}
+    ])
+    xhs.is_logged_in = False
+    if not await xhs.ensure_browser():
+        raise RuntimeError("替身站点登录状态校验失败")
+
+    targets = build_targets(args.server, args.keyword, max(args.iterations * args.concurrency, 1), args.search_limit)
+    results: Dict[str, Dict[str, Any]] = {}
+    tracemalloc.start()
+    try:
+        for name in args.tools:
+            print(f"运行 {name} ...")
+            # 预热一次，不计入统计
+            await tool_function(xhs, name)(**targets[name][0])
+            results[name] = await run_tool(xhs, counter, name, targets[name], args.iterations, args.concurrency)
+    finally:
+        tracemalloc.stop()
+        counter.uninstall()
+        await xhs.browser_context.close()
+        await xhs.playwright_instance.stop()
+
+    return {
+        "config": {
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "page_pool_size": xhs.PAGE_POOL_SIZE,
+            "comments_per_note": args.comments_per_note,
+            "api_latency": args.api_latency,
+            "lean_mode": xhs.LEAN_MODE,
+            "capture_api": xhs.CAPTURE_API,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地替身站点上运行 MCP 工具的基准测试")
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=TOOLS)
+    parser.add_argument("--iterations", type=int, default=5, help="每个工具执行的轮数")
+    parser.add_argument("--concurrency", type=int, default=1, help="每轮并发调用数")
+    parser.add_argument("--keyword", default="旅行")
+    parser.add_argument("--search-limit", type=int, default=40)
+    parser.add_argument("--comments-per-note", type=int, default=60)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="替身站点每个接口请求附加的延迟（秒）")
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    parser.add_argument("--baseline", help="用于对比的基线结果 JSON 文件")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="允许的最大退化比例")
+    args = parser.parse_args()
+
+    server = FixtureServer(api_latency=args.api_latency, comments_per_note=args.comments_per_note).start()
+    args.server = server
+
+    # 必须在导入 xiaohongshu_mcp 之前设置，使用临时目录避免影响真实的登录状态和缓存
+    workdir = tempfile.mkdtemp(prefix="xhs-benchmark-")
+    os.environ.update({
+        "XHS_BASE_URL": server.url,
+        "XHS_API_BASE_URL": server.url,
+        "XHS_HEADLESS": "1",
+        "XHS_BROWSER_DATA_DIR": os.path.join(workdir, "browser_data"),
+        "XHS_DATA_DIR": os.path.join(workdir, "data"),
+    })
+    os.environ.setdefault("XHS_CACHE_TTL", "0")
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        server.stop()
+
+    print()
+    print_table(report["results"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(report["results"], args.baseline, args.max_regression)
+        if regressions:
+            print("\n性能退化超过阈值:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n未发现超过阈值的性能退化")
+
+
+if __name__ == "__main__":
+    main()
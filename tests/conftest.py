@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# 必须在导入 xiaohongshu_mcp 之前设置，避免测试读写项目下的登录状态和数据目录
+_workdir = tempfile.mkdtemp(prefix="xhs-test-")
+os.environ["XHS_BROWSER_DATA_DIR"] = os.path.join(_workdir, "browser_data")
+os.environ["XHS_DATA_DIR"] = os.path.join(_workdir, "data")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
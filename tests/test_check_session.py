@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import xiaohongshu_mcp as xhs
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def json(self):
+        if isinstance(self.payload, Exception):
+            raise self.payload
+        return self.payload
+
+
+class FakeRequest:
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def get(self, url, timeout=None):
+        return FakeResponse(self.payload)
+
+
+class FakePage:
+    def __init__(self, context):
+        self.context = context
+
+    async def goto(self, url, **kwargs):
+        self.context.page_checks += 1
+
+    async def wait_for_selector(self, selector, timeout=None):
+        if not self.context.shows_login_button:
+            raise xhs.PlaywrightTimeoutError("timeout")
+
+    async def close(self):
+        pass
+
+
+class FakeContext:
+    def __init__(self, payload, session="s1", shows_login_button=True):
+        self.request = FakeRequest(payload)
+        self.session = session
+        self.shows_login_button = shows_login_button
+        self.page_checks = 0
+
+    async def cookies(self, url):
+        return [{"name": xhs.LOGIN_COOKIE_NAME, "value": self.session, "expires": time.time() + 3600}]
+
+    async def new_page(self):
+        return FakePage(self)
+
+
+def check(monkeypatch, context):
+    monkeypatch.setattr(xhs, "browser_context", context)
+    return asyncio.run(xhs.check_session())
+
+
+def test_probe_decides_when_conclusive(monkeypatch):
+    monkeypatch.setattr(xhs, "_dom_session_check", None)
+    assert check(monkeypatch, FakeContext({"success": True, "data": {"guest": True}})) is False
+    assert check(monkeypatch, FakeContext({"success": True, "data": {"user_id": "1"}})) is True
+
+
+def test_inconclusive_probe_falls_back_to_page_check_once_per_cookie(monkeypatch):
+    monkeypatch.setattr(xhs, "_dom_session_check", None)
+    guest = FakeContext({"success": False, "data": {}})
+    assert check(monkeypatch, guest) is False
+    assert check(monkeypatch, guest) is False
+    assert guest.page_checks == 1
+
+    user = FakeContext(ValueError("not json"), session="s2", shows_login_button=False)
+    assert check(monkeypatch, user) is True
+    assert user.page_checks == 1
@@ -0,0 +1,39 @@
+import json
+
+import xiaohongshu_mcp as xhs
+
+
+def test_ascii_terms_match_whole_words_only():
+    classifier = xhs.DomainClassifier(xhs.DEFAULT_DOMAIN_KEYWORDS)
+
+    assert classifier.classify("He said the email and Mail arrive daily. Training") == (["生活"], [])
+    assert classifier.classify("AI, GPT-4 和 Claude") == (["AI"], ["AI", "GPT", "Claude"])
+    assert classifier.classify("用AI绘画") == (["AI"], ["AI"])
+
+
+def test_domains_are_ranked_by_match_count():
+    classifier = xhs.DomainClassifier(xhs.DEFAULT_DOMAIN_KEYWORDS)
+
+    domains, terms = classifier.classify("周末旅行攻略：酒店推荐，顺便买了口红")
+    assert domains == ["旅行", "美妆"]
+    assert terms == ["旅行", "攻略", "酒店", "口红"]
+
+
+def test_load_merges_config_file_with_builtin_terms(tmp_path):
+    path = tmp_path / "domain_terms.json"
+    path.write_text(json.dumps({"AI": ["LLM"], "宠物": ["猫咪", "Cat"]}, ensure_ascii=False), encoding="utf-8")
+    classifier = xhs.DomainClassifier.load(str(path))
+
+    assert classifier.classify("LLM 入门")[0] == ["AI"]
+    assert classifier.classify("我家猫咪 cat")[0] == ["宠物"]
+    assert classifier.classify("Category")[0] == ["生活"]
+    assert classifier.classify("口红")[0] == ["美妆"]
+
+
+def test_load_falls_back_to_builtin_terms_on_invalid_file(tmp_path):
+    path = tmp_path / "domain_terms.json"
+    path.write_text("{not json", encoding="utf-8")
+    classifier = xhs.DomainClassifier.load(str(path))
+
+    assert classifier.domains == list(xhs.DEFAULT_DOMAIN_KEYWORDS)
+    assert classifier.classify("口红")[0] == ["美妆"]
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+def add_note(writer, note_id):
+    writer.add(note_id, {"note_id": note_id, "title": f"标题{note_id}"},
+               [{"note_id": note_id, "comment_id": f"{note_id}-c"}])
+
+
+def crash():
+    raise OSError("crash")
+
+
+def test_resume_after_crash_before_checkpoint_does_not_duplicate_rows(tmp_path, monkeypatch):
+    directory = str(tmp_path / "export")
+    writer = xhs.ExportWriter(directory, "csv")
+    add_note(writer, "n1")
+    writer.flush()
+
+    add_note(writer, "n2")
+    monkeypatch.setattr(writer, "_save_checkpoint", crash)
+    with pytest.raises(OSError):
+        writer.flush()
+
+    resumed = xhs.ExportWriter(directory, "csv")
+    assert resumed.completed == {"n1"}
+    add_note(resumed, "n2")
+    resumed.flush()
+
+    assert list(pd.read_csv(tmp_path / "export" / "notes.csv")["note_id"]) == ["n1", "n2"]
+    assert list(pd.read_csv(tmp_path / "export" / "comments.csv")["comment_id"]) == ["n1-c", "n2-c"]
+
+
+def test_crash_during_first_chunk_restarts_files_with_header(tmp_path, monkeypatch):
+    directory = str(tmp_path / "export")
+    writer = xhs.ExportWriter(directory, "csv")
+    add_note(writer, "n1")
+    monkeypatch.setattr(writer, "_save_checkpoint", crash)
+    with pytest.raises(OSError):
+        writer.flush()
+
+    resumed = xhs.ExportWriter(directory, "csv")
+    assert resumed.completed == set()
+    add_note(resumed, "n1")
+    resumed.flush()
+
+    assert list(pd.read_csv(tmp_path / "export" / "notes.csv")["note_id"]) == ["n1"]
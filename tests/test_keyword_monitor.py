@@ -0,0 +1,35 @@
+import json
+import os
+
+import xiaohongshu_mcp as xhs
+
+
+def test_keyword_slug_keeps_similar_keywords_apart():
+    assert xhs.keyword_slug("a b") != xhs.keyword_slug("a_b")
+    assert xhs.keyword_slug("a b").startswith("a_b_")
+    assert xhs.keyword_slug("咖啡 探店") == xhs.keyword_slug("咖啡 探店")
+
+
+def test_reads_do_not_create_directories(tmp_path):
+    monitor = xhs.KeywordMonitor(str(tmp_path))
+    checkpoint_path, notes_path = monitor.paths("露营")
+
+    assert monitor.load_checkpoint("露营")["runs"] == 0
+    assert not os.path.exists(os.path.dirname(checkpoint_path))
+    assert os.listdir(tmp_path) == []
+
+
+def test_legacy_directory_is_migrated_for_its_only_keyword(tmp_path):
+    (tmp_path / "monitors.json").write_text(json.dumps({
+        "露营 装备": {"interval_minutes": 60, "limit": 20, "fetch_content": False},
+        "a b": {"interval_minutes": 60, "limit": 20, "fetch_content": False},
+        "a_b": {"interval_minutes": 60, "limit": 20, "fetch_content": False},
+    }), encoding="utf-8")
+    (tmp_path / "露营_装备").mkdir()
+    (tmp_path / "露营_装备" / "checkpoint.json").write_text(json.dumps({"runs": 3}), encoding="utf-8")
+    (tmp_path / "a_b").mkdir()
+
+    monitor = xhs.KeywordMonitor(str(tmp_path))
+
+    assert monitor.load_checkpoint("露营 装备")["runs"] == 3
+    assert (tmp_path / "a_b").is_dir()
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+def run_concurrent(scheduler, callers):
+    async def timed_acquire():
+        started = time.monotonic()
+        try:
+            await scheduler.acquire()
+        except xhs.ThrottledError:
+            return None
+        return time.monotonic() - started
+
+    async def main():
+        return await asyncio.gather(*(timed_acquire() for _ in range(callers)))
+
+    return asyncio.run(main())
+
+
+def test_burst_beyond_max_wait_is_rejected():
+    scheduler = xhs.NavigationScheduler(rate=10, burst=1, backoff_base=1, backoff_max=1, max_wait=0.25)
+    waits = run_concurrent(scheduler, 7)
+
+    accepted = [wait for wait in waits if wait is not None]
+    assert len(accepted) == 3
+    assert scheduler.rejected == 4
+    # 排在后面的调用的等待时间不超过 max_wait
+    assert max(accepted) < 0.25 + 0.1
+
+
+def test_callers_are_spaced_by_rate():
+    scheduler = xhs.NavigationScheduler(rate=20, burst=2, backoff_base=1, backoff_max=1, max_wait=5)
+    waits = sorted(run_concurrent(scheduler, 6))
+
+    assert waits[0] < 0.05 and waits[1] < 0.05
+    # 突发额度用完后每 1/rate 秒放行一个
+    assert waits[-1] == pytest.approx(4 / 20, abs=0.05)
+
+
+def test_backoff_rejects_immediately_when_longer_than_max_wait():
+    scheduler = xhs.NavigationScheduler(rate=10, burst=3, backoff_base=5, backoff_max=10, max_wait=1)
+    scheduler.penalize("HTTP 461", "https://example.com")
+
+    started = time.monotonic()
+    waits = run_concurrent(scheduler, 3)
+    assert waits == [None, None, None]
+    assert time.monotonic() - started < 0.1
+
+
+def test_unlimited_rate_only_waits_for_backoff():
+    scheduler = xhs.NavigationScheduler(rate=0, burst=1, backoff_base=0.1, backoff_max=1, max_wait=1)
+    assert max(run_concurrent(scheduler, 5)) < 0.05
+
+    scheduler.penalize("captcha", "https://example.com")
+    waits = run_concurrent(scheduler, 2)
+    assert all(wait == pytest.approx(0.1, abs=0.05) for wait in waits)
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import xiaohongshu_mcp as xhs
+
+
+def test_callers_share_one_fetch_and_apply_their_own_deadline():
+    calls = []
+
+    async def factory(progress, deadline):
+        calls.append(deadline())
+        for i in range(4):
+            progress[str(i)] = i
+            await asyncio.sleep(0.05)
+        return list(progress.values()), True
+
+    async def main():
+        flight = xhs.SingleFlight()
+
+        def fetch(timeout):
+            deadline = time.monotonic() + timeout if timeout else None
+            return flight.do(("comments", "n1"), factory, deadline,
+                             lambda progress: (list(progress.values()), False))
+
+        return await asyncio.gather(fetch(0.08), fetch(None))
+
+    early, full = asyncio.run(main())
+    assert len(calls) == 1 and calls[0] is not None
+    assert early[1] is False and 0 < len(early[0]) < 4
+    assert full == ([0, 1, 2, 3], True)
+
+
+def test_fetch_sees_the_latest_deadline_and_stops_after_every_caller_times_out():
+    observed = []
+
+    async def factory(progress, deadline):
+        while deadline() is None or time.monotonic() < deadline():
+            observed.append(deadline())
+            progress[str(len(progress))] = len(progress)
+            await asyncio.sleep(0.02)
+        return list(progress.values())
+
+    async def main():
+        flight = xhs.SingleFlight()
+        started = time.monotonic()
+        results = await asyncio.gather(*(
+            flight.do(("search",), factory, started + timeout, lambda progress: list(progress.values()))
+            for timeout in (0.05, 0.15)
+        ))
+        task = flight._inflight[("search",)]["task"] if ("search",) in flight._inflight else None
+        if task is not None:
+            await task
+        return started, results, task
+
+    started, (first, second), task = asyncio.run(main())
+    assert observed[0] == started + 0.15
+    assert len(first) < len(second)
+    assert task is None or not task.cancelled()
+
+
+def test_cancelled_fetch_saves_partial_result_for_every_waiting_client(monkeypatch):
+    monkeypatch.setattr(xhs, "partial_results", xhs.OrderedDict())
+
+    async def factory(progress, deadline):
+        progress["a"] = {"title": "a"}
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            xhs.save_partial_result("search_notes", "咖啡", list(progress.values()))
+            raise
+
+    async def call(flight, client):
+        xhs._current_client.set(client)
+        return await flight.do(("search",), factory)
+
+    async def main():
+        flight = xhs.SingleFlight()
+        callers = [asyncio.ensure_future(call(flight, client)) for client in ("client-a", "client-b")]
+        await asyncio.sleep(0.05)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert set(xhs.partial_results) == {("client-a", "search_notes", "咖啡"), ("client-b", "search_notes", "咖啡")}
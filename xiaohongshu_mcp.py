@@ -1,44 +1,1496 @@
-from typing import Any, List, Dict, Optional
+from typing import Any, List, Dict, Optional, Tuple
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field, fields, asdict, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import argparse
 import asyncio
+import functools
+import hashlib
 import json
+import multiprocessing
 import os
+import re
+import schedule
+import sqlite3
+import sys
+import threading
+import time
 import pandas as pd
-from datetime import datetime
-from playwright.async_api import async_playwright
-from fastmcp import FastMCP
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+from fastmcp import FastMCP, Context
+from fastmcp.exceptions import ToolError
+from fastmcp.server.middleware import Middleware
 
 # 初始化 FastMCP 服务器
 mcp = FastMCP("xiaohongshu_scraper")
 
 # 全局变量
-BROWSER_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_data")
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BROWSER_DATA_DIR = os.environ.get(
+    "XHS_BROWSER_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_data")
+)
+DATA_DIR = os.environ.get("XHS_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
 TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 
+# 网页端和接口的根地址，可指向本地的替身站点（如 benchmark/fixture_server.py）进行离线测试
+BASE_URL = os.environ.get("XHS_BASE_URL", "https://www.xiaohongshu.com").rstrip("/")
+API_BASE_URL = os.environ.get("XHS_API_BASE_URL", "https://edith.xiaohongshu.com").rstrip("/")
+
+# 页面池大小，即只读工具可并行执行的最大数量
+PAGE_POOL_SIZE = max(1, int(os.environ.get("XHS_PAGE_POOL_SIZE", "3")))
+
+# 服务模式：stdio（默认，每个客户端各自启动一个进程），或 http / sse（一个常驻服务和浏览器供多个客户端共享）
+TRANSPORT = os.environ.get("XHS_TRANSPORT", "stdio")
+SERVER_HOST = os.environ.get("XHS_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("XHS_PORT", "8000"))
+SERVER_PATH = os.environ.get("XHS_PATH") or None
+
+# 同时执行的工具调用上限，超出的调用排队等待，排队超过 CALL_QUEUE_TIMEOUT 秒返回服务器繁忙
+MAX_CONCURRENT_CALLS = max(1, int(os.environ.get("XHS_MAX_CONCURRENT_CALLS", str(PAGE_POOL_SIZE * 2))))
+CALL_QUEUE_TIMEOUT = float(os.environ.get("XHS_CALL_QUEUE_TIMEOUT", "60"))
+
+# 调试模式：每次调用都保存调试快照，默认关闭以免拖慢正常调用
+DEBUG_MODE = os.environ.get("XHS_DEBUG", "").lower() in ("1", "true", "yes")
+
+# 调试快照：提取失败或回退时保存页面 HTML、截图和选择器命中记录，设为 0 关闭
+DEBUG_SNAPSHOTS = os.environ.get("XHS_DEBUG_SNAPSHOTS", "1").lower() not in ("0", "false", "no")
+DEBUG_SNAPSHOT_DIR = os.path.join(DATA_DIR, "debug_snapshots")
+# 快照目录的总大小上限（MB），超出时删除最旧的快照
+DEBUG_SNAPSHOT_MAX_MB = float(os.environ.get("XHS_DEBUG_SNAPSHOT_MAX_MB", "50"))
+# 同一工具的同一种失败在多少秒内只保存一次，避免布局变化后每次调用都写快照
+DEBUG_SNAPSHOT_INTERVAL = float(os.environ.get("XHS_DEBUG_SNAPSHOT_INTERVAL", "300"))
+
+# 搜索结果最多滚动的轮数，以及连续多少轮没有新结果时认为结果流已到底
+SEARCH_MAX_SCROLL_ROUNDS = int(os.environ.get("XHS_SEARCH_MAX_SCROLL_ROUNDS", "50"))
+SEARCH_MAX_IDLE_ROUNDS = 3
+
+# 登录状态校验：登录 Cookie 名、轻量探测接口，以及已登录状态的重新校验间隔（秒）
+LOGIN_COOKIE_NAME = os.environ.get("XHS_LOGIN_COOKIE", "web_session")
+SESSION_PROBE_URL = f"{API_BASE_URL}/api/sns/web/v2/user/me"
+SESSION_REVALIDATE_SECONDS = float(os.environ.get("XHS_SESSION_REVALIDATE", "300"))
+
+# 页面导航限速：令牌桶每秒补充 XHS_NAV_RATE 个令牌（0 表示不限速），最多积累 XHS_NAV_BURST 个
+NAV_RATE = float(os.environ.get("XHS_NAV_RATE", "1"))
+NAV_BURST = max(1, int(os.environ.get("XHS_NAV_BURST", "3")))
+# 遇到限流或验证码页面后暂停导航，退避时长从 NAV_BACKOFF_BASE 秒开始翻倍，最长 NAV_BACKOFF_MAX 秒；
+# 需要等待超过 NAV_MAX_WAIT 秒时直接返回错误
+NAV_BACKOFF_BASE = float(os.environ.get("XHS_NAV_BACKOFF_BASE", "30"))
+NAV_BACKOFF_MAX = float(os.environ.get("XHS_NAV_BACKOFF_MAX", "600"))
+NAV_MAX_WAIT = float(os.environ.get("XHS_NAV_MAX_WAIT", "60"))
+# 被限流时网页端返回的状态码，以及跳转到的验证码、风控页面地址
+THROTTLE_STATUS_CODES = {429, 461, 471}
+THROTTLE_URL_PATTERN = re.compile(r"/website-login/(?:captcha|error)|captcha|verifyType=", re.IGNORECASE)
+
+# 多进程抓取：大于 0 时搜索、笔记内容和评论交给这么多个工作进程执行，每个进程使用自己的浏览器，
+# 登录状态由主进程导出到 STORAGE_STATE_PATH 后共享，只需登录一次
+WORKER_PROCESSES = max(0, int(os.environ.get("XHS_WORKERS", "0")))
+STORAGE_STATE_PATH = os.path.join(DATA_DIR, "storage_state.json")
+
+# 精简抓取模式：无头启动，只读页面屏蔽图片、视频、字体和统计请求，登录时仍使用有界面浏览器
+LEAN_MODE = os.environ.get("XHS_LEAN_MODE", "").lower() in ("1", "true", "yes")
+
+# 无头模式：不开启精简模式时同样以无头方式启动浏览器，用于基准测试和 CI，登录时仍使用有界面浏览器
+HEADLESS = os.environ.get("XHS_HEADLESS", "").lower() in ("1", "true", "yes")
+
+# 精简模式下只读页面屏蔽的资源类型和请求地址关键字
+LEAN_BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+LEAN_BLOCKED_URL_KEYWORDS = [
+    "apm-fe.xiaohongshu.com",
+    "t2.xiaohongshu.com",
+    "spltapi.xiaohongshu.com",
+    "/api/sns/web/v1/trace",
+    "google-analytics.com",
+    "hm.baidu.com"
+]
+
+# 笔记和评论缓存：过期时间（秒，设为 0 关闭缓存）和最大条目数
+CACHE_PATH = os.path.join(DATA_DIR, "cache.sqlite3")
+CACHE_TTL = float(os.environ.get("XHS_CACHE_TTL", "3600"))
+CACHE_MAX_ENTRIES = int(os.environ.get("XHS_CACHE_MAX_ENTRIES", "2000"))
+
+# 每篇笔记已抓取的评论线程和游标（最新评论的ID和时间），用于增量获取评论，不受缓存有效期影响
+COMMENT_THREAD_DIR = os.path.join(DATA_DIR, "comment_threads")
+
+# 评论区显示的相对时间，如 "5分钟前"、"3天前"、"昨天 12:30"
+RELATIVE_TIME_PATTERN = re.compile(r"(\d+)\s*(秒|分钟|小时|天|周)前")
+RELATIVE_TIME_UNITS = {"秒": "seconds", "分钟": "minutes", "小时": "hours", "天": "days", "周": "weeks"}
+DAY_WORD_OFFSETS = {"今天": 0, "昨天": 1, "前天": 2}
+CLOCK_PATTERN = re.compile(r"(\d{1,2}):(\d{2})")
+DATE_PATTERN = re.compile(r"(?:(\d{4})[-./年])?(\d{1,2})[-./月](\d{1,2})日?")
+
+# 提取策略命中统计的保存位置，以及连续失败多少次的策略视为失效
+SELECTOR_STATS_PATH = os.path.join(DATA_DIR, "selector_stats.json")
+SELECTOR_DYING_MISSES = 10
+
+# 是否捕获网页端的接口 JSON 并优先基于其生成结果
+CAPTURE_API = os.environ.get("XHS_CAPTURE_API", "").lower() in ("1", "true", "yes")
+
+# 需要捕获的接口路径
+API_CAPTURE_PATTERNS = {
+    "feed": "/api/sns/web/v1/feed",
+    "comments": "/api/sns/web/v2/comment/page",
+    "sub_comments": "/api/sns/web/v2/comment/sub/page",
+    "search": "/api/sns/web/v1/search/notes"
+}
+
+# 笔记链接中的笔记ID，如 /explore/<id>、/search_result/<id>、/discovery/item/<id>
+NOTE_ID_PATTERN = re.compile(r"/(?:explore|search_result|discovery/item)/([0-9a-zA-Z]{24})")
+
+# 批量获取笔记时的默认并发数，实际并发同时受页面池大小限制
+BATCH_CONCURRENCY = max(1, int(os.environ.get("XHS_BATCH_CONCURRENCY", str(PAGE_POOL_SIZE))))
+
+# 关键词导出目录，以及每累计多少篇笔记写出一次
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+
+# 关键词监控的数据目录、调度器检查间隔（秒），以及每个关键词记住的已见笔记ID数量
+MONITOR_DIR = os.path.join(DATA_DIR, "monitors")
+MONITOR_TICK_SECONDS = 30
+MONITOR_SEEN_MAX = 5000
+EXPORT_CHUNK_SIZE = max(1, int(os.environ.get("XHS_EXPORT_CHUNK_SIZE", "10")))
+
+# 领域词表配置文件，JSON 格式为 {"领域": ["词1", "词2", ...]}，其中的词会追加到内置词表
+DOMAIN_TERMS_PATH = os.environ.get("XHS_DOMAIN_TERMS", os.path.join(DATA_DIR, "domain_terms.json"))
+
+# 评论元素选择器，按优先级排列
+COMMENT_SELECTORS = [
+    "div.comment-item",
+    "div.commentItem",
+    "div.comment-content",
+    "div.comment-wrapper",
+    "section.comment",
+    "div.feed-comment"
+]
+
+# 完整抓取评论时的评论数量上限和时间上限（秒），避免爆款笔记无限加载
+COMMENT_CRAWL_MAX_COMMENTS = int(os.environ.get("XHS_COMMENT_CRAWL_MAX_COMMENTS", "2000"))
+COMMENT_CRAWL_MAX_SECONDS = float(os.environ.get("XHS_COMMENT_CRAWL_MAX_SECONDS", "300"))
+# 连续多少轮没有新增评论后停止，以及每轮最多点击多少个"展开回复"按钮
+COMMENT_CRAWL_MAX_IDLE_ROUNDS = 3
+COMMENT_EXPAND_BATCH_SIZE = 20
+
+# 各工具判定页面就绪所等待的元素
+READY_SELECTORS = {
+    "search_notes": "section.note-item",
+    "get_note_content": "#detail-desc, #detail-title",
+    "get_note_comments": ".comments-container, .comment-list, .comment-item, .no-comments",
+    "post_comment": 'div[contenteditable="true"], .comments-container, div.comment-container, .engage-bar',
+}
+
+# 各工具等待页面就绪的最长时间（秒），可通过 XHS_READY_TIMEOUT_<工具名> 覆盖
+READY_TIMEOUTS = {
+    tool: float(os.environ.get(f"XHS_READY_TIMEOUT_{tool.upper()}", "15"))
+    for tool in READY_SELECTORS
+}
+
 # 确保目录存在
 os.makedirs(BROWSER_DATA_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # 用于存储浏览器上下文，以便在不同方法之间共享
+playwright_instance = None
 browser_context = None
-main_page = None
+browser_headless = False
+main_page = None  # 仅用于登录和登录状态检查
+page_pool = None
+api_capture = None
 is_logged_in = False
+session_checked_at = 0.0
+_dom_session_check = None  # 探测接口不可用时页面检查的结果，(登录 Cookie 值, 是否已登录)
+_browser_lock = None
+worker_storage_state = None  # 工作进程中为主进程导出的登录状态文件，主进程中为 None
+_worker_loop = None
+
+# 被取消的长时任务已收集到的部分结果，键为 (客户端会话, 工具名, 目标)
+partial_results: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+PARTIAL_RESULTS_MAX = 50
+PARTIAL_RESULT_NOTICE = "（已达到时间上限，以下为部分结果）\n\n"
+TIMED_OUT_EMPTY_NOTICE = "已达到时间上限，尚未获取到任何{}，请增大 deadline_seconds 后重试"
+
+# 耗时指标：每个工具和阶段保留最近多少次耗时用于计算分位数，以及 Prometheus 格式指标的监听端口（0 表示不开启）
+METRICS_WINDOW = 1000
+METRICS_PORT = int(os.environ.get("XHS_METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("XHS_METRICS_HOST", "127.0.0.1")
+
+
+class LoginRequiredError(Exception):
+    """需要先登录小红书账号"""
+
+
+class ThrottledError(Exception):
+    """平台限流或要求验证，需要稍后重试"""
+
+
+def debug_log(message: str):
+    """每次调用都会产生的诊断信息，仅在调试模式下输出到 stderr
+
+    stdio 模式下 stdout 是 JSON-RPC 通道，这类日志不能写到 stdout；相应的耗时和命中情况
+    已分别记录在 metrics 和 selector_registry 中。
+    """
+    if DEBUG_MODE:
+        print(message, file=sys.stderr, flush=True)
+
+
+class ProgressReporter:
+    """向 MCP 客户端发送进度通知，没有请求上下文（如内部调用）时不做任何事"""
+
+    def __init__(self, ctx: Optional[Context] = None):
+        self.ctx = ctx
+
+    async def report(self, progress: float, total: Optional[float] = None, message: Optional[str] = None):
+        if self.ctx is None:
+            return
+        try:
+            try:
+                await self.ctx.report_progress(progress, total, message)
+            except TypeError:
+                # 旧版本的 report_progress 不支持 message 参数
+                await self.ctx.report_progress(progress, total)
+        except Exception as e:
+            print(f"发送进度通知失败: {str(e)}")
+
+
+class ToolSpan:
+    """一次工具调用的耗时记录，调用期间各阶段的耗时和计数器都挂在它上面"""
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.error: Optional[str] = None
+
+
+# 当前正在执行的工具调用，内部函数据此把阶段耗时记到对应工具上
+_current_span: ContextVar[Optional[ToolSpan]] = ContextVar("xhs_current_span", default=None)
 
-async def ensure_browser():
-    """确保浏览器已启动并登录"""
-    global browser_context, main_page, is_logged_in
+
+class Metrics:
+    """按工具和阶段汇总耗时与计数器
+
+    工具函数用 instrument 装饰，调用内部用 phase() 标记浏览器获取、登录检查、导航、等待、
+    滚动、提取、格式化等阶段，用 count() 记录选择器回退、浏览器协议调用等次数。
+    不在工具调用内发生的阶段记在 "internal" 下。
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self._lock = threading.Lock()
+        self.tools: Dict[str, Dict[str, Any]] = {}
+        self.phases: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.counters: Dict[Tuple[str, str], int] = {}
+        self.recent: deque = deque(maxlen=50)
+
+    def _observe(self, table: dict, key, seconds: float, error: bool = False):
+        with self._lock:
+            series = table.get(key)
+            if series is None:
+                series = table[key] = {"count": 0, "errors": 0, "sum": 0.0, "durations": deque(maxlen=self.window)}
+            series["count"] += 1
+            series["errors"] += int(error)
+            series["sum"] += seconds
+            series["durations"].append(seconds)
+
+    def instrument(self, func):
+        """工具函数装饰器，为每次调用创建一个 ToolSpan"""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            span = ToolSpan(func.__name__)
+            token = _current_span.set(span)
+            try:
+                return await func(*args, **kwargs)
+            except BaseException as e:
+                span.error = span.error or type(e).__name__
+                raise
+            finally:
+                _current_span.reset(token)
+                self.finish(span)
+        return wrapper
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录一个阶段的耗时，阶段内抛出异常时该次工具调用记为失败"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            span = _current_span.get()
+            if span is not None and span.error is None:
+                span.error = type(e).__name__
+            raise
+        finally:
+            self.record_phase(name, time.perf_counter() - started)
+
+    def record_phase(self, name: str, seconds: float):
+        span = _current_span.get()
+        self._observe(self.phases, (span.tool if span else "internal", name), seconds)
+        if span is not None:
+            span.phases[name] = span.phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1):
+        span = _current_span.get()
+        key = (span.tool if span else "internal", name)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        if span is not None:
+            span.counters[name] = span.counters.get(name, 0) + value
+
+    def finish(self, span: ToolSpan):
+        elapsed = time.perf_counter() - span.started
+        self._observe(self.tools, span.tool, elapsed, error=span.error is not None)
+        self.recent.append({
+            "tool": span.tool,
+            "finished_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "duration_ms": round(elapsed * 1000, 1),
+            "error": span.error,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in span.phases.items()},
+            "counters": dict(span.counters)
+        })
+
+    @staticmethod
+    def _quantile(values: List[float], fraction: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * fraction)))]
+
+    def _summary(self, series: Dict[str, Any]) -> Dict[str, Any]:
+        durations = list(series["durations"])
+        return {
+            "count": series["count"],
+            "errors": series["errors"],
+            "total_s": round(series["sum"], 3),
+            "p50_ms": round(self._quantile(durations, 0.5) * 1000, 1),
+            "p95_ms": round(self._quantile(durations, 0.95) * 1000, 1),
+            "p99_ms": round(self._quantile(durations, 0.99) * 1000, 1)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """按工具汇总的指标，分位数基于每个工具或阶段最近 window 次的耗时"""
+        with self._lock:
+            tools = {tool: self._summary(series) for tool, series in self.tools.items()}
+            for (tool, phase), series in self.phases.items():
+                tools.setdefault(tool, {}).setdefault("phases", {})[phase] = self._summary(series)
+            for (tool, name), value in self.counters.items():
+                tools.setdefault(tool, {}).setdefault("counters", {})[name] = value
+        return {"tools": tools, "recent": list(self.recent)}
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式的指标"""
+        lines = []
+        with self._lock:
+            tool_series = [(tool, dict(series, durations=list(series["durations"]))) for tool, series in self.tools.items()]
+            phase_series = [(key, dict(series, durations=list(series["durations"]))) for key, series in self.phases.items()]
+            counters = list(self.counters.items())
+
+        def summary(metric: str, help_text: str, rows):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for labels, series in rows:
+                for quantile in (0.5, 0.95, 0.99):
+                    value = self._quantile(series["durations"], quantile)
+                    lines.append(f'{metric}{{{labels},quantile="{quantile}"}} {value:.6f}')
+                lines.append(f"{metric}_sum{{{labels}}} {series['sum']:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {series['count']}")
+
+        summary("xhs_tool_duration_seconds", "Duration of MCP tool calls",
+                [(f'tool="{tool}"', series) for tool, series in tool_series])
+        lines.append("# HELP xhs_tool_errors_total MCP tool calls that failed")
+        lines.append("# TYPE xhs_tool_errors_total counter")
+        for tool, series in tool_series:
+            lines.append(f'xhs_tool_errors_total{{tool="{tool}"}} {series["errors"]}')
+        summary("xhs_phase_duration_seconds", "Duration of phases within MCP tool calls",
+                [(f'tool="{tool}",phase="{phase}"', series) for (tool, phase), series in phase_series])
+        lines.append("# HELP xhs_events_total Counted events such as selector fallbacks and browser protocol calls")
+        lines.append("# TYPE xhs_events_total counter")
+        for (tool, name), value in counters:
+            lines.append(f'xhs_events_total{{tool="{tool}",event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(METRICS_WINDOW)
+
+
+def install_protocol_counter():
+    """统计每次工具调用向浏览器发送的协议请求（即 CDP 往返）次数
+
+    依赖 Playwright 的内部接口，接口不存在时跳过，不影响工具本身。
+    """
+    try:
+        from playwright._impl import _connection
+    except ImportError:
+        return
+    for name in ("_inner_send", "inner_send"):
+        original = getattr(_connection.Channel, name, None)
+        if original is not None:
+            break
+    else:
+        return
+    if getattr(original, "_xhs_counted", False):
+        return
+
+    async def counted_send(channel, method, *args, **kwargs):
+        metrics.count("protocol_calls")
+        return await original(channel, method, *args, **kwargs)
+
+    counted_send._xhs_counted = True
+    setattr(_connection.Channel, name, counted_send)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """以 Prometheus 文本格式提供 /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host: str, port: int):
+    """在后台线程中启动 Prometheus 指标端点"""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Prometheus 指标端点: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+# 当前调用所属的客户端会话，HTTP 模式下多个客户端共享一个服务，部分结果等按会话隔离
+_current_client: ContextVar[str] = ContextVar("xhs_current_client", default="local")
+
+# 合并执行的获取中，所有等待过这次获取的客户端；获取被取消时部分结果为每个客户端各保存一份
+_flight_clients: ContextVar[Optional[set]] = ContextVar("xhs_flight_clients", default=None)
+
+
+class CallLimitMiddleware(Middleware):
+    """限制同时执行的工具调用数量，并记录调用所属的客户端会话
+
+    超出上限的调用排队等待，排队超过 queue_timeout 秒时返回服务器繁忙的错误。
+    """
+
+    def __init__(self, limit: int, queue_timeout: float):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def on_call_tool(self, context, call_next):
+        # 信号量在事件循环内延迟创建
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.count("rejected_calls")
+            raise ToolError(f"服务器繁忙：已有 {self.limit} 个调用正在执行，请稍后重试")
+        
+        session_id = None
+        if context.fastmcp_context is not None:
+            try:
+                session_id = context.fastmcp_context.session_id
+            except Exception:
+                session_id = None
+        token = _current_client.set(session_id or "local")
+        try:
+            return await call_next(context)
+        finally:
+            _current_client.reset(token)
+            self._slots.release()
+
+
+mcp.add_middleware(CallLimitMiddleware(MAX_CONCURRENT_CALLS, CALL_QUEUE_TIMEOUT))
+
+
+def save_partial_result(tool: str, target: str, items: List[Dict[str, Any]]):
+    """保存被取消的长时任务已收集到的部分结果，供同一客户端通过 get_partial_result 工具取回"""
+    saved_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for client in sorted(_flight_clients.get() or {_current_client.get()}):
+        key = (client, tool, target)
+        partial_results[key] = {"tool": tool, "target": target, "saved_at": saved_at, "items": items}
+        partial_results.move_to_end(key)
+    while len(partial_results) > PARTIAL_RESULTS_MAX:
+        partial_results.popitem(last=False)
+    print(f"{tool} 被取消，已保存 {len(items)} 条部分结果")
+
+
+class SingleFlight:
+    """合并同一时刻对同一目标的重复请求
+
+    同一个键同时只执行一次获取，期间到达的其他调用等待并共享这次的结果。获取过程把已收集
+    的条目写入共享的 progress，调用各自的截止时间到达时，用 partial(progress) 返回部分结果，
+    获取继续为其他调用进行。获取通过 deadline() 读取仍在等待的调用中最晚的截止时间
+    （有调用不限时则为 None），所有调用都已超时离开时获取自行停止；最后一个调用被取消时
+    获取随之取消，部分结果为所有等待过的客户端各保存一份。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[tuple, Dict[str, Any]] = {}
+
+    def _forget(self, key: tuple, flight: Dict[str, Any], task: asyncio.Future):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    @staticmethod
+    def _latest_deadline(flight: Dict[str, Any]) -> Optional[float]:
+        deadlines = flight["deadlines"]
+        if not deadlines:
+            # 没有仍在等待的调用，获取应立即停止
+            return float("-inf")
+        return None if None in deadlines else max(deadlines)
+
+    def _start(self, key: tuple, factory) -> Dict[str, Any]:
+        progress: "OrderedDict[str, Any]" = OrderedDict()
+        flight = {"progress": progress, "deadlines": [], "clients": set()}
+        # 获取任务在单独的上下文中运行，取消时按 clients 为所有等待过的客户端保存部分结果
+        context = copy_context()
+        context.run(_flight_clients.set, flight["clients"])
+        flight["task"] = context.run(
+            asyncio.ensure_future, factory(progress, functools.partial(self._latest_deadline, flight))
+        )
+        self._inflight[key] = flight
+        flight["task"].add_done_callback(functools.partial(self._forget, key, flight))
+        return flight
+
+    async def do(self, key: tuple, factory, deadline: Optional[float] = None, partial=None):
+        """
+        Args:
+            key: 合并请求的键
+            factory: 以 (progress, deadline) 为参数创建获取协程，progress 为 OrderedDict，
+                deadline() 返回获取当前应遵守的截止时间
+            deadline: 本调用的 time.monotonic() 截止时间
+            partial: 截止时间到达时由 progress 生成返回值
+        """
+        while True:
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = self._start(key, factory)
+            else:
+                metrics.count("coalesced")
+            task = flight["task"]
+            flight["deadlines"].append(deadline)
+            flight["clients"].add(_current_client.get())
+            timed_out = False
+            try:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                return await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                return partial(flight["progress"])
+            except asyncio.CancelledError:
+                # 获取被其他原因取消、而本调用自身并未被取消时，重新发起获取；
+                # Python 3.11 以前无法区分两者，此时不重试
+                cancelling = getattr(asyncio.current_task(), "cancelling", None)
+                if task.cancelled() and cancelling is not None and not cancelling():
+                    continue
+                raise
+            finally:
+                flight["deadlines"].remove(deadline)
+                if not flight["deadlines"] and not timed_out and not task.done():
+                    task.cancel()
+
+
+single_flight = SingleFlight()
+
+
+def normalize_keywords(keywords: str) -> str:
+    """用于合并请求的关键词形式：去掉多余空白并忽略大小写"""
+    return " ".join(keywords.split()).lower()
+
+
+class PagePool:
+    """持久化浏览器上下文中的有界标签页池
+
+    每次工具调用通过 lease() 租用一个页面并在调用结束后归还，
+    池中页面全部被占用时，新的调用会排队等待。
+    写操作（如发布评论）之间互斥执行。
+    """
+
+    def __init__(self, context, size: int, lean: bool = False):
+        self.context = context
+        self.size = size
+        self.lean = lean
+        self._idle: List[Any] = []
+        self._slots = asyncio.Semaphore(size)
+        self._write_lock = asyncio.Lock()
+        self._writing: set = set()  # 正在执行写操作的页面，不屏蔽任何资源
+
+    async def _take_page(self):
+        while self._idle:
+            page = self._idle.pop()
+            if not page.is_closed():
+                return page
+        page = await self.context.new_page()
+        page.set_default_timeout(60000)
+        if self.lean:
+            await page.route("**/*", lambda route: self._route_lean(route, page))
+        return page
+
+    async def _route_lean(self, route, page):
+        """精简模式下只读页面屏蔽媒体、字体和统计请求"""
+        request = route.request
+        if page not in self._writing and (
+            request.resource_type in LEAN_BLOCKED_RESOURCE_TYPES
+            or any(keyword in request.url for keyword in LEAN_BLOCKED_URL_KEYWORDS)
+        ):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    @asynccontextmanager
+    async def lease(self, write: bool = False):
+        """租用一个页面，退出上下文时自动归还
+
+        Args:
+            write: 是否为写操作，写操作之间串行执行
+        """
+        started = time.perf_counter()
+        if write:
+            await self._write_lock.acquire()
+        try:
+            async with self._slots:
+                page = await self._take_page()
+                metrics.record_phase("acquire", time.perf_counter() - started)
+                if write:
+                    self._writing.add(page)
+                try:
+                    yield page
+                finally:
+                    self._writing.discard(page)
+                    if not page.is_closed():
+                        self._idle.append(page)
+        finally:
+            if write:
+                self._write_lock.release()
+
+
+def extract_note_id(url: str) -> Optional[str]:
+    """从笔记链接中提取规范的笔记ID，搜索结果链接和探索页链接对应同一ID"""
+    match = NOTE_ID_PATTERN.search(url or "")
+    return match.group(1) if match else None
+
+def _format_timestamp(value) -> Optional[str]:
+    """将接口返回的毫秒时间戳格式化为可读时间"""
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(int(value) / 1000).strftime("%Y-%m-%d %H:%M")
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def normalize_comment_time(text: Optional[str], now: Optional[datetime] = None) -> Optional[str]:
+    """将评论区显示的时间（"刚刚"、"3天前"、"昨天 12:30"、"05-12"、"2023-05-12"）换算为绝对时间
+
+    结果格式与 _format_timestamp 一致，无法识别时返回 None。
+    """
+    if not text:
+        return None
+    now = now or datetime.now()
+    clock = CLOCK_PATTERN.search(text)
+    if "刚刚" in text:
+        return now.strftime("%Y-%m-%d %H:%M")
+    match = RELATIVE_TIME_PATTERN.search(text)
+    if match:
+        delta = timedelta(**{RELATIVE_TIME_UNITS[match.group(2)]: int(match.group(1))})
+        return (now - delta).strftime("%Y-%m-%d %H:%M")
+    for word, offset in DAY_WORD_OFFSETS.items():
+        if word in text:
+            day = now - timedelta(days=offset)
+            hour, minute = (int(clock.group(1)), int(clock.group(2))) if clock else (0, 0)
+            return day.replace(hour=hour, minute=minute).strftime("%Y-%m-%d %H:%M")
+    match = DATE_PATTERN.search(text)
+    if match:
+        hour, minute = (int(clock.group(1)), int(clock.group(2))) if clock else (0, 0)
+        try:
+            value = datetime(int(match.group(1) or now.year), int(match.group(2)), int(match.group(3)), hour, minute)
+            # 不带年份的日期晚于当前时间时属于去年
+            if not match.group(1) and value > now:
+                value = value.replace(year=value.year - 1)
+        except ValueError:
+            return None
+        return value.strftime("%Y-%m-%d %H:%M")
+    return None
+
+def _pick(data: dict, *keys, default=None):
+    """按顺序取第一个存在的字段，兼容接口的下划线命名和页面状态的驼峰命名"""
+    for key in keys:
+        if data.get(key) not in (None, ""):
+            return data[key]
+    return default
+
+@dataclass
+class NoteRecord:
+    """结构化的笔记数据，由 fetch_note() 返回并在各工具之间复用"""
+    url: str
+    note_id: Optional[str] = None
+    title: str = "未知标题"
+    author: str = "未知作者"
+    publish_time: str = "未知"
+    content: str = "未能获取内容"
+    images: List[str] = field(default_factory=list)
+    interact: Dict[str, Any] = field(default_factory=dict)  # 点赞、收藏、评论、分享数，仅接口数据提供
+    ip_location: str = ""
+    source: str = "dom"  # 数据来源：api、initial_state 或 dom
+    strategies: Dict[str, Optional[str]] = field(default_factory=dict)  # DOM 提取时各字段命中的策略
+
+    @property
+    def has_content(self) -> bool:
+        return self.content != "未能获取内容"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NoteRecord":
+        names = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in names})
+
+def note_from_payload(note: dict, url: str, source: str = "api") -> NoteRecord:
+    """将接口返回的 note_card 或页面初始状态中的 note 转换为笔记数据"""
+    user = note.get("user") or {}
+    interact = _pick(note, "interact_info", "interactInfo", default={})
+    images = []
+    for image in _pick(note, "image_list", "imageList", default=[]):
+        info_list = _pick(image, "info_list", "infoList", default=[])
+        src = _pick(image, "url_default", "urlDefault", "url") or (info_list[-1].get("url") if info_list else None)
+        if src:
+            images.append(src)
+    return NoteRecord(
+        url=url,
+        note_id=_pick(note, "note_id", "noteId") or extract_note_id(url),
+        title=_pick(note, "title", "display_title", "displayTitle", default="未知标题"),
+        author=_pick(user, "nickname", "nick_name", "nickName", default="未知作者"),
+        publish_time=_format_timestamp(note.get("time")) or "未知",
+        content=_pick(note, "desc", default="未能获取内容"),
+        images=images,
+        interact={
+            "点赞": _pick(interact, "liked_count", "likedCount", default="0"),
+            "收藏": _pick(interact, "collected_count", "collectedCount", default="0"),
+            "评论": _pick(interact, "comment_count", "commentCount", default="0"),
+            "分享": _pick(interact, "share_count", "shareCount", default="0")
+        },
+        ip_location=_pick(note, "ip_location", "ipLocation", default=""),
+        source=source
+    )
+
+def search_post_from_payload(item: dict) -> dict:
+    """将搜索接口返回的条目转换为搜索结果字段"""
+    card = item.get("note_card") or {}
+    user = card.get("user") or {}
+    interact = card.get("interact_info") or {}
+    url = f"{BASE_URL}/search_result/{item['id']}"
+    if item.get("xsec_token"):
+        url += f"?xsec_token={item['xsec_token']}&xsec_source=pc_search"
+    return {
+        "url": url,
+        "title": card.get("display_title") or "未知标题",
+        "note_id": item["id"],
+        "作者": _pick(user, "nickname", "nick_name", default="未知作者"),
+        "点赞": interact.get("liked_count", "0")
+    }
+
+def comment_from_payload(comment: dict) -> dict:
+    """将评论分页接口返回的评论转换为评论字段"""
+    user = comment.get("user_info") or {}
+    return {
+        "用户名": user.get("nickname") or "未知用户",
+        "内容": comment.get("content") or "",
+        "时间": _format_timestamp(comment.get("create_time")) or "未知时间",
+        "id": comment.get("id"),
+        "parent_id": comment.get("root_comment_id"),
+        "点赞数": comment.get("like_count", "0"),
+        "IP属地": comment.get("ip_location", "")
+    }
+
+
+class ApiCapture:
+    """捕获网页端通过 XHR 加载的笔记详情、评论分页和搜索结果 JSON
+
+    在 ensure_browser() 中挂到浏览器上下文的 response 事件上，
+    工具优先基于捕获到的数据生成结果，没有捕获到时再回退到 DOM 提取。
+    """
+
+    def __init__(self, max_entries: int = 200):
+        self.max_entries = max_entries
+        self.notes: "OrderedDict[str, dict]" = OrderedDict()
+        self.comments: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        self.searches: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        self._events: Dict[tuple, asyncio.Event] = {}
+
+    def _store(self, table: OrderedDict, key: str, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def _notify(self, kind: str, key: str):
+        event = self._events.get((kind, key))
+        if event:
+            event.set()
+
+    async def on_response(self, response):
+        url = response.url
+        kind = next((name for name, pattern in API_CAPTURE_PATTERNS.items() if pattern in url), None)
+        if kind is None:
+            return
+        try:
+            payload = await response.json()
+        except Exception:
+            return
+        data = payload.get("data") or {}
+        
+        if kind == "feed":
+            for item in data.get("items") or []:
+                card = item.get("note_card") or {}
+                note_id = item.get("id") or card.get("note_id")
+                if note_id:
+                    self._store(self.notes, note_id, card)
+                    self._notify("feed", note_id)
+        
+        elif kind in ("comments", "sub_comments"):
+            query = parse_qs(urlparse(url).query)
+            note_id = (query.get("note_id") or [None])[0]
+            if not note_id:
+                return
+            thread = self.comments.get(note_id) or OrderedDict()
+            for comment in data.get("comments") or []:
+                if kind == "sub_comments":
+                    comment.setdefault("root_comment_id", (query.get("root_comment_id") or [None])[0])
+                thread[comment["id"]] = comment
+                for sub in comment.get("sub_comments") or []:
+                    sub.setdefault("root_comment_id", comment["id"])
+                    thread[sub["id"]] = sub
+            self._store(self.comments, note_id, thread)
+            self._notify("comments", note_id)
+        
+        elif kind == "search":
+            try:
+                keyword = json.loads(response.request.post_data or "{}").get("keyword")
+            except ValueError:
+                keyword = None
+            if not keyword:
+                return
+            items = self.searches.get(keyword) or OrderedDict()
+            for item in data.get("items") or []:
+                if item.get("model_type", "note") == "note" and item.get("id"):
+                    items[item["id"]] = item
+            self._store(self.searches, keyword, items)
+            self._notify("search", keyword)
+
+    def reset(self, kind: str, key: str):
+        """导航前清除旧数据，保证结果只来自本次页面加载"""
+        table = {"feed": self.notes, "comments": self.comments, "search": self.searches}[kind]
+        table.pop(key, None)
+        self._events[(kind, key)] = asyncio.Event()
+
+    async def wait_for(self, kind: str, key: str, timeout: float = 2):
+        """等待指定数据被捕获，超时返回 None"""
+        table = {"feed": self.notes, "comments": self.comments, "search": self.searches}[kind]
+        if key not in table and timeout > 0:
+            event = self._events.setdefault((kind, key), asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return table.get(key)
+
+
+class NoteCache:
+    """按笔记ID缓存笔记内容和评论的本地 SQLite 缓存
+
+    条目超过 ttl 秒视为过期，条目总数超过 max_entries 时按最近访问时间淘汰，
+    缓存文件位于 DATA_DIR 下，服务重启后仍然有效。
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS note_cache (
+                note_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (note_id, kind)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_note_cache_accessed ON note_cache (accessed_at)")
+        self.conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, note_id: str, kind: str):
+        """读取缓存，未命中或已过期时返回 None"""
+        if not self.enabled:
+            return None
+        row = self.conn.execute(
+            "SELECT data, fetched_at FROM note_cache WHERE note_id = ? AND kind = ?",
+            (note_id, kind)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.ttl:
+            self.conn.execute("DELETE FROM note_cache WHERE note_id = ? AND kind = ?", (note_id, kind))
+            self.conn.commit()
+            return None
+        self.conn.execute(
+            "UPDATE note_cache SET accessed_at = ? WHERE note_id = ? AND kind = ?",
+            (now, note_id, kind)
+        )
+        self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, note_id: str, kind: str, data):
+        """写入缓存，并按最近访问时间淘汰超出容量的条目"""
+        if not self.enabled:
+            return
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO note_cache (note_id, kind, data, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (note_id, kind, json.dumps(data, ensure_ascii=False), now, now)
+        )
+        self.conn.execute(
+            "DELETE FROM note_cache WHERE rowid IN "
+            "(SELECT rowid FROM note_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.conn.commit()
+
+    def items(self, kind: str, limit: int = 0) -> List[Tuple[str, Any]]:
+        """按抓取时间从新到旧列出未过期的某类缓存条目，limit 为 0 表示不限制"""
+        if not self.enabled:
+            return []
+        rows = self.conn.execute(
+            "SELECT note_id, data FROM note_cache WHERE kind = ? AND fetched_at >= ? "
+            "ORDER BY fetched_at DESC LIMIT ?",
+            (kind, time.time() - self.ttl, limit if limit > 0 else -1)
+        ).fetchall()
+        return [(note_id, json.loads(data)) for note_id, data in rows]
+
+
+note_cache = NoteCache(CACHE_PATH, CACHE_TTL, CACHE_MAX_ENTRIES)
+
+
+class CommentThreadStore:
+    """按笔记保存已抓取的全部评论，以及最新评论的游标
+
+    每次获取到评论都会合并进对应笔记的线程文件，增量获取时据此判断哪些评论是新的。
+    游标为时间最新的评论的ID和时间，时间统一为绝对时间，相对时间在提取时已换算。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.enabled = True
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, note_id: str) -> str:
+        return os.path.join(self.directory, f"{note_id}.json")
+
+    def load(self, note_id: str) -> Optional[Dict[str, Any]]:
+        """读取笔记的评论线程 {"comments", "cursor", "updated_at"}，没有时返回 None"""
+        path = self._path(note_id)
+        if not self.enabled or not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _parse_time(comment: Dict[str, Any]) -> Optional[datetime]:
+        try:
+            return datetime.strptime(comment.get("时间") or "", "%Y-%m-%d %H:%M")
+        except ValueError:
+            return None
+
+    def merge(self, note_id: str, comments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """将评论合并进线程，返回其中此前没有保存过的评论"""
+        if not self.enabled:
+            return []
+        thread = self.load(note_id) or {"comments": [], "cursor": None}
+        known = {comment_key(comment) for comment in thread["comments"]}
+        new_comments = []
+        for comment in comments:
+            key = comment_key(comment)
+            if key not in known:
+                known.add(key)
+                new_comments.append(comment)
+        if not new_comments:
+            return []
+        
+        # 新评论排在前面，游标取时间最新的评论
+        thread["comments"] = new_comments + thread["comments"]
+        newest = None
+        for comment in thread["comments"]:
+            value = self._parse_time(comment)
+            if value is not None and (newest is None or value > newest[0]):
+                newest = (value, comment)
+        if newest is not None:
+            thread["cursor"] = {"id": newest[1].get("id"), "time": newest[1]["时间"]}
+        thread["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        path = self._path(note_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(thread, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return new_comments
+
+
+comment_threads = CommentThreadStore(COMMENT_THREAD_DIR)
+
+
+class DebugCapture:
+    """提取失败或回退时保存调试快照：页面 HTML、截图和选择器命中记录
+
+    正常调用不做任何额外工作。快照按时间命名保存在独立目录中，
+    总大小超过上限时删除最旧的快照；同一工具的同一原因在 interval 秒内只保存一次。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, interval: float, enabled: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.enabled = enabled
+        self._last_saved: Dict[Tuple[str, str], float] = {}
+
+    async def capture(self, page, tool: str, reason: str, trace: Optional[Dict[str, Any]] = None):
+        """保存一份快照，调试模式下不受保存间隔限制；出错时只打印日志，不影响工具调用"""
+        if not (self.enabled or DEBUG_MODE):
+            return
+        now = time.monotonic()
+        last = self._last_saved.get((tool, reason))
+        if not DEBUG_MODE and last is not None and now - last < self.interval:
+            return
+        self._last_saved[(tool, reason)] = now
+        
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{tool}_{reason}"
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, "trace.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "tool": tool,
+                    "reason": reason,
+                    "url": page.url,
+                    "captured_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "trace": trace or {}
+                }, f, ensure_ascii=False, indent=2)
+            with open(os.path.join(path, "page.html"), "w", encoding="utf-8") as f:
+                f.write(await page.content())
+            await page.screenshot(path=os.path.join(path, "screenshot.png"), timeout=10000)
+            metrics.count("debug_snapshots")
+            print(f"已保存调试快照: {path}")
+        except Exception as e:
+            print(f"保存调试快照失败: {str(e)}")
+        self._rotate()
+
+    def _rotate(self):
+        """删除最旧的快照，直到目录总大小不超过上限"""
+        snapshots = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                snapshots.append((path, size))
+        total = sum(size for _, size in snapshots)
+        for path, size in snapshots:
+            if total <= self.max_bytes:
+                break
+            for entry in os.scandir(path):
+                os.remove(entry.path)
+            os.rmdir(path)
+            total -= size
+
+
+debug_capture = DebugCapture(
+    DEBUG_SNAPSHOT_DIR, int(DEBUG_SNAPSHOT_MAX_MB * 1024 * 1024), DEBUG_SNAPSHOT_INTERVAL, DEBUG_SNAPSHOTS
+)
+
+
+class SelectorRegistry:
+    """记录各字段每个提取策略的命中情况，并据此调整尝试顺序
+
+    最近一次命中的策略排在最前，其余保持默认顺序，页面布局变化后只有第一次调用需要
+    依次尝试失效的策略。统计定期保存到 DATA_DIR，服务重启后继续生效。
+    """
+
+    def __init__(self, path: str, defaults: Dict[str, List[str]], save_interval: float = 30):
+        self.path = path
+        self.defaults = defaults
+        self.save_interval = save_interval
+        self.stats: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.winners: Dict[str, str] = {}
+        self._saved_at = time.monotonic()
+        self._dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                self.stats = state.get("stats", {})
+                self.winners = {
+                    name: winner for name, winner in state.get("winners", {}).items()
+                    if winner in defaults.get(name, [])
+                }
+            except Exception as e:
+                print(f"读取提取策略统计失败，重新开始统计: {str(e)}")
+
+    def order(self, name: str) -> List[str]:
+        """字段策略的尝试顺序：当前首选策略在前，其余按默认顺序"""
+        strategies = self.defaults[name]
+        winner = self.winners.get(name)
+        if winner not in strategies:
+            return list(strategies)
+        return [winner] + [strategy for strategy in strategies if strategy != winner]
+
+    def record(self, name: str, winner: Optional[str], tried: List[str], count: int = 1):
+        """记录一次提取：winner 之前尝试过的策略计为失败，winner 计为命中，None 表示全部失败"""
+        field_stats = self.stats.setdefault(name, {})
+        for strategy in tried:
+            if strategy == winner:
+                break
+            entry = field_stats.setdefault(strategy, {"hits": 0, "misses": 0, "consecutive_misses": 0, "last_hit": None})
+            entry["misses"] += count
+            entry["consecutive_misses"] += count
+        if winner:
+            entry = field_stats.setdefault(winner, {"hits": 0, "misses": 0, "consecutive_misses": 0, "last_hit": None})
+            entry["hits"] += count
+            entry["consecutive_misses"] = 0
+            entry["last_hit"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if winner != self.winners.get(name) and winner in self.defaults.get(name, []):
+                print(f"字段 {name} 的首选提取策略变为 {winner}")
+                self.winners[name] = winner
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stats": self.stats, "winners": self.winners}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._saved_at = time.monotonic()
+        self._dirty = False
+
+    def report(self) -> Dict[str, List[Dict[str, Any]]]:
+        """各字段每个策略的命中率和状态，按当前尝试顺序排列"""
+        result = {}
+        for name in self.defaults:
+            field_stats = self.stats.get(name, {})
+            rows = []
+            for strategy in self.order(name):
+                entry = field_stats.get(strategy, {})
+                hits, misses = entry.get("hits", 0), entry.get("misses", 0)
+                if strategy == self.winners.get(name):
+                    status = "首选"
+                elif hits and entry.get("consecutive_misses", 0) >= SELECTOR_DYING_MISSES:
+                    status = "失效中"
+                elif misses and not hits:
+                    status = "从未命中"
+                elif not hits and not misses:
+                    status = "未尝试"
+                else:
+                    status = "备用"
+                rows.append({
+                    "strategy": strategy,
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+                    "consecutive_misses": entry.get("consecutive_misses", 0),
+                    "last_hit": entry.get("last_hit"),
+                    "status": status
+                })
+            result[name] = rows
+        return result
+
+
+
+class NavigationScheduler:
+    """统一调度页面导航：令牌桶限速，识别限流和验证码页面后指数退避
+
+    令牌以每秒 rate 个的速度补充，最多积累 burst 个，每次导航消耗一个。发现限流后
+    退避期内暂停所有导航，连续被限流时退避时长翻倍，导航成功后恢复。需要等待的时间
+    超过 max_wait 时立即报错，避免每个调用都在页面超时后才失败。
+
+    调用到达时按先后顺序预约令牌（令牌数可以为负，表示已被预约），据此直接算出
+    需要等待的时间，排在前面的调用的等待时间也计入后面调用的 max_wait。
+    """
+
+    def __init__(self, rate: float, burst: int, backoff_base: float, backoff_max: float, max_wait: float):
+        self.rate = rate
+        self.burst = burst
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.backoff = 0.0
+        self.backoff_until = 0.0
+        self.navigations = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.last_throttle: Optional[Dict[str, Any]] = None
+        self._refilled_at = time.monotonic()
+
+    def _refill(self, now: float):
+        # 退避期间 _refilled_at 为退避结束时间，在此之前不补充令牌
+        if now > self._refilled_at:
+            self.tokens = min(float(self.burst), self.tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+
+    async def acquire(self):
+        """等待退避结束并取得一个令牌
+
+        Raises:
+            ThrottledError: 需要等待的时间超过 max_wait
+        """
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if self.rate <= 0:
+                wait = max(0.0, self.backoff_until - now)
+            else:
+                self._refill(now)
+                wait = max(0.0, self._refilled_at - now) + max(0.0, (1 - self.tokens) / self.rate)
+            if now + wait - started > self.max_wait:
+                self.rejected += 1
+                metrics.count("navigations_rejected")
+                if self.backoff_until > now:
+                    raise ThrottledError(f"平台限流中，约 {self.backoff_until - now:.0f} 秒后恢复访问，请稍后重试")
+                raise ThrottledError(f"导航排队超过 {self.max_wait:.0f} 秒，请稍后重试")
+            # 预约令牌后再等待，后到的调用据此排在后面
+            if self.rate > 0:
+                self.tokens -= 1
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # 等待期间进入了退避，预约作废，重新排队
+            if time.monotonic() < self.backoff_until:
+                continue
+            return
+
+    def penalize(self, reason: str, url: str):
+        """记录一次限流并进入退避，退避期内同时返回的其他限流不再叠加"""
+        now = time.monotonic()
+        self.throttled += 1
+        metrics.count("throttled")
+        self.last_throttle = {"reason": reason, "url": url, "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        if now < self.backoff_until:
+            return
+        self.backoff = min(max(self.backoff * 2, self.backoff_base), self.backoff_max)
+        self.backoff_until = now + self.backoff
+        self.tokens = 0.0
+        self._refilled_at = self.backoff_until
+        print(f"检测到限流（{reason}），暂停页面访问 {self.backoff:.0f} 秒")
+
+    def detect(self, page, response) -> Optional[str]:
+        """判断导航结果是否为限流、验证码或风控页面，返回原因"""
+        status = response.status if response is not None else None
+        if status in THROTTLE_STATUS_CODES or (status is not None and status >= 500):
+            return f"HTTP {status}"
+        if THROTTLE_URL_PATTERN.search(page.url):
+            return "captcha"
+        return None
+
+    async def goto(self, page, url: str, timeout: float = 60000):
+        """限速后打开页面，遇到限流页面时进入退避并抛出 ThrottledError"""
+        with metrics.phase("pace"):
+            await self.acquire()
+        self.navigations += 1
+        try:
+            with metrics.phase("navigate"):
+                response = await page.goto(url, timeout=timeout, wait_until="domcontentloaded")
+        except PlaywrightTimeoutError:
+            self.penalize("timeout", url)
+            raise
+        reason = self.detect(page, response)
+        if reason:
+            self.penalize(reason, url)
+            raise ThrottledError(f"平台返回了限流或验证页面（{reason}），已暂停访问 {self.backoff:.0f} 秒，请稍后重试")
+        # 正常返回说明限流已解除
+        self.backoff = 0.0
+        return response
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        if self.rate > 0 and now >= self.backoff_until:
+            self._refill(now)
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "tokens": round(self.tokens, 2),
+            "backoff_seconds": self.backoff,
+            "backoff_remaining": round(max(0.0, self.backoff_until - now), 1),
+            "navigations": self.navigations,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "last_throttle": self.last_throttle
+        }
+
+
+navigation_scheduler = NavigationScheduler(NAV_RATE, NAV_BURST, NAV_BACKOFF_BASE, NAV_BACKOFF_MAX, NAV_MAX_WAIT)
+
+
+async def wait_until_ready(page, tool: str, selector: Optional[str] = None) -> bool:
+    """等待页面满足工具所需的就绪条件，而不是固定休眠
+    
+    Args:
+        page: 要等待的页面
+        tool: 工具名，用于确定默认的就绪条件和最长等待时间
+        selector: 自定义就绪条件，默认使用 READY_SELECTORS 中的配置
+    
+    Returns:
+        bool: 是否在最长等待时间内就绪
+    """
+    selector = selector or READY_SELECTORS[tool]
+    started = time.monotonic()
+    with metrics.phase("wait"):
+        try:
+            await page.wait_for_selector(selector, state="attached", timeout=READY_TIMEOUTS[tool] * 1000)
+            ready = True
+        except PlaywrightTimeoutError:
+            ready = False
+    elapsed = time.monotonic() - started
+    if not ready:
+        metrics.count("ready_timeouts")
+        await debug_capture.capture(page, tool, "ready_timeout", {"selector": selector, "waited_seconds": round(elapsed, 2)})
+        # 验证码页面可能在页面加载后才通过脚本跳转
+        if THROTTLE_URL_PATTERN.search(page.url):
+            navigation_scheduler.penalize("captcha", page.url)
+            raise ThrottledError("平台要求验证，已暂停访问，请稍后重试")
+    debug_log(f"[{tool}] 页面就绪等待 {elapsed:.2f} 秒{'' if ready else '（超时）'}")
+    return ready
+
+async def wait_for_more(page, selector: str, previous_count: int, timeout: float = 3) -> bool:
+    """等待匹配 selector 的元素数量超过 previous_count，用于滚动或点击加载更多之后"""
+    with metrics.phase("wait"):
+        try:
+            await page.wait_for_function(
+                "([selector, count]) => document.querySelectorAll(selector).length > count",
+                arg=[selector, previous_count],
+                timeout=timeout * 1000
+            )
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+async def wait_for_network_idle(page, timeout: float = 5):
+    """等待页面网络请求平静下来，例如发送评论之后"""
+    with metrics.phase("wait"):
+        try:
+            await page.wait_for_load_state("networkidle", timeout=timeout * 1000)
+        except PlaywrightTimeoutError:
+            pass
+
+async def check_session() -> bool:
+    """通过登录 Cookie 和轻量接口探测判断当前会话是否有效，不需要打开页面"""
+    now = time.time()
+    cookies = await browser_context.cookies(BASE_URL)
+    has_cookie = any(
+        cookie["name"] == LOGIN_COOKIE_NAME and cookie["value"]
+        and (cookie.get("expires", -1) == -1 or cookie["expires"] > now)
+        for cookie in cookies
+    )
+    if not has_cookie:
+        return False
+    
+    # 游客也可能持有会话 Cookie，用接口确认是否为已登录用户
+    try:
+        response = await browser_context.request.get(SESSION_PROBE_URL, timeout=10000)
+        payload = await response.json()
+    except Exception:
+        payload = {}
+    data = payload.get("data") or {}
+    if payload.get("success") and data:
+        return not data.get("guest", False)
+    
+    # 探测失败或结果不明确时，对同一个 Cookie 只用页面检查一次并缓存结果
+    global _dom_session_check
+    session_value = next(cookie["value"] for cookie in cookies if cookie["name"] == LOGIN_COOKIE_NAME and cookie["value"])
+    if _dom_session_check is None or _dom_session_check[0] != session_value:
+        _dom_session_check = (session_value, await _check_session_dom())
+    return _dom_session_check[1]
+
+async def _check_session_dom() -> bool:
+    """打开首页查看是否出现登录按钮，页面无法打开时视为未登录"""
+    page = await browser_context.new_page()
+    try:
+        await page.goto(BASE_URL, timeout=60000, wait_until="domcontentloaded")
+        try:
+            await page.wait_for_selector('text="登录"', timeout=5000)
+            return False
+        except PlaywrightTimeoutError:
+            return True
+    except Exception as e:
+        print(f"页面检查登录状态失败: {str(e)}")
+        return False
+    finally:
+        await page.close()
+
+async def ensure_browser(interactive: bool = False):
+    """确保浏览器已启动并登录
+    
+    Args:
+        interactive: 是否需要用户在浏览器中操作（如扫码登录），为 True 时总是使用有界面浏览器
+    """
+    global _browser_lock
+    
+    # 锁在事件循环内延迟创建，避免并发调用重复启动浏览器
+    if _browser_lock is None:
+        _browser_lock = asyncio.Lock()
+    
+    with metrics.phase("login_check"):
+        async with _browser_lock:
+            return await _ensure_browser_locked(interactive)
+
+async def _ensure_browser_locked(interactive: bool = False):
+    global playwright_instance, browser_context, browser_headless, main_page, page_pool, api_capture
+    global is_logged_in, session_checked_at
+    
+    # 精简模式和无头模式以无头方式启动，需要用户登录时重新以有界面方式启动
+    if browser_context is not None and interactive and browser_headless and not is_logged_in:
+        await browser_context.close()
+        browser_context = None
     
     if browser_context is None:
         # 启动浏览器
-        playwright_instance = await async_playwright().start()
+        if playwright_instance is None:
+            install_protocol_counter()
+            playwright_instance = await async_playwright().start()
         
         # 使用持久化上下文来保存用户状态
-        browser_context = await playwright_instance.chromium.launch_persistent_context(
-            user_data_dir=BROWSER_DATA_DIR,
-            headless=False,  # 非隐藏模式，方便用户登录
-            viewport={"width": 1280, "height": 800},
-            timeout=60000
-        )
+        browser_headless = ((LEAN_MODE or HEADLESS) and not interactive) or worker_storage_state is not None
+        launch_options = {
+            "user_data_dir": BROWSER_DATA_DIR,
+            "headless": browser_headless,  # 默认非隐藏模式，方便用户登录
+            "viewport": {"width": 1280, "height": 800},
+            "timeout": 60000
+        }
+        if LEAN_MODE:
+            # 缩小视口并关闭动画，减少渲染开销
+            launch_options["viewport"] = {"width": 1024, "height": 768}
+            launch_options["reduced_motion"] = "reduce"
+        if worker_storage_state:
+            # 持久化目录已被主进程占用，工作进程从导出的登录状态创建独立上下文
+            browser = await playwright_instance.chromium.launch(headless=True, timeout=60000)
+            context_options = {key: launch_options[key] for key in ("viewport", "reduced_motion") if key in launch_options}
+            browser_context = await browser.new_context(storage_state=worker_storage_state, **context_options)
+        else:
+            browser_context = await playwright_instance.chromium.launch_persistent_context(**launch_options)
         
         # 创建一个新页面
         if browser_context.pages:
@@ -48,1000 +1500,2016 @@ async def ensure_browser():
         
         # 设置页面级别的超时时间
         main_page.set_default_timeout(60000)
+        
+        # 工具调用使用的页面池
+        page_pool = PagePool(browser_context, PAGE_POOL_SIZE, lean=LEAN_MODE)
+        
+        # 捕获接口 JSON
+        if CAPTURE_API:
+            if api_capture is None:
+                api_capture = ApiCapture()
+            browser_context.on("response", api_capture.on_response)
+    
+    # 检查登录状态：未登录时每次都检查，已登录时定期重新校验以发现会话过期
+    if not is_logged_in or time.monotonic() - session_checked_at > SESSION_REVALIDATE_SECONDS:
+        is_logged_in = await check_session()
+        session_checked_at = time.monotonic()
+    
+    return is_logged_in
+
+class WorkerPool:
+    """把只读抓取任务分发到多个工作进程，每个进程驱动自己的浏览器
+
+    第一次分发时在主进程确认已登录，并将登录状态（Cookie 和 localStorage）导出到文件，
+    工作进程从该文件创建浏览器上下文，任务通过进程池的共享队列分配给空闲的进程。
+    重新登录或工作进程发现会话失效后，进程池会重建并重新导出登录状态。
+    """
+
+    def __init__(self, size: int, state_path: str):
+        self.size = size
+        self.state_path = state_path
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def active(self) -> bool:
+        # 工作进程内部直接执行，不再分发
+        return self.size > 0 and worker_storage_state is None
+
+    async def _ensure_started(self) -> ProcessPoolExecutor:
+        # 锁在事件循环内延迟创建
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._executor is None:
+                if not await ensure_browser():
+                    raise LoginRequiredError("请先登录小红书账号")
+                await browser_context.storage_state(path=self.state_path)
+                os.chmod(self.state_path, 0o600)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_worker_init,
+                    initargs=(self.state_path,)
+                )
+                print(f"已导出登录状态，启动 {self.size} 个抓取工作进程")
+            return self._executor
+
+    def reset(self):
+        """关闭现有工作进程，下次分发时重新导出登录状态"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, kind: str, **kwargs):
+        """在工作进程中执行一个任务并返回结果
+
+        Raises:
+            LoginRequiredError: 主进程或工作进程未登录
+        """
+        executor = await self._ensure_started()
+        metrics.count("worker_jobs")
+        try:
+            status, payload = await asyncio.get_running_loop().run_in_executor(executor, _worker_run, kind, kwargs)
+        except BrokenProcessPool:
+            self.reset()
+            raise RuntimeError("抓取工作进程异常退出，请重试")
+        if status == "login":
+            # 导出的登录状态可能已过期，重建进程池以便下次使用主进程最新的登录状态
+            self.reset()
+            raise LoginRequiredError(payload)
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+
+worker_pool = WorkerPool(WORKER_PROCESSES, STORAGE_STATE_PATH)
+
+
+def _worker_init(state_path: str):
+    """工作进程初始化：使用导出的登录状态，缓存和提取策略统计由主进程维护"""
+    global worker_storage_state, _worker_loop
+    worker_storage_state = state_path
+    note_cache.ttl = 0
+    comment_threads.enabled = False
+    selector_registry.save_interval = float("inf")
+    # 限速按进程数均分，所有工作进程合计的导航速率与单进程一致
+    navigation_scheduler.rate /= max(1, WORKER_PROCESSES)
+    navigation_scheduler.burst = max(1, navigation_scheduler.burst // max(1, WORKER_PROCESSES))
+    navigation_scheduler.tokens = float(navigation_scheduler.burst)
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+
+
+async def _worker_job(kind: str, kwargs: Dict[str, Any]):
+    remaining = kwargs.pop("remaining", None)
+    deadline = time.monotonic() + remaining if remaining is not None else None
+    if kind == "search":
+        return await search_posts(kwargs["keywords"], kwargs["limit"], deadline=deadline,
+                                  known_ids=set(kwargs.get("known_ids") or []))
+    if kind == "note":
+        return (await fetch_note(kwargs["url"], refresh=True)).to_dict()
+    if kind == "comments":
+        return await fetch_comments(kwargs["url"], refresh=True, exhaustive=kwargs["exhaustive"],
+                                    max_comments=kwargs["max_comments"], since=kwargs.get("since"),
+                                    max_seconds=remaining or 0)
+    raise ValueError(f"未知的任务类型: {kind}")
+
+
+def _worker_run(kind: str, kwargs: Dict[str, Any]) -> Tuple[str, Any]:
+    """在工作进程中执行任务，异常转为 (状态, 信息) 返回，避免跨进程传递自定义异常类"""
+    try:
+        return "ok", _worker_loop.run_until_complete(_worker_job(kind, kwargs))
+    except LoginRequiredError as e:
+        return "login", str(e)
+    except Exception as e:
+        return "error", str(e)
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    """将本进程的截止时间转为剩余秒数，工作进程据此计算自己的截止时间"""
+    return max(0.0, deadline - time.monotonic()) if deadline is not None else None
+
+@mcp.tool()
+@metrics.instrument
+async def login() -> str:
+    """登录小红书账号"""
+    global is_logged_in, session_checked_at
     
-    # 检查登录状态
-    if not is_logged_in:
-        # 访问小红书首页
-        await main_page.goto("https://www.xiaohongshu.com", timeout=60000)
-        await asyncio.sleep(3)
+    await ensure_browser(interactive=True)
+    
+    if is_logged_in:
+        return "已登录小红书账号"
+    
+    # 登录成功时服务端会下发登录 Cookie，监听响应而不是轮询页面
+    logged_in = asyncio.Event()
+    
+    async def on_response(response):
+        if logged_in.is_set():
+            return
+        try:
+            set_cookie = await response.header_value("set-cookie")
+        except Exception:
+            return
+        if set_cookie and LOGIN_COOKIE_NAME in set_cookie and await check_session():
+            logged_in.set()
+    
+    browser_context.on("response", on_response)
+    try:
+        # 访问小红书登录页面
+        await main_page.goto(BASE_URL, timeout=60000, wait_until="domcontentloaded")
         
-        # 检查是否已登录
+        # 查找登录按钮并点击
+        try:
+            await main_page.wait_for_selector('text="登录"', timeout=5000)
+        except PlaywrightTimeoutError:
+            pass
         login_elements = await main_page.query_selector_all('text="登录"')
         if login_elements:
-            return False  # 需要登录
-        else:
-            is_logged_in = True
-            return True  # 已登录
+            await login_elements[0].click()
+        elif await check_session():
+            logged_in.set()
+        
+        # 提示用户手动登录
+        message = "请在打开的浏览器窗口中完成登录操作。登录成功后，系统将自动继续。"
+        
+        # 等待用户登录成功，最多等待3分钟
+        try:
+            await asyncio.wait_for(logged_in.wait(), timeout=180)
+        except asyncio.TimeoutError:
+            return "登录等待超时。请重试或手动登录后再使用其他功能。"
+    finally:
+        browser_context.remove_listener("response", on_response)
+    
+    is_logged_in = True
+    session_checked_at = time.monotonic()
+    # 工作进程使用的是登录前导出的状态，重建进程池
+    worker_pool.reset()
+    return "登录成功！" if login_elements else "已登录小红书账号"
+
+def format_search_results(keywords: str, posts: List[Dict[str, Any]]) -> str:
+    """格式化搜索结果"""
+    if not posts:
+        return f"未找到与\"{keywords}\"相关的笔记"
+    
+    result = "搜索结果：\n\n"
+    for i, post in enumerate(posts, 1):
+        result += f"{i}. {post['title']}\n   链接: {post['url']}\n"
+        if "作者" in post:
+            result += f"   作者: {post['作者']}  点赞: {post['点赞']}\n"
+        result += "\n"
+    return result
+
+# 在页面内一次性提取当前已渲染的全部搜索结果卡片，返回 [{href, title}]
+SEARCH_CARDS_SCRIPT = r'''
+() => {
+    const text = el => (el && el.textContent ? el.textContent.trim() : '');
+    const longest = values => values.reduce((a, b) => (b.length > a.length ? b : a), '');
+    
+    let cards = Array.from(document.querySelectorAll('section.note-item'));
+    if (cards.length === 0) {
+        // 备用选择器
+        cards = Array.from(document.querySelectorAll('div[data-v-a264b01a]'));
+    }
+    
+    const results = [];
+    for (const card of cards) {
+        const link = card.querySelector('a[href*="/search_result/"]');
+        const href = link ? link.getAttribute('href') : null;
+        if (!href || !href.includes('/search_result/')) continue;
+        
+        // 依次尝试卡片 footer 中的标题、标题元素、最长的 span 文本、最长的任意文本
+        let title = text(card.querySelector('div.footer a.title span')) || text(card.querySelector('a.title span'));
+        if (!title) {
+            title = longest(Array.from(card.querySelectorAll('span')).map(text).filter(t => t.length > 5));
+        }
+        if (!title) {
+            title = longest(Array.from(card.querySelectorAll('*')).map(text).filter(t => t.length > 5));
+        }
+        results.push({href: href, title: title || '未知标题'});
+    }
+    return results;
+}
+'''
+
+async def search_posts(
+    keywords: str,
+    limit: int,
+    reporter: Optional[ProgressReporter] = None,
+    deadline: Optional[float] = None,
+    known_ids: Optional[set] = None
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """滚动搜索结果流并按笔记ID去重，收集到 limit 条或结果流到底时停止，返回 (笔记列表, 是否完整)
+    
+    同一关键词、数量和已知笔记的并发搜索只执行一次，各调用按自己的截止时间返回。
+    
+    Args:
+        keywords: 搜索关键词
+        limit: 需要的笔记数量
+        reporter: 进度通知，仅发给实际执行搜索的调用
+        deadline: time.monotonic() 截止时间，到达后停止滚动并返回已收集的笔记
+        known_ids: 增量搜索时已见过的笔记ID，这些笔记不返回，某一轮滚动只剩已知笔记时停止
+    
+    Raises:
+        LoginRequiredError: 尚未登录小红书账号
+    """
+    known_ids = frozenset(known_ids or ())
+    return await single_flight.do(
+        ("search", normalize_keywords(keywords), limit, known_ids),
+        lambda progress, shared_deadline: _search_posts(keywords, limit, reporter, shared_deadline, known_ids, progress),
+        deadline,
+        lambda progress: (list(progress.values())[:limit], False)
+    )
+
+async def _search_posts(
+    keywords: str,
+    limit: int,
+    reporter: Optional[ProgressReporter],
+    deadline,
+    known_ids: Optional[set] = None,
+    progress: Optional["OrderedDict[str, Dict[str, Any]]"] = None
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """执行一次搜索，deadline() 返回当前的截止时间，见 SingleFlight"""
+    reporter = reporter or ProgressReporter()
+    known_ids = known_ids or set()
+    if worker_pool.active:
+        # 工作进程按派发时的截止时间自行停止，并返回已收集的部分
+        posts, complete = await worker_pool.run(
+            "search", keywords=keywords, limit=limit, remaining=_remaining(deadline()), known_ids=list(known_ids)
+        )
+        await reporter.report(len(posts), limit, f"找到 {len(posts)} 条笔记")
+        return posts, complete
+    
+    login_status = await ensure_browser()
+    if not login_status:
+        raise LoginRequiredError("请先登录小红书账号")
+    
+    # 构建搜索URL并访问
+    search_url = f"{BASE_URL}/search_result?keyword={keywords}"
+    async with page_pool.lease() as page:
+        if api_capture:
+            api_capture.reset("search", keywords)
+        await navigation_scheduler.goto(page, search_url)
+        
+        # 等待帖子卡片渲染完成
+        await wait_until_ready(page, "search_notes")
+        
+        # 优先使用捕获到的搜索接口数据，滚动加载的后续分页同样会被捕获
+        use_api = bool(api_capture and await api_capture.wait_for("search", keywords))
+        
+        posts: "OrderedDict[str, Dict[str, Any]]" = progress if progress is not None else OrderedDict()
+        complete = True
+        idle_rounds = 0
+        try:
+            for scroll_round in range(SEARCH_MAX_SCROLL_ROUNDS):
+                current_deadline = deadline()
+                if current_deadline is not None and time.monotonic() >= current_deadline:
+                    complete = False
+                    break
+                
+                if use_api:
+                    batch = [search_post_from_payload(item) for item in api_capture.searches.get(keywords, {}).values()]
+                else:
+                    with metrics.phase("extract"):
+                        cards = await page.evaluate(SEARCH_CARDS_SCRIPT)
+                    batch = []
+                    for card in cards:
+                        url = f"{BASE_URL}{card['href']}"
+                        batch.append({"url": url, "title": card["title"], "note_id": extract_note_id(url)})
+                
+                added = 0
+                reached_known = False
+                for post in batch:
+                    key = post["note_id"] or post["url"]
+                    if key in known_ids:
+                        reached_known = True
+                        continue
+                    if key not in posts:
+                        posts[key] = post
+                        added += 1
+                debug_log(f"第 {scroll_round + 1} 轮获取到 {added} 条新笔记，共 {len(posts)} 条")
+                await reporter.report(min(len(posts), limit), limit, f"已滚动 {scroll_round + 1} 轮，找到 {len(posts)} 条笔记")
+                
+                if len(posts) >= limit:
+                    break
+                
+                # 增量搜索：本轮没有新笔记且已经出现已知笔记，说明新内容已取完，无需继续滚动
+                if reached_known and not added:
+                    break
+                
+                # 连续多轮没有新结果，认为结果流已到底
+                idle_rounds = 0 if added else idle_rounds + 1
+                if idle_rounds >= SEARCH_MAX_IDLE_ROUNDS:
+                    break
+                
+                # 滚动加载下一屏
+                loaded = await page.evaluate("s => document.querySelectorAll(s).length", READY_SELECTORS["search_notes"])
+                with metrics.phase("scroll"):
+                    await page.evaluate("window.scrollBy(0, window.innerHeight * 2)")
+                await wait_for_more(page, READY_SELECTORS["search_notes"], loaded)
+        except asyncio.CancelledError:
+            save_partial_result("search_notes", keywords, list(posts.values())[:limit])
+            raise
+        
+        if not posts or DEBUG_MODE:
+            await debug_capture.capture(page, "search_notes", "no_results" if not posts else "debug", {
+                "keywords": keywords,
+                "source": "api" if use_api else "dom",
+                "found": len(posts)
+            })
+    
+    return list(posts.values())[:limit], complete
+
+@mcp.tool()
+@metrics.instrument
+async def search_notes(keywords: str, limit: int = 5, deadline_seconds: float = 0, ctx: Context = None) -> str:
+    """根据关键词搜索笔记
+    
+    Args:
+        keywords: 搜索关键词
+        limit: 返回结果数量限制
+        deadline_seconds: 最长执行时间（秒），到达后返回已找到的部分结果，0 表示不限制
+    """
+    deadline = time.monotonic() + deadline_seconds if deadline_seconds > 0 else None
+    try:
+        posts, complete = await search_posts(keywords, limit, ProgressReporter(ctx), deadline)
+    except LoginRequiredError as e:
+        return str(e)
+    except Exception as e:
+        return f"搜索笔记时出错: {str(e)}"
+    if not complete and not posts:
+        return TIMED_OUT_EMPTY_NOTICE.format("笔记")
+    
+    # 格式化返回结果
+    with metrics.phase("format"):
+        result = format_search_results(keywords, posts)
+    if not complete and posts:
+        result = PARTIAL_RESULT_NOTICE + result
+    return result
+
+# 直接打开笔记页时详情由服务端渲染，不会请求 feed 接口，此时从页面初始状态读取同样的数据
+INITIAL_STATE_NOTE_SCRIPT = '''
+(noteId) => {
+    const state = window.__INITIAL_STATE__;
+    const detailMap = state && state.note && state.note.noteDetailMap;
+    if (!detailMap) return null;
+    const entry = detailMap[noteId] || Object.values(detailMap)[0];
+    const note = entry && entry.note;
+    return note && (note.title || note.desc) ? JSON.parse(JSON.stringify(note)) : null;
+}
+'''
+
+# 一次性在页面内执行全部字段提取策略的脚本，返回各字段的值及命中的策略
+# order 为各字段策略的尝试顺序，见 NOTE_FIELD_STRATEGIES
+NOTE_EXTRACT_SCRIPT = r'''
+(order) => {
+    const text = el => (el && el.textContent ? el.textContent.trim() : '');
+    
+    // 评论区域，正文提取时需要排除
+    const commentAreas = Array.from(document.querySelectorAll(
+        '.comments-container, .comment-list, .feed-comment, div[data-v-aed4aacc], .comment-item'
+    ));
+    const inComment = el => commentAreas.some(area => area !== el && area.contains(el));
+    
+    // 依次尝试选择器，返回第一个有文本的元素
+    const firstText = selectors => {
+        for (const selector of selectors) {
+            const value = text(document.querySelector(selector));
+            if (value) return [value, selector];
+        }
+        return [null, null];
+    };
+    
+    // 查找第一个匹配正则的文本节点，返回其所在元素的文本
+    const firstTextMatching = regexes => {
+        for (const regex of regexes) {
+            const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+            let node;
+            while ((node = walker.nextNode())) {
+                if (regex.test(node.textContent)) {
+                    const value = text(node.parentElement);
+                    if (value) return value;
+                }
+            }
+        }
+        return null;
+    };
+    
+    const strategies = {};
+    
+    // 标题
+    let [title, titleStrategy] = firstText(order.title);
+    strategies.title = titleStrategy;
+    
+    // 作者
+    let [author, authorStrategy] = firstText(order.author);
+    strategies.author = authorStrategy;
+    
+    // 发布时间
+    const dateRegexes = [
+        /编辑于/,
+        /\d{2}-\d{2}/,
+        /\d{4}-\d{2}-\d{2}/,
+        /\d+月\d+日/,
+        /\d+天前/,
+        /\d+小时前/,
+        /今天/,
+        /昨天/
+    ];
+    let publishTime = null;
+    strategies.publish_time = null;
+    for (const name of order.publish_time) {
+        publishTime = name === 'text-regex' ? firstTextMatching(dateRegexes) : firstText([name])[0];
+        if (publishTime) {
+            strategies.publish_time = name;
+            break;
+        }
+    }
+    
+    // 正文
+    const contentStrategies = {
+        'detail-desc-note-text': () => {
+            const el = document.querySelector('#detail-desc .note-text');
+            const value = el && !inComment(el) ? text(el) : '';
+            return value.length > 50 ? value : null;
+        },
+        'xpath': () => {
+            const result = document.evaluate(
+                '//div[@id="detail-desc"]/span[@class="note-text"]',
+                document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+            );
+            const value = text(result.singleNodeValue);
+            return value.length > 20 ? value : null;
+        },
+        'longest-text': () => {
+            const candidates = Array.from(document.querySelectorAll('div#detail-desc, div.note-content, div.desc, span.note-text'))
+                .filter(el => !inComment(el))
+                .map(text)
+                .filter(value => value.length > 100 && value.length < 10000)
+                .sort((a, b) => b.length - a.length);
+            return candidates.length > 0 ? candidates[0] : null;
+        },
+        'note-content': () => {
+            const noteContent = document.querySelector('.note-content');
+            if (noteContent) {
+                const noteText = text(noteContent.querySelector('.note-text'));
+                if (noteText.length > 50) return noteText;
+                if (text(noteContent).length > 50) return text(noteContent);
+            }
+            const paragraphs = Array.from(document.querySelectorAll('p'))
+                .filter(p => !p.closest('.comments-container, .comment-list') && text(p).length > 10)
+                .map(text);
+            const joined = paragraphs.join('\n\n');
+            return joined.length > 50 ? joined : null;
+        },
+        'desc': () => {
+            const detailDesc = document.querySelector('div.note-content #detail-desc');
+            if (detailDesc) {
+                const value = text(detailDesc.querySelector('span.note-text')) || text(detailDesc);
+                if (value.length > 100) return value;
+            }
+            for (const desc of document.querySelectorAll('div.desc')) {
+                if (!desc.closest('.comments-container, .comment-list, .feed-comment') && text(desc).length > 100) {
+                    return text(desc);
+                }
+            }
+            return null;
+        }
+    };
+    let content = null;
+    strategies.content = null;
+    for (const name of order.content) {
+        try {
+            content = contentStrategies[name] ? contentStrategies[name]() : null;
+        } catch (e) {
+            content = null;
+        }
+        if (content) {
+            strategies.content = name;
+            break;
+        }
+    }
     
-    return True
-
-@mcp.tool()
-async def login() -> str:
-    """登录小红书账号"""
-    global is_logged_in
+    // 图文笔记的图片列表，轮播会克隆首尾图片，按 data-index 去重
+    const imagesMap = {};
+    document.querySelectorAll('div.swiper-wrapper > div[data-index]').forEach(slide => {
+        const img = slide.querySelector('.img-container img');
+        if (img && img.getAttribute('src')) {
+            imagesMap[slide.getAttribute('data-index')] = img.getAttribute('src');
+        }
+    });
+    const images = Object.keys(imagesMap)
+        .sort((a, b) => Number(a) - Number(b))
+        .map(key => imagesMap[key]);
     
-    await ensure_browser()
+    return {
+        title: title,
+        author: author,
+        publish_time: publishTime,
+        content: content,
+        images: images,
+        strategies: strategies
+    };
+}
+'''
+
+# 笔记各字段的提取策略，按默认优先级排列；实际尝试顺序由 selector_registry 根据命中情况调整
+NOTE_FIELD_STRATEGIES = {
+    "title": ["#detail-title", "div.title", "h1", "div.note-content div.title"],
+    "author": ["span.username", "a.name", ".author-wrapper .username", ".info .name"],
+    "publish_time": ["span.date", ".bottom-container .date", ".date", "text-regex"],
+    "content": ["detail-desc-note-text", "xpath", "longest-text", "note-content", "desc"]
+}
+
+def format_note_content(record: NoteRecord) -> str:
+    """格式化笔记内容"""
+    result = f"标题: {record.title}\n"
+    result += f"作者: {record.author}\n"
+    result += f"发布时间: {record.publish_time}\n"
+    if record.interact:
+        interact = record.interact
+        result += f"互动: 点赞 {interact['点赞']} / 收藏 {interact['收藏']} / 评论 {interact['评论']} / 分享 {interact['分享']}\n"
+    result += f"链接: {record.url}\n\n"
+    result += f"内容:\n{record.content}\n"
+    if record.images:
+        result += f"图片: {record.images}\n"
+    return result
+
+async def fetch_note(url: str, refresh: bool = False) -> NoteRecord:
+    """获取结构化的笔记数据，get_note_content、analyze_note 等工具都基于它实现
     
-    if is_logged_in:
-        return "已登录小红书账号"
+    同一篇笔记的并发请求（按笔记ID判断）只打开一次页面，其余调用共享结果。
     
-    # 访问小红书登录页面
-    await main_page.goto("https://www.xiaohongshu.com", timeout=60000)
-    await asyncio.sleep(3)
+    Args:
+        url: 笔记 URL
+        refresh: 为 True 时跳过缓存，重新从页面获取
     
-    # 查找登录按钮并点击
-    login_elements = await main_page.query_selector_all('text="登录"')
-    if login_elements:
-        await login_elements[0].click()
-        
-        # 提示用户手动登录
-        message = "请在打开的浏览器窗口中完成登录操作。登录成功后，系统将自动继续。"
-        
-        # 等待用户登录成功
-        max_wait_time = 180  # 等待3分钟
-        wait_interval = 5
-        waited_time = 0
-        
-        while waited_time < max_wait_time:
-            # 检查是否已登录成功
-            still_login = await main_page.query_selector_all('text="登录"')
-            if not still_login:
-                is_logged_in = True
-                await asyncio.sleep(2)  # 等待页面加载
-                return "登录成功！"
-            
-            # 继续等待
-            await asyncio.sleep(wait_interval)
-            waited_time += wait_interval
-        
-        return "登录等待超时。请重试或手动登录后再使用其他功能。"
-    else:
-        is_logged_in = True
-        return "已登录小红书账号"
+    Raises:
+        LoginRequiredError: 尚未登录小红书账号
+    """
+    record = await single_flight.do(
+        ("note", extract_note_id(url) or url, refresh),
+        lambda progress: _fetch_note(url, refresh)
+    )
+    if record.url != url:
+        record = replace(record, url=url)
+    return record
 
-@mcp.tool()
-async def search_notes(keywords: str, limit: int = 5) -> str:
-    """根据关键词搜索笔记
+async def _fetch_note(url: str, refresh: bool = False) -> NoteRecord:
+    note_id = extract_note_id(url)
+    if note_id and not refresh:
+        cached = note_cache.get(note_id, "note")
+        if cached:
+            metrics.count("cache_hits")
+            record = NoteRecord.from_dict(cached)
+            record.url = url
+            return record
+    
+    if worker_pool.active:
+        record = NoteRecord.from_dict(await worker_pool.run("note", url=url))
+        if note_id and record.has_content:
+            note_cache.put(note_id, "note", record.to_dict())
+        return record
     
-    Args:
-        keywords: 搜索关键词
-        limit: 返回结果数量限制
-    """
     login_status = await ensure_browser()
     if not login_status:
-        return "请先登录小红书账号"
+        raise LoginRequiredError("请先登录小红书账号")
     
-    # 构建搜索URL并访问
-    search_url = f"https://www.xiaohongshu.com/search_result?keyword={keywords}"
-    try:
-        await main_page.goto(search_url, timeout=60000)
-        await asyncio.sleep(5)  # 等待页面加载
-        
-        # 等待页面完全加载
-        await asyncio.sleep(5)
-        
-        # 打印页面HTML用于调试
-        page_html = await main_page.content()
-        print(f"页面HTML片段: {page_html[10000:10500]}...")
-        
-        # 使用更精确的选择器获取帖子卡片
-        print("尝试获取帖子卡片...")
-        post_cards = await main_page.query_selector_all('section.note-item')
-        print(f"找到 {len(post_cards)} 个帖子卡片")
-        
-        if not post_cards:
-            # 尝试备用选择器
-            post_cards = await main_page.query_selector_all('div[data-v-a264b01a]')
-            print(f"使用备用选择器找到 {len(post_cards)} 个帖子卡片")
-        
-        post_links = []
-        post_titles = []
-        
-        for card in post_cards:
-            try:
-                # 获取链接
-                link_element = await card.query_selector('a[href*="/search_result/"]')
-                if not link_element:
-                    continue
-                
-                href = await link_element.get_attribute('href')
-                if href and '/search_result/' in href:
-                    full_url = f"https://www.xiaohongshu.com{href}"
-                    post_links.append(full_url)
-                    
-                    # 尝试获取帖子标题
-                    try:
-                        # 打印卡片HTML用于调试
-                        card_html = await card.inner_html()
-                        print(f"卡片HTML片段: {card_html[:200]}...")
-                        
-                        # 首先尝试获取卡片内的footer中的标题
-                        title_element = await card.query_selector('div.footer a.title span')
-                        if title_element:
-                            title = await title_element.text_content()
-                            print(f"找到标题(方法1): {title}")
-                        else:
-                            # 尝试直接获取标题元素
-                            title_element = await card.query_selector('a.title span')
-                            if title_element:
-                                title = await title_element.text_content()
-                                print(f"找到标题(方法2): {title}")
-                            else:
-                                # 尝试获取任何可能的文本内容
-                                text_elements = await card.query_selector_all('span')
-                                potential_titles = []
-                                for text_el in text_elements:
-                                    text = await text_el.text_content()
-                                    if text and len(text.strip()) > 5:
-                                        potential_titles.append(text.strip())
-                                
-                                if potential_titles:
-                                    # 选择最长的文本作为标题
-                                    title = max(potential_titles, key=len)
-                                    print(f"找到可能的标题(方法3): {title}")
-                                else:
-                                    # 尝试直接获取卡片中的所有文本
-                                    all_text = await card.evaluate('el => Array.from(el.querySelectorAll("*")).map(node => node.textContent).filter(text => text && text.trim().length > 5)')
-                                    if all_text and len(all_text) > 0:
-                                        # 选择最长的文本作为标题
-                                        title = max(all_text, key=len)
-                                        print(f"找到可能的标题(方法4): {title}")
-                                    else:
-                                        title = "未知标题"
-                                        print("无法找到标题，使用默认值'未知标题'")
-                        
-                        # 如果获取到的标题为空，设为未知标题
-                        if not title or title.strip() == "":
-                            title = "未知标题"
-                            print("获取到的标题为空，使用默认值'未知标题'")
-                    except Exception as e:
-                        print(f"获取标题时出错: {str(e)}")
-                        title = "未知标题"
-                    
-                    post_titles.append(title)
-            except Exception as e:
-                print(f"处理帖子卡片时出错: {str(e)}")
+    async with page_pool.lease() as page:
+        if api_capture and note_id:
+            api_capture.reset("feed", note_id)
         
-        # 去重
-        unique_posts = []
-        seen_urls = set()
-        for url, title in zip(post_links, post_titles):
-            if url not in seen_urls:
-                seen_urls.add(url)
-                unique_posts.append({"url": url, "title": title})
-        
-        # 限制返回数量
-        unique_posts = unique_posts[:limit]
-        
-        # 格式化返回结果
-        if unique_posts:
-            result = "搜索结果：\n\n"
-            for i, post in enumerate(unique_posts, 1):
-                result += f"{i}. {post['title']}\n   链接: {post['url']}\n\n"
+        # 访问帖子链接
+        await navigation_scheduler.goto(page, url)
+        
+        # 等待标题或正文节点渲染完成
+        await wait_until_ready(page, "get_note_content")
+        
+        # 优先使用捕获到的接口数据或页面初始状态
+        record = None
+        if api_capture and note_id:
+            with metrics.phase("extract"):
+                payload = await api_capture.wait_for("feed", note_id, timeout=0.5)
+                if payload:
+                    record = note_from_payload(payload, url)
+                else:
+                    payload = await page.evaluate(INITIAL_STATE_NOTE_SCRIPT, note_id)
+                    if payload:
+                        record = note_from_payload(payload, url, source="initial_state")
+        
+        if record is None:
+            # 在页面内一次性执行全部提取策略，按各字段最近命中的策略优先尝试
+            order = {name: selector_registry.order(name) for name in NOTE_FIELD_STRATEGIES}
+            with metrics.phase("extract"):
+                extracted = await page.evaluate(NOTE_EXTRACT_SCRIPT, order)
+            debug_log(f"笔记字段命中策略: {extracted['strategies']}")
             
-            return result
-        else:
-            return f"未找到与\"{keywords}\"相关的笔记"
+            # 首选策略未命中的字段计为回退
+            fallbacks = 0
+            for name, strategy in extracted["strategies"].items():
+                selector_registry.record(name, strategy, order[name])
+                if strategy != order[name][0]:
+                    fallbacks += 1
+            if fallbacks:
+                metrics.count("selector_fallbacks", fallbacks)
+            if fallbacks or DEBUG_MODE:
+                reason = "no_content" if not extracted["content"] else ("fallback" if fallbacks else "debug")
+                await debug_capture.capture(page, "get_note_content", reason, {
+                    "strategies": extracted["strategies"],
+                    "order": order,
+                    "capture_api": bool(api_capture)
+                })
+            
+            record = NoteRecord(
+                url=url,
+                note_id=note_id,
+                title=extracted["title"] or "未知标题",
+                author=extracted["author"] or "未知作者",
+                publish_time=extracted["publish_time"] or "未知",
+                content=extracted["content"] or "未能获取内容",
+                images=extracted["images"],
+                strategies=extracted["strategies"]
+            )
     
-    except Exception as e:
-        return f"搜索笔记时出错: {str(e)}"
+    # 只缓存成功获取到正文的笔记
+    if note_id and record.has_content:
+        note_cache.put(note_id, "note", record.to_dict())
+    
+    return record
 
 @mcp.tool()
-async def get_note_content(url: str) -> str:
+@metrics.instrument
+async def get_note_content(url: str, refresh: bool = False, output_format: str = "text") -> str:
     """获取笔记内容
     
     Args:
         url: 笔记 URL
+        refresh: 为 True 时跳过缓存，重新从页面获取
+        output_format: 输出格式，"text" 为可读文本，"json" 为结构化的笔记数据
     """
-    login_status = await ensure_browser()
-    if not login_status:
-        return "请先登录小红书账号"
-    
     try:
-        # 访问帖子链接
-        await main_page.goto(url, timeout=60000)
-        await asyncio.sleep(10)  # 增加等待时间到10秒
-        
-        # 增强滚动操作以确保所有内容加载
-        await main_page.evaluate('''
-            () => {
-                // 先滚动到页面底部
-                window.scrollTo(0, document.body.scrollHeight);
-                setTimeout(() => { 
-                    // 然后滚动到中间
-                    window.scrollTo(0, document.body.scrollHeight / 2); 
-                }, 1000);
-                setTimeout(() => { 
-                    // 最后回到顶部
-                    window.scrollTo(0, 0); 
-                }, 2000);
-            }
-        ''')
-        await asyncio.sleep(3)  # 等待滚动完成和内容加载
-        
-        # 打印页面结构片段用于分析
-        try:
-            # print("打印页面结构片段用于分析")
-            page_structure = await main_page.evaluate('''
-                () => {
-                    // 获取笔记内容区域
-                    const noteContent = document.querySelector('.note-content');
-                    const detailDesc = document.querySelector('#detail-desc');
-                    const commentArea = document.querySelector('.comments-container, .comment-list');
-                    
-                    return {
-                        hasNoteContent: !!noteContent,
-                        hasDetailDesc: !!detailDesc,
-                        hasCommentArea: !!commentArea,
-                        noteContentHtml: noteContent ? noteContent.outerHTML.slice(0, 500) : null,
-                        detailDescHtml: detailDesc ? detailDesc.outerHTML.slice(0, 500) : null,
-                        commentAreaFirstChild: commentArea ? 
-                            (commentArea.firstElementChild ? commentArea.firstElementChild.outerHTML.slice(0, 500) : null) : null
-                    };
-                }
-            ''')
-            # print(f"页面结构分析: {json.dumps(page_structure, ensure_ascii=False, indent=2)}")
-        except Exception as e:
-            print(f"打印页面结构时出错: {str(e)}")
-        
-        # 获取帖子内容
-        post_content = {}
-        
-        # 获取帖子标题 - 方法1：使用id选择器
-        try:
-            # print("尝试获取标题 - 方法1：使用id选择器")
-            title_element = await main_page.query_selector('#detail-title')
-            if title_element:
-                title = await title_element.text_content()
-                post_content["标题"] = title.strip() if title else "未知标题"
-                # print(f"方法1获取到标题: {post_content['标题']}")
-            else:
-                # print("方法1未找到标题元素")
-                post_content["标题"] = "未知标题"
-        except Exception as e:
-            print(f"方法1获取标题出错: {str(e)}")
-            post_content["标题"] = "未知标题"
-        
-        # 获取帖子标题 - 方法2：使用class选择器
-        if post_content["标题"] == "未知标题":
-            try:
-                # print("尝试获取标题 - 方法2：使用class选择器")
-                title_element = await main_page.query_selector('div.title')
-                if title_element:
-                    title = await title_element.text_content()
-                    post_content["标题"] = title.strip() if title else "未知标题"
-                    # print(f"方法2获取到标题: {post_content['标题']}")
-                # else:
-                #     print("方法2未找到标题元素")
-            except Exception as e:
-                print(f"方法2获取标题出错: {str(e)}")
-        
-        # 获取帖子标题 - 方法3：使用JavaScript
-        if post_content["标题"] == "未知标题":
+        record = await fetch_note(url, refresh=refresh)
+    except LoginRequiredError as e:
+        return str(e)
+    except Exception as e:
+        return f"获取笔记内容时出错: {str(e)}"
+    
+    with metrics.phase("format"):
+        if output_format == "json":
+            return json.dumps(record.to_dict(), ensure_ascii=False)
+        return format_note_content(record)
+
+@mcp.tool()
+@metrics.instrument
+async def get_notes_content(
+    urls: List[str],
+    concurrency: int = BATCH_CONCURRENCY,
+    refresh: bool = False,
+    ctx: Context = None
+) -> List[Dict[str, Any]]:
+    """批量并发获取多篇笔记内容，结果与输入顺序一致，单篇失败不影响其他笔记
+    
+    Args:
+        urls: 笔记 URL 列表
+        concurrency: 最大并发数，实际并发同时受页面池大小限制
+        refresh: 为 True 时跳过缓存，重新从页面获取
+    
+    Returns:
+        list: 每个元素为 {"url", "note", "error"}，成功时 note 为结构化的笔记数据，失败时 error 为错误信息
+    """
+    reporter = ProgressReporter(ctx)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    finished = 0
+    
+    async def fetch_one(url: str) -> Dict[str, Any]:
+        nonlocal finished
+        async with semaphore:
             try:
-                # print("尝试获取标题 - 方法3：使用JavaScript")
-                title = await main_page.evaluate('''
-                    () => {
-                        // 尝试多种可能的标题选择器
-                        const selectors = [
-                            '#detail-title',
-                            'div.title',
-                            'h1',
-                            'div.note-content div.title'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
-                        }
-                        return null;
-                    }
-                ''')
-                if title:
-                    post_content["标题"] = title
-                    # print(f"方法3获取到标题: {post_content['标题']}")
-                # else:
-                #     print("方法3未找到标题元素")
+                record = await fetch_note(url, refresh=refresh)
+                result = {"url": url, "note": record.to_dict(), "error": None}
+            except LoginRequiredError as e:
+                result = {"url": url, "note": None, "error": str(e)}
             except Exception as e:
-                print(f"方法3获取标题出错: {str(e)}")
+                result = {"url": url, "note": None, "error": f"获取笔记内容时出错: {str(e)}"}
+        finished += 1
+        await reporter.report(finished, len(urls), f"已完成 {finished}/{len(urls)} 篇笔记")
+        return result
+    
+    return list(await asyncio.gather(*(fetch_one(url) for url in urls)))
+
+def format_comments(comments: List[Dict[str, Any]]) -> str:
+    """格式化评论列表"""
+    if not comments:
+        return "未找到任何评论，可能是帖子没有评论或评论区无法访问。"
+    
+    # 回复挂在父评论下显示，父评论不在列表中的回复按普通评论显示
+    ids = {comment.get("id") for comment in comments if comment.get("id")}
+    replies: Dict[str, List[Dict[str, Any]]] = {}
+    top_level = []
+    for comment in comments:
+        parent_id = comment.get("parent_id")
+        if parent_id and parent_id in ids:
+            replies.setdefault(parent_id, []).append(comment)
+        else:
+            top_level.append(comment)
+
+    reply_count = len(comments) - len(top_level)
+    if reply_count:
+        result = f"共获取到 {len(comments)} 条评论（其中回复 {reply_count} 条）：\n\n"
+    else:
+        result = f"共获取到 {len(comments)} 条评论：\n\n"
+
+    def thread_lines(comment_id: Optional[str], depth: int) -> str:
+        lines = ""
+        for reply in replies.get(comment_id, []) if comment_id else []:
+            lines += f"{'   ' * depth}↳ {reply['用户名']}（{reply['时间']}）: {reply['内容']}\n"
+            lines += thread_lines(reply.get("id"), depth + 1)
+        return lines
+
+    for i, comment in enumerate(top_level, 1):
+        result += f"{i}. {comment['用户名']}（{comment['时间']}）: {comment['内容']}\n"
+        result += thread_lines(comment.get("id"), 1) + "\n"
+    return result
+
+# 评论字段选择器，按优先级排列
+COMMENT_FIELD_SELECTORS = {
+    "user": ["span.user-name", "a.name", "div.username", "span.nickname", "a.user-nickname"],
+    "content": ["div.content", "p.content", "div.text", "span.content", "div.comment-text"],
+    "time": ["span.time", "div.time", "span.date", "div.date", "time"]
+}
+
+# 在页面内一次性序列化全部评论节点的脚本
+# 返回 {method, records, fieldHits}，records 中每条评论为 {user, content, time, id, parent_id}，
+# fieldHits 为各字段每个选择器命中的评论数
+# onlyNew 为 true 时只返回上次提取之后新出现的评论节点（已提取的节点会打上标记）
+COMMENT_EXTRACT_SCRIPT = r'''
+({commentSelectors, fieldSelectors, onlyNew}) => {
+    const MARK = 'data-mcp-extracted';
+    const text = el => (el && el.textContent ? el.textContent.trim() : '');
+    const fieldHits = {user: {}, content: {}, time: {}};
+    const firstText = (root, field) => {
+        for (const selector of fieldSelectors[field]) {
+            const el = root.querySelector(selector);
+            if (el) {
+                fieldHits[field][selector] = (fieldHits[field][selector] || 0) + 1;
+                return text(el);
+            }
+        }
+        return null;
+    };
+    const commentId = el => {
+        if (!el) return null;
+        const raw = el.getAttribute('data-comment-id') || el.getAttribute('data-id') || el.id || '';
+        return raw ? raw.replace(/^comment-/, '') : null;
+    };
+    
+    for (const selector of commentSelectors) {
+        const elements = Array.from(document.querySelectorAll(selector));
+        if (elements.length === 0) continue;
+        
+        const records = [];
+        for (const el of elements) {
+            if (onlyNew && el.hasAttribute(MARK)) continue;
+            let user = firstText(el, 'user');
+            if (user === null) {
+                const link = el.querySelector('a[href*="/user/profile/"]');
+                user = link ? text(link) : null;
+            }
+            
+            let content = firstText(el, 'content');
+            if (content === null) {
+                // 内容可能就在评论元素本身
+                const fullText = text(el);
+                content = user && fullText.includes(user) ? fullText.replace(user, '').trim() : fullText;
+            }
+            
+            // 回复可能嵌套在父评论内，也可能位于父评论旁的 reply-container 中
+            let parent = el.parentElement ? el.parentElement.closest(selector) : null;
+            if (!parent && el.closest('.reply-container')) {
+                const thread = el.closest('.parent-comment');
+                parent = thread ? thread.querySelector(selector) : null;
+                if (parent === el) parent = null;
+            }
+            
+            if (user && content && content.length > 2) {
+                if (onlyNew) el.setAttribute(MARK, '1');
+                records.push({
+                    user: user,
+                    content: content,
+                    time: firstText(el, 'time'),
+                    id: commentId(el),
+                    parent_id: commentId(parent)
+                });
+            }
+        }
         
-        # 获取作者 - 方法1：使用username类选择器
-        try:
-            # print("尝试获取作者 - 方法1：使用username类选择器")
-            author_element = await main_page.query_selector('span.username')
-            if author_element:
-                author = await author_element.text_content()
-                post_content["作者"] = author.strip() if author else "未知作者"
-                # print(f"方法1获取到作者: {post_content['作者']}")
-            else:
-                # print("方法1未找到作者元素")
-                post_content["作者"] = "未知作者"
-        except Exception as e:
-            print(f"方法1获取作者出错: {str(e)}")
-            post_content["作者"] = "未知作者"
+        // 找到评论就不继续尝试其他选择器了；增量提取时，已提取过的节点同样说明选择器命中
+        if (records.length > 0 || (onlyNew && elements.some(el => el.hasAttribute(MARK)))) {
+            return {method: selector, records: records, fieldHits: fieldHits};
+        }
+    }
+    
+    // 备用方法：通过用户主页链接定位评论
+    const records = [];
+    document.querySelectorAll('a[href*="/user/profile/"]').forEach(link => {
+        const user = text(link);
+        if (!user) return;
+        
+        let content = null;
+        let sibling = link.nextElementSibling;
+        while (sibling && !content) {
+            content = text(sibling) || null;
+            sibling = sibling.nextElementSibling;
+        }
+        if (!content && link.parentElement) {
+            const allText = text(link.parentElement);
+            content = allText.includes(user) ? allText.replace(user, '').trim() || null : null;
+        }
         
-        # 获取作者 - 方法2：使用链接选择器
-        if post_content["作者"] == "未知作者":
+        if (content) {
+            records.push({user: user, content: content, time: null, id: null, parent_id: null});
+        }
+    });
+    return {method: records.length > 0 ? 'profile-links' : null, records: records, fieldHits: fieldHits};
+}
+'''
+
+# 提取策略命中统计，笔记字段和评论字段共用
+selector_registry = SelectorRegistry(SELECTOR_STATS_PATH, {
+    **NOTE_FIELD_STRATEGIES,
+    "comment": COMMENT_SELECTORS + ["profile-links"],
+    **{f"comment_{name}": selectors for name, selectors in COMMENT_FIELD_SELECTORS.items()}
+})
+
+async def extract_loaded_comments(
+    page,
+    note_id: Optional[str],
+    only_new: bool = False,
+    capture_timeout: float = 0.5
+) -> List[Dict[str, Any]]:
+    """提取页面上已加载的评论，优先使用捕获到的评论分页接口数据
+    
+    only_new 为 True 时只从页面提取上次调用之后新出现的评论节点，接口数据始终全量返回。
+    capture_timeout 为等待评论接口数据的秒数，逐轮提取时只需第一轮等待，之后传 0。
+    """
+    captured = None
+    with metrics.phase("extract"):
+        if api_capture and note_id:
+            captured = await api_capture.wait_for("comments", note_id, timeout=capture_timeout)
+        if captured:
+            return [comment_from_payload(comment) for comment in captured.values()]
+        
+        # 在页面内一次性提取全部评论，按最近命中的选择器优先尝试
+        comment_order = selector_registry.order("comment")
+        field_order = {name: selector_registry.order(f"comment_{name}") for name in COMMENT_FIELD_SELECTORS}
+        extracted = await page.evaluate(COMMENT_EXTRACT_SCRIPT, {
+            "commentSelectors": [selector for selector in comment_order if selector != "profile-links"],
+            "fieldSelectors": field_order,
+            "onlyNew": only_new
+        })
+    debug_log(f"评论提取方法: {extracted['method']}，共 {len(extracted['records'])} 条")
+    
+    if extracted["records"]:
+        selector_registry.record("comment", extracted["method"], comment_order)
+        for name, hits in extracted["fieldHits"].items():
+            for selector, count in hits.items():
+                selector_registry.record(f"comment_{name}", selector, field_order[name], count)
+    if extracted["records"] and extracted["method"] != comment_order[0]:
+        metrics.count("selector_fallbacks")
+        await debug_capture.capture(page, "get_note_comments", "fallback", {
+            "method": extracted["method"],
+            "order": comment_order,
+            "records": len(extracted["records"])
+        })
+    
+    return [
+        {
+            "用户名": record["user"],
+            "内容": record["content"],
+            "时间": normalize_comment_time(record["time"]) or record["time"] or "未知时间",
+            "id": record["id"],
+            "parent_id": record["parent_id"]
+        }
+        for record in extracted["records"]
+    ]
+
+# 读取评论区标题中显示的评论总数，例如"共 123 条评论"
+COMMENT_TOTAL_SCRIPT = r'''
+() => {
+    const header = document.querySelector('.comments-container .total, .comments-el .total');
+    const source = header ? header.textContent : (document.querySelector('.comments-container') || document.body).innerText;
+    const match = (source || '').match(/共\s*(\d+)\s*条评论/);
+    return match ? parseInt(match[1], 10) : null;
+}
+'''
+
+# 批量点击"展开更多回复"/"展开 N 条回复"以及"查看更多评论"类按钮，返回点击数量
+COMMENT_EXPAND_SCRIPT = r'''
+(maxClicks) => {
+    const pattern = /^(展开\s*(更多|\d+\s*条)?\s*回复|查看更多评论|展开更多评论|加载更多)/;
+    const root = document.querySelector('.comments-container') || document.body;
+    const walker = document.createTreeWalker(root, NodeFilter.SHOW_TEXT);
+    const targets = new Set();
+    while (walker.nextNode() && targets.size < maxClicks) {
+        const node = walker.currentNode;
+        const el = node.parentElement;
+        if (!el || !pattern.test(node.textContent.trim())) continue;
+        // 只点击可见的按钮，已展开完毕的按钮会被隐藏或移除
+        if (el.offsetParent === null) continue;
+        targets.add(el.closest('.show-more, button, a') || el);
+    }
+    targets.forEach(el => el.click());
+    return targets.size;
+}
+'''
+
+# 将评论所在的滚动容器滚动到底部，返回是否已出现评论区结束标记
+COMMENT_SCROLL_SCRIPT = r'''
+() => {
+    const scroller = document.querySelector('.note-scroller');
+    if (scroller) {
+        scroller.scrollTop = scroller.scrollHeight;
+    } else {
+        window.scrollTo(0, document.body.scrollHeight);
+    }
+    return !!document.querySelector('.comments-container .end-container');
+}
+'''
+
+def comment_key(comment: Dict[str, Any]) -> str:
+    """评论去重键，优先使用评论ID，没有ID时使用用户名和内容"""
+    return comment.get("id") or f"{comment.get('用户名')}|{comment.get('内容')}"
+
+async def crawl_all_comments(
+    page,
+    url: str,
+    note_id: Optional[str],
+    reporter: "ProgressReporter",
+    deadline,
+    max_comments: int,
+    since: Optional[Dict[str, Any]] = None,
+    seen: Optional["OrderedDict[str, Dict[str, Any]]"] = None
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """在已打开的笔记页面上持续加载评论和回复，直到达到页面显示的评论总数或不再有新评论
+
+    每轮批量展开回复、滚动评论区，再增量提取新出现的评论并按评论ID去重。
+    返回 (评论列表, 是否完整)，因达到数量上限或时间上限而停止时视为不完整。
+    since 为 {"known": 已保存评论的去重键, "cursor_id": 最新评论ID} 时为增量模式，
+    某一轮新出现的评论全部是已保存的评论，或出现了游标所指的评论，即停止加载。
+    seen 为外部传入的已加载评论字典，加载过程中可从中读取部分结果。
+    deadline() 返回当前的截止时间，每轮开始前检查。
+    """
+    known = set(since.get("known") or []) if since else set()
+    cursor_id = since.get("cursor_id") if since else None
+    seen = seen if seen is not None else OrderedDict()
+    total = await page.evaluate(COMMENT_TOTAL_SCRIPT)
+    print(f"页面显示评论总数: {total if total is not None else '未知'}")
+
+    comment_item_selector = ", ".join(COMMENT_SELECTORS)
+    complete = False
+    idle_rounds = 0
+    rounds = 0
+    try:
+        while True:
+            current_deadline = deadline()
+            if current_deadline is not None and time.monotonic() >= current_deadline:
+                print("已达到时间上限，停止加载评论")
+                break
+            if len(seen) >= max_comments:
+                print(f"已达到评论数量上限 {max_comments}，停止加载评论")
+                break
+
+            rounds += 1
+            ended = False
             try:
-                # print("尝试获取作者 - 方法2：使用链接选择器")
-                author_element = await main_page.query_selector('a.name')
-                if author_element:
-                    author = await author_element.text_content()
-                    post_content["作者"] = author.strip() if author else "未知作者"
-                    # print(f"方法2获取到作者: {post_content['作者']}")
-                # else:
-                #     print("方法2未找到作者元素")
+                loaded = await page.evaluate("s => document.querySelectorAll(s).length", comment_item_selector)
+                expanded = await page.evaluate(COMMENT_EXPAND_SCRIPT, COMMENT_EXPAND_BATCH_SIZE)
+                with metrics.phase("scroll"):
+                    ended = await page.evaluate(COMMENT_SCROLL_SCRIPT)
+                await wait_for_more(page, comment_item_selector, loaded, timeout=2)
             except Exception as e:
-                print(f"方法2获取作者出错: {str(e)}")
+                expanded = 0
+                print(f"加载评论时出错: {str(e)}")
+
+            added_keys = []
+            capture_timeout = 0.5 if rounds == 1 else 0
+            for comment in await extract_loaded_comments(page, note_id, only_new=True, capture_timeout=capture_timeout):
+                key = comment_key(comment)
+                if key not in seen:
+                    seen[key] = comment
+                    added_keys.append(key)
+            added = len(added_keys)
+
+            progress_total = total if total else max(len(seen), 1)
+            await reporter.report(min(len(seen), progress_total), progress_total,
+                                  f"第 {rounds} 轮，已提取 {len(seen)} 条评论，本轮新增 {added} 条")
+
+            if total is not None and len(seen) >= total:
+                complete = True
+                break
+            # 增量模式：已经加载到上次抓取过的评论
+            if since and added_keys and (cursor_id in added_keys or all(key in known for key in added_keys)):
+                print(f"已加载到上次抓取过的评论，停止加载（第 {rounds} 轮）")
+                complete = True
+                break
+            # 已到评论区末尾且没有可展开的回复，或连续多轮没有新增评论
+            if ended and expanded == 0 and added == 0:
+                complete = True
+                break
+            idle_rounds = 0 if added else idle_rounds + 1
+            if idle_rounds >= COMMENT_CRAWL_MAX_IDLE_ROUNDS:
+                complete = True
+                break
+    except asyncio.CancelledError:
+        save_partial_result("get_note_comments", url, list(seen.values()))
+        raise
+
+    return list(seen.values())[:max_comments], complete
+
+async def fetch_comments(
+    url: str,
+    refresh: bool = False,
+    reporter: Optional["ProgressReporter"] = None,
+    deadline: Optional[float] = None,
+    exhaustive: bool = False,
+    max_comments: int = COMMENT_CRAWL_MAX_COMMENTS,
+    since: Optional[Dict[str, Any]] = None,
+    max_seconds: float = 0
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """获取笔记评论，返回 (评论列表, 是否完整)，获取到的评论同时合并进该笔记保存的评论线程
+    
+    同一篇笔记相同参数的并发请求只加载一次评论，各调用按自己的截止时间返回已加载的部分。
+    
+    Args:
+        url: 笔记 URL
+        refresh: 为 True 时跳过缓存，重新从页面获取
+        reporter: 进度通知，仅发给实际加载评论的调用
+        deadline: 本调用的 time.monotonic() 截止时间，到达后返回已提取的评论
+        exhaustive: 为 True 时持续加载并展开全部回复，直到达到页面显示的评论总数或不再有新评论
+        max_comments: 完整抓取模式下的评论数量上限
+        since: 增量获取时的已保存评论信息，见 crawl_all_comments，此时总是完整抓取且不使用缓存
+        max_seconds: 加载本身的最长时间（秒），从开始加载时计算，0 表示不限制
+    
+    Raises:
+        LoginRequiredError: 尚未登录小红书账号
+    """
+    def load(progress, shared_deadline):
+        crawl_deadline = time.monotonic() + max_seconds if max_seconds > 0 else None
         
-        # 获取作者 - 方法3：使用JavaScript
-        if post_content["作者"] == "未知作者":
-            try:
-                # print("尝试获取作者 - 方法3：使用JavaScript")
-                author = await main_page.evaluate('''
-                    () => {
-                        // 尝试多种可能的作者选择器
-                        const selectors = [
-                            'span.username',
-                            'a.name',
-                            '.author-wrapper .username',
-                            '.info .name'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
-                        }
-                        return null;
-                    }
-                ''')
-                if author:
-                    post_content["作者"] = author
-                    # print(f"方法3获取到作者: {post_content['作者']}")
-                # else:
-                #     print("方法3未找到作者元素")
-            except Exception as e:
-                print(f"方法3获取作者出错: {str(e)}")
+        def current_deadline():
+            # 加载时间上限和仍在等待的调用的截止时间，取较早者
+            deadlines = [value for value in (crawl_deadline, shared_deadline()) if value is not None]
+            return min(deadlines) if deadlines else None
         
-        # 获取发布时间 - 方法1：使用date类选择器
+        return _fetch_comments(url, refresh, reporter, current_deadline, exhaustive, max_comments, since, progress)
+    
+    comments, complete = await single_flight.do(
+        ("comments", extract_note_id(url) or url, refresh, exhaustive, max_comments, max_seconds, bool(since)),
+        load,
+        deadline,
+        lambda progress: (list(progress.values()), False)
+    )
+    note_id = extract_note_id(url)
+    if note_id and comments:
+        comment_threads.merge(note_id, comments)
+    return comments, complete
+
+async def _fetch_comments(
+    url: str,
+    refresh: bool,
+    reporter: Optional["ProgressReporter"],
+    deadline,
+    exhaustive: bool,
+    max_comments: int,
+    since: Optional[Dict[str, Any]] = None,
+    progress: Optional["OrderedDict[str, Dict[str, Any]]"] = None
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """执行一次评论加载，deadline() 返回当前的截止时间，见 SingleFlight"""
+    reporter = reporter or ProgressReporter()
+    note_id = extract_note_id(url)
+    cache_kind = "comments_all" if exhaustive else "comments"
+    if since:
+        # 增量获取的结果只是评论的一部分，不读写缓存
+        exhaustive, refresh, cache_kind = True, True, None
+    if note_id and not refresh:
+        cached = note_cache.get(note_id, cache_kind)
+        if cached:
+            metrics.count("cache_hits")
+            return cached, True
+    
+    if worker_pool.active:
+        comments, complete = await worker_pool.run(
+            "comments", url=url, exhaustive=exhaustive, max_comments=max_comments,
+            remaining=_remaining(deadline()), since=since
+        )
+        if complete and note_id and comments and cache_kind:
+            note_cache.put(note_id, cache_kind, comments)
+        return comments, complete
+    
+    login_status = await ensure_browser()
+    if not login_status:
+        raise LoginRequiredError("请先登录小红书账号")
+    
+    comments: List[Dict[str, Any]] = []
+    complete = True
+    async with page_pool.lease() as page:
         try:
-            # print("尝试获取发布时间 - 方法1：使用date类选择器")
-            time_element = await main_page.query_selector('span.date')
-            if time_element:
-                time_text = await time_element.text_content()
-                post_content["发布时间"] = time_text.strip() if time_text else "未知"
-                # print(f"方法1获取到发布时间: {post_content['发布时间']}")
-            else:
-                # print("方法1未找到发布时间元素")
-                post_content["发布时间"] = "未知"
-        except Exception as e:
-            print(f"方法1获取发布时间出错: {str(e)}")
-            post_content["发布时间"] = "未知"
-        
-        # 获取发布时间 - 方法2：使用正则表达式匹配
-        if post_content["发布时间"] == "未知":
-            try:
-                # print("尝试获取发布时间 - 方法2：使用正则表达式匹配")
-                time_selectors = [
-                    'text=/编辑于/',
-                    'text=/\\d{2}-\\d{2}/',
-                    'text=/\\d{4}-\\d{2}-\\d{2}/',
-                    'text=/\\d+月\\d+日/',
-                    'text=/\\d+天前/',
-                    'text=/\\d+小时前/',
-                    'text=/今天/',
-                    'text=/昨天/'
-                ]
-                
-                for selector in time_selectors:
-                    time_element = await main_page.query_selector(selector)
-                    if time_element:
-                        time_text = await time_element.text_content()
-                        post_content["发布时间"] = time_text.strip() if time_text else "未知"
-                        # print(f"方法2获取到发布时间: {post_content['发布时间']}")
+            if api_capture and note_id:
+                api_capture.reset("comments", note_id)
+            
+            # 访问帖子链接
+            await navigation_scheduler.goto(page, url)
+            
+            # 等待评论区渲染完成
+            await wait_until_ready(page, "get_note_comments")
+            
+            # 先滚动到评论区
+            comment_section_locators = [
+                page.get_by_text("条评论", exact=False),
+                page.get_by_text("评论", exact=False),
+                page.locator("text=评论").first
+            ]
+            
+            for locator in comment_section_locators:
+                try:
+                    if await locator.count() > 0:
+                        await locator.scroll_into_view_if_needed(timeout=5000)
                         break
-                    # else:
-                    #     print(f"方法2未找到发布时间元素: {selector}")
-            except Exception as e:
-                print(f"方法2获取发布时间出错: {str(e)}")
-        
-        # 获取发布时间 - 方法3：使用JavaScript
-        if post_content["发布时间"] == "未知":
-            try:
-                # print("尝试获取发布时间 - 方法3：使用JavaScript")
-                time_text = await main_page.evaluate(r'''
-                    () => {
-                        // 尝试多种可能的时间选择器
-                        const selectors = [
-                            'span.date',
-                            '.bottom-container .date',
-                            '.date'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
-                        }
-                        
-                        // 尝试查找包含日期格式的文本
-                        const dateRegexes = [
-                            /编辑于\s*([\d-]+)/,
-                            /(\d{2}-\d{2})/,
-                            /(\d{4}-\d{2}-\d{2})/,
-                            /(\d+月\d+日)/,
-                            /(\d+天前)/,
-                            /(\d+小时前)/,
-                            /(今天)/,
-                            /(昨天)/
-                        ];
-                        
-                        const allText = document.body.textContent;
-                        for (const regex of dateRegexes) {
-                            const match = allText.match(regex);
-                            if (match) {
-                                return match[0];
-                            }
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                if time_text:
-                    post_content["发布时间"] = time_text
-                    # print(f"方法3获取到发布时间: {post_content['发布时间']}")
-                # else:
-                #     print("方法3未找到发布时间元素")
-            except Exception as e:
-                print(f"方法3获取发布时间出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法1：使用精确的ID和class选择器
-        try:
-            # print("尝试获取正文内容 - 方法1：使用精确的ID和class选择器")
+                except Exception:
+                    continue
+            
+            if exhaustive:
+                comments, complete = await crawl_all_comments(page, url, note_id, reporter, deadline, max_comments, since, progress)
+                if note_id and comments and complete and cache_kind:
+                    note_cache.put(note_id, cache_kind, comments)
+                return comments, complete
             
-            # 先明确标记评论区域
-            await main_page.evaluate('''
-                () => {
-                    const commentSelectors = [
-                        '.comments-container', 
-                        '.comment-list',
-                        '.feed-comment',
-                        'div[data-v-aed4aacc]',  // 根据您提供的评论HTML结构
-                        '.content span.note-text'  // 评论中的note-text结构
-                    ];
+            # 滚动页面以加载更多评论，每轮只提取新出现的评论，以便汇报进度和保留部分结果
+            scroll_rounds = 8
+            comment_item_selector = ", ".join(COMMENT_SELECTORS)
+            seen: "OrderedDict[str, Dict[str, Any]]" = progress if progress is not None else OrderedDict()
+            capture_timeout = 0.5
+            
+            async def collect():
+                # 只在第一次提取时等待评论接口数据
+                nonlocal capture_timeout
+                for comment in await extract_loaded_comments(page, note_id, only_new=True, capture_timeout=capture_timeout):
+                    seen.setdefault(comment_key(comment), comment)
+                capture_timeout = 0
+                return list(seen.values())
+            
+            for i in range(scroll_rounds):
+                current_deadline = deadline()
+                if current_deadline is not None and time.monotonic() >= current_deadline:
+                    complete = False
+                    break
+                try:
+                    loaded = await page.evaluate("s => document.querySelectorAll(s).length", comment_item_selector)
+                    with metrics.phase("scroll"):
+                        await page.evaluate("window.scrollBy(0, 500)")
+                    await wait_for_more(page, comment_item_selector, loaded, timeout=1.5)
                     
-                    for (const selector of commentSelectors) {
-                        const elements = document.querySelectorAll(selector);
-                        elements.forEach(el => {
-                            if (el) {
-                                el.setAttribute('data-is-comment', 'true');
-                                console.log('标记评论区域:', el.tagName, el.className);
-                            }
-                        });
-                    }
-                }
-            ''')
+                    # 尝试点击"查看更多评论"按钮
+                    more_comment_selectors = [
+                        "text=查看更多评论",
+                        "text=展开更多评论",
+                        "text=加载更多",
+                        "text=查看全部"
+                    ]
+                    
+                    for selector in more_comment_selectors:
+                        try:
+                            more_btn = page.locator(selector).first
+                            if await more_btn.count() > 0 and await more_btn.is_visible():
+                                loaded = await page.evaluate("s => document.querySelectorAll(s).length", comment_item_selector)
+                                await more_btn.click()
+                                await wait_for_more(page, comment_item_selector, loaded)
+                        except Exception:
+                            continue
+                except Exception:
+                    pass
+                
+                comments = await collect()
+                await reporter.report(i + 1, scroll_rounds, f"已滚动 {i + 1} 轮，提取到 {len(comments)} 条评论")
             
-            # 先尝试获取detail-desc和note-text组合
-            content_element = await main_page.query_selector('#detail-desc .note-text')
-            if content_element:
-                # 检查是否在评论区域内
-                is_in_comment = await content_element.evaluate('(el) => !!el.closest("[data-is-comment=\'true\']") || false')
-                if not is_in_comment:
-                    content_text = await content_element.text_content()
-                    if content_text and len(content_text.strip()) > 50:  # 增加长度阈值
-                        post_content["内容"] = content_text.strip()
-                        # print(f"方法1获取到正文内容，长度: {len(post_content['内容'])}")
-                    else:
-                        # print(f"方法1获取到的内容太短: {len(content_text.strip() if content_text else 0)}")
-                        post_content["内容"] = "未能获取内容"
-                else:
-                    # print("方法1找到的元素在评论区域内，跳过")
-                    post_content["内容"] = "未能获取内容"
+            comments = await collect()
+        except asyncio.CancelledError:
+            # 完整抓取模式已自行保存部分结果
+            if not exhaustive:
+                save_partial_result("get_note_comments", url, comments)
+            raise
+    
+    if complete and note_id and comments:
+        note_cache.put(note_id, cache_kind, comments)
+    
+    return comments, complete
+
+@mcp.tool()
+@metrics.instrument
+async def get_note_comments(
+    url: str,
+    refresh: bool = False,
+    deadline_seconds: float = 0,
+    exhaustive: bool = False,
+    max_comments: int = COMMENT_CRAWL_MAX_COMMENTS,
+    max_seconds: float = COMMENT_CRAWL_MAX_SECONDS,
+    delta: bool = False,
+    ctx: Context = None
+) -> str:
+    """获取笔记评论
+    
+    Args:
+        url: 笔记 URL
+        refresh: 为 True 时跳过缓存，重新从页面获取
+        deadline_seconds: 最长执行时间（秒），到达后返回已获取的部分评论，0 表示不限制
+        exhaustive: 为 True 时完整抓取全部评论，并展开楼中楼回复
+        max_comments: 完整抓取模式下最多获取的评论数量
+        max_seconds: 完整抓取模式下最长的加载时间（秒）
+        delta: 为 True 时只加载到上次抓取过的评论为止，只返回新评论并合并进已保存的评论线程；
+            该笔记没有保存过评论时完整抓取一次
+    """
+    deadline = time.monotonic() + deadline_seconds if deadline_seconds > 0 else None
+    
+    since = None
+    thread = None
+    if delta:
+        note_id = extract_note_id(url)
+        thread = comment_threads.load(note_id) if note_id else None
+        if thread:
+            since = {
+                "known": [comment_key(comment) for comment in thread["comments"]],
+                "cursor_id": (thread.get("cursor") or {}).get("id")
+            }
+    try:
+        comments, complete = await fetch_comments(
+            url, refresh, ProgressReporter(ctx), deadline,
+            exhaustive=exhaustive or delta, max_comments=max_comments, since=since,
+            max_seconds=max_seconds if exhaustive or delta else 0
+        )
+    except LoginRequiredError as e:
+        return str(e)
+    except Exception as e:
+        return f"获取评论时出错: {str(e)}"
+    if not complete and not comments:
+        return TIMED_OUT_EMPTY_NOTICE.format("评论")
+    
+    if since:
+        known = set(since["known"])
+        new_comments = [comment for comment in comments if comment_key(comment) not in known]
+        cursor_time = (thread.get("cursor") or {}).get("time") or "未知"
+        header = f"已保存 {len(known)} 条评论（最新评论时间 {cursor_time}）"
+        if not new_comments:
+            return header + "，没有新评论。"
+        with metrics.phase("format"):
+            result = header + f"，本次新增 {len(new_comments)} 条，已合并保存：\n\n" + format_comments(new_comments)
+        return (PARTIAL_RESULT_NOTICE + result) if not complete else result
+    
+    # 格式化返回结果
+    with metrics.phase("format"):
+        result = format_comments(comments)
+    if not complete and comments:
+        if exhaustive and len(comments) >= max_comments:
+            result = f"（已达到评论数量上限 {max_comments}，以下为部分结果）\n\n" + result
+        else:
+            result = PARTIAL_RESULT_NOTICE + result
+    return result
+
+@mcp.tool()
+@metrics.instrument
+async def get_partial_result(tool: str, target: str) -> str:
+    """取回被取消（如客户端超时）的长时任务已收集到的部分结果
+    
+    Args:
+        tool: 被取消的工具名，可选 "search_notes" 或 "get_note_comments"
+        target: 调用该工具时使用的关键词或笔记 URL
+    """
+    partial = partial_results.get((_current_client.get(), tool, target))
+    if partial is None:
+        return f"没有找到 {tool} 对 \"{target}\" 的部分结果"
+    
+    header = f"以下为 {partial['saved_at']} 被取消时已收集到的部分结果：\n\n"
+    if tool == "search_notes":
+        return header + format_search_results(target, partial["items"])
+    return header + format_comments(partial["items"])
+
+def _readable_slug(keywords: str) -> str:
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", keywords).strip("_") or "keyword"
+
+def keyword_slug(keywords: str) -> str:
+    """关键词对应的目录名，可读部分之后附加关键词的短哈希，"a b" 与 "a_b" 不会共用目录"""
+    digest = hashlib.sha1(keywords.encode("utf-8")).hexdigest()[:8]
+    return f"{_readable_slug(keywords)}_{digest}"
+
+class ExportWriter:
+    """将导出的笔记和评论按块追加写入 CSV 或 Parquet 文件
+
+    每次写入后更新断点文件，记录已写入的笔记ID，中断后重新运行会跳过这些笔记。CSV 模式下
+    断点同时记录各文件写入后的字节数，追加后、更新断点前中断时，重新运行会先把文件截断回
+    断点记录的长度，避免同一块数据重复写入。
+    """
+
+    def __init__(self, directory: str, file_format: str):
+        self.directory = directory
+        self.file_format = file_format
+        self.checkpoint_path = os.path.join(directory, f"checkpoint_{file_format}.json")
+        os.makedirs(directory, exist_ok=True)
+        
+        state = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        self.completed = set(state.get("completed", []))
+        self.parts = state.get("parts", 0)
+        self.sizes: Dict[str, int] = state.get("sizes", {})
+        if file_format == "csv":
+            if "sizes" in state:
+                self._truncate_to_checkpoint()
             else:
-                # print("方法1未找到正文内容元素")
-                post_content["内容"] = "未能获取内容"
-        except Exception as e:
-            print(f"方法1获取正文内容出错: {str(e)}")
-            post_content["内容"] = "未能获取内容"
-        
-        # 获取帖子正文内容 - 方法2：使用XPath选择器
-        if post_content["内容"] == "未能获取内容":
+                # 首次运行（或旧版断点）以现有文件长度为基准，先写入断点再开始追加
+                self.sizes = self._csv_sizes()
+                self._save_checkpoint()
+        self._notes: List[Dict[str, Any]] = []
+        self._comments: List[Dict[str, Any]] = []
+        self._pending_ids: List[str] = []
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending_ids)
+
+    def add(self, note_key: str, note_row: Dict[str, Any], comment_rows: List[Dict[str, Any]]):
+        self._pending_ids.append(note_key)
+        self._notes.append(note_row)
+        self._comments.extend(comment_rows)
+
+    def _write(self, name: str, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        df = pd.DataFrame(rows)
+        if self.file_format == "parquet":
+            df.to_parquet(os.path.join(self.directory, f"{name}-part-{self.parts:05d}.parquet"), index=False)
+        else:
+            path = os.path.join(self.directory, f"{name}.csv")
+            header = not os.path.exists(path) or os.path.getsize(path) == 0
+            df.to_csv(path, mode="a", header=header, index=False, encoding="utf-8")
+
+    def _csv_sizes(self) -> Dict[str, int]:
+        sizes = {}
+        for name in ("notes", "comments"):
+            path = os.path.join(self.directory, f"{name}.csv")
+            sizes[name] = os.path.getsize(path) if os.path.exists(path) else 0
+        return sizes
+
+    def _truncate_to_checkpoint(self):
+        for name, size in self._csv_sizes().items():
+            recorded = self.sizes.get(name, 0)
+            if size > recorded:
+                print(f"{name}.csv 含有断点之后写入的 {size - recorded} 字节，已截断")
+                with open(os.path.join(self.directory, f"{name}.csv"), "r+b") as f:
+                    f.truncate(recorded)
+
+    def _save_checkpoint(self):
+        # 先写临时文件再替换，避免中断时断点文件损坏
+        state = {
+            "completed": sorted(self.completed),
+            "parts": self.parts,
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if self.file_format == "csv":
+            state["sizes"] = self.sizes
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def flush(self):
+        """写出缓冲的行并更新断点"""
+        if not self._pending_ids:
+            return
+        self.parts += 1
+        self._write("notes", self._notes)
+        self._write("comments", self._comments)
+        self.completed.update(self._pending_ids)
+        self._notes, self._comments, self._pending_ids = [], [], []
+        if self.file_format == "csv":
+            self.sizes = self._csv_sizes()
+        self._save_checkpoint()
+
+def note_export_row(record: NoteRecord, keywords: str) -> Dict[str, Any]:
+    """笔记数据转换为导出行"""
+    return {
+        "keyword": keywords,
+        "note_id": record.note_id,
+        "url": record.url,
+        "title": record.title,
+        "author": record.author,
+        "publish_time": record.publish_time,
+        "content": record.content,
+        "images": json.dumps(record.images, ensure_ascii=False),
+        "liked_count": record.interact.get("点赞"),
+        "collected_count": record.interact.get("收藏"),
+        "comment_count": record.interact.get("评论"),
+        "share_count": record.interact.get("分享"),
+        "ip_location": record.ip_location,
+        "source": record.source,
+        "export_run": TIMESTAMP
+    }
+
+def comment_export_row(comment: Dict[str, Any], note_id: Optional[str]) -> Dict[str, Any]:
+    """评论转换为导出行"""
+    return {
+        "note_id": note_id,
+        "comment_id": comment.get("id"),
+        "parent_id": comment.get("parent_id"),
+        "user": comment.get("用户名"),
+        "content": comment.get("内容"),
+        "time": comment.get("时间"),
+        "like_count": comment.get("点赞数"),
+        "ip_location": comment.get("IP属地"),
+        "export_run": TIMESTAMP
+    }
+
+@mcp.tool()
+@metrics.instrument
+async def export_keyword(
+    keywords: str,
+    limit: int = 20,
+    file_format: str = "csv",
+    include_comments: bool = True,
+    ctx: Context = None
+) -> str:
+    """搜索关键词并将笔记内容和评论流式导出到 DATA_DIR 下的 CSV 或 Parquet 文件
+    
+    导出按块追加写入，内存占用与笔记总数无关；中断后以相同参数重新运行，
+    会从上次写入完成的笔记之后继续。
+    
+    Args:
+        keywords: 搜索关键词
+        limit: 导出的笔记数量
+        file_format: 文件格式，"csv" 或 "parquet"（需要安装 pyarrow）
+        include_comments: 是否同时导出评论
+    """
+    if file_format not in ("csv", "parquet"):
+        return f"不支持的导出格式: {file_format}，可选 csv 或 parquet"
+    if file_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return "导出 Parquet 需要安装 pyarrow：pip install pyarrow"
+    
+    reporter = ProgressReporter(ctx)
+    directory = os.path.join(EXPORT_DIR, keyword_slug(keywords))
+    writer = ExportWriter(directory, file_format)
+    
+    try:
+        posts, _ = await search_posts(keywords, limit, reporter)
+    except LoginRequiredError as e:
+        return str(e)
+    except Exception as e:
+        return f"搜索笔记时出错: {str(e)}"
+    
+    pending = [post for post in posts if (post["note_id"] or post["url"]) not in writer.completed]
+    skipped = len(posts) - len(pending)
+    
+    # 多个页面并发抓取，结果队列有界，写入跟不上时抓取会暂停，保证内存占用平稳
+    jobs: asyncio.Queue = asyncio.Queue()
+    for post in pending:
+        jobs.put_nowait(post)
+    results: asyncio.Queue = asyncio.Queue(maxsize=BATCH_CONCURRENCY)
+    
+    async def worker():
+        while True:
             try:
-                # print("尝试获取正文内容 - 方法2：使用XPath选择器")
-                # 使用XPath获取笔记内容区域
-                content_text = await main_page.evaluate('''
-                    () => {
-                        const xpath = '//div[@id="detail-desc"]/span[@class="note-text"]';
-                        const result = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null);
-                        const element = result.singleNodeValue;
-                        return element ? element.textContent.trim() : null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 20:
-                    post_content["内容"] = content_text
-                    # print(f"方法2获取到正文内容，长度: {len(post_content['内容'])}")
-                # else:
-                #     print(f"方法2获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法2获取正文内容出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法3：使用JavaScript获取最长文本
-        if post_content["内容"] == "未能获取内容":
+                post = jobs.get_nowait()
+            except asyncio.QueueEmpty:
+                return
             try:
-                # print("尝试获取正文内容 - 方法3：使用JavaScript获取最长文本")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 定义评论区域选择器
-                        const commentSelectors = [
-                            '.comments-container', 
-                            '.comment-list',
-                            '.feed-comment',
-                            'div[data-v-aed4aacc]',
-                            '.comment-item',
-                            '[data-is-comment="true"]'
-                        ];
-                        
-                        // 找到所有评论区域
-                        let commentAreas = [];
-                        for (const selector of commentSelectors) {
-                            const elements = document.querySelectorAll(selector);
-                            elements.forEach(el => commentAreas.push(el));
-                        }
-                        
-                        // 查找可能的内容元素，排除评论区
-                        const contentElements = Array.from(document.querySelectorAll('div#detail-desc, div.note-content, div.desc, span.note-text'))
-                            .filter(el => {
-                                // 检查是否在评论区域内
-                                const isInComment = commentAreas.some(commentArea => 
-                                    commentArea && commentArea.contains(el));
-                                
-                                if (isInComment) {
-                                    console.log('排除评论区域内容:', el.tagName, el.className);
-                                    return false;
-                                }
-                                
-                                const text = el.textContent.trim();
-                                return text.length > 100 && text.length < 10000;
-                            })
-                            .sort((a, b) => b.textContent.length - a.textContent.length);
-                        
-                        if (contentElements.length > 0) {
-                            console.log('找到内容元素:', contentElements[0].tagName, contentElements[0].className);
-                            return contentElements[0].textContent.trim();
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 100:  # 增加长度阈值
-                    post_content["内容"] = content_text
-                    # print(f"方法3获取到正文内容，长度: {len(post_content['内容'])}")
-                # else:
-                #     print(f"方法3获取到的内容太短或为空: {len(content_text) if content_text else 0}")
+                record = await fetch_note(post["url"])
+                comments = (await fetch_comments(post["url"]))[0] if include_comments else []
+                await results.put((post, record, comments, None))
             except Exception as e:
-                print(f"方法3获取正文内容出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法4：区分正文和评论内容
-        if post_content["内容"] == "未能获取内容":
+                await results.put((post, None, [], e))
+    
+    workers = [asyncio.create_task(worker()) for _ in range(min(BATCH_CONCURRENCY, len(pending)))]
+    exported_notes = exported_comments = failed = 0
+    try:
+        for i in range(len(pending)):
+            post, record, comments, error = await results.get()
+            if error is not None:
+                failed += 1
+                print(f"导出笔记 {post['url']} 时出错: {str(error)}")
+            else:
+                note_id = record.note_id or post["note_id"]
+                writer.add(
+                    post["note_id"] or post["url"],
+                    note_export_row(record, keywords),
+                    [comment_export_row(comment, note_id) for comment in comments]
+                )
+                exported_notes += 1
+                exported_comments += len(comments)
+                if writer.pending >= EXPORT_CHUNK_SIZE:
+                    writer.flush()
+            await reporter.report(i + 1, len(pending), f"已处理 {i + 1}/{len(pending)} 篇笔记")
+    finally:
+        for task in workers:
+            task.cancel()
+        # 被取消或出错时也写出已完成的部分，下次从断点继续
+        writer.flush()
+    
+    return (
+        f"已导出 {exported_notes} 篇笔记、{exported_comments} 条评论到 {directory}\n"
+        f"跳过此前已导出的 {skipped} 篇，失败 {failed} 篇"
+    )
+
+class KeywordMonitor:
+    """按设定间隔增量搜索关键词，只记录之前没见过的笔记
+
+    每个关键词的检查点保存最近见过的笔记ID，搜索时某一屏只剩已知笔记即停止滚动，
+    稳定运行后每次的开销与新增内容成正比。新笔记追加到 <目录>/<关键词>_<哈希>/notes.jsonl。
+    调度使用 schedule，由事件循环内的后台任务定期调用 run_pending()；
+    监控配置和检查点保存在目录中，服务重启后恢复。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.config_path = os.path.join(directory, "monitors.json")
+        self.scheduler = schedule.Scheduler()
+        self.monitors: Dict[str, Dict[str, Any]] = {}
+        self._jobs: Dict[str, schedule.Job] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.config_path):
             try:
-                # print("尝试获取正文内容 - 方法4：区分正文和评论内容")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 首先尝试获取note-content区域
-                        const noteContent = document.querySelector('.note-content');
-                        if (noteContent) {
-                            // 查找note-text，这通常包含主要内容
-                            const noteText = noteContent.querySelector('.note-text');
-                            if (noteText && noteText.textContent.trim().length > 50) {
-                                return noteText.textContent.trim();
-                            }
-                            
-                            // 如果没有找到note-text或内容太短，返回整个note-content
-                            if (noteContent.textContent.trim().length > 50) {
-                                return noteContent.textContent.trim();
-                            }
-                        }
-                        
-                        // 如果上面的方法都失败了，尝试获取所有段落并拼接
-                        const paragraphs = Array.from(document.querySelectorAll('p'))
-                            .filter(p => {
-                                // 排除评论区段落
-                                const isInComments = p.closest('.comments-container, .comment-list');
-                                return !isInComments && p.textContent.trim().length > 10;
-                            });
-                            
-                        if (paragraphs.length > 0) {
-                            return paragraphs.map(p => p.textContent.trim()).join('\n\n');
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 50:
-                    post_content["内容"] = content_text
-                    # print(f"方法4获取到正文内容，长度: {len(post_content['内容'])}")
-                # else:
-                #     print(f"方法4获取到的内容太短或为空: {len(content_text) if content_text else 0}")
+                with open(self.config_path, "r", encoding="utf-8") as f:
+                    self.monitors = json.load(f)
             except Exception as e:
-                print(f"方法4获取正文内容出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法5：直接通过DOM结构定位
-        if post_content["内容"] == "未能获取内容":
+                print(f"读取关键词监控配置失败: {str(e)}")
+        self._migrate_legacy_directories()
+        for keyword, config in self.monitors.items():
+            self._schedule(keyword, config)
+
+    def _migrate_legacy_directories(self):
+        # 旧版目录名不含哈希，只有一个已登记关键词对应该目录时才能确定归属，迁移到新目录名
+        owners: Dict[str, List[str]] = {}
+        for keyword in self.monitors:
+            owners.setdefault(_readable_slug(keyword), []).append(keyword)
+        for legacy, keywords in owners.items():
+            legacy_dir = os.path.join(self.directory, legacy)
+            target_dir = os.path.join(self.directory, keyword_slug(keywords[0]))
+            if len(keywords) == 1 and os.path.isdir(legacy_dir) and not os.path.exists(target_dir):
+                os.replace(legacy_dir, target_dir)
+
+    def _write_json(self, path: str, data):
+        # 先写临时文件再替换，避免中断时文件损坏
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def _schedule(self, keyword: str, config: Dict[str, Any]):
+        if keyword in self._jobs:
+            self.scheduler.cancel_job(self._jobs.pop(keyword))
+        self._jobs[keyword] = self.scheduler.every(config["interval_minutes"]).minutes.do(self.start_run, keyword)
+
+    def paths(self, keyword: str) -> Tuple[str, str]:
+        """关键词的 (检查点文件, 新笔记文件)，只计算路径，目录在运行监控时才创建"""
+        directory = os.path.join(self.directory, keyword_slug(keyword))
+        return os.path.join(directory, "checkpoint.json"), os.path.join(directory, "notes.jsonl")
+
+    def load_checkpoint(self, keyword: str) -> Dict[str, Any]:
+        checkpoint_path, _ = self.paths(keyword)
+        checkpoint = {"seen_ids": [], "runs": 0, "total_new": 0, "last_run": None, "last_new": 0, "last_error": None}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint.update(json.load(f))
+        return checkpoint
+
+    def add(self, keyword: str, interval_minutes: int, limit: int, fetch_content: bool):
+        self.monitors[keyword] = {
+            "interval_minutes": interval_minutes,
+            "limit": limit,
+            "fetch_content": fetch_content,
+            "created_at": self.monitors.get(keyword, {}).get("created_at") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        self._write_json(self.config_path, self.monitors)
+        self._schedule(keyword, self.monitors[keyword])
+
+    def remove(self, keyword: str) -> bool:
+        """停止监控，已保存的笔记和检查点保留"""
+        if keyword not in self.monitors:
+            return False
+        del self.monitors[keyword]
+        self._write_json(self.config_path, self.monitors)
+        if keyword in self._jobs:
+            self.scheduler.cancel_job(self._jobs.pop(keyword))
+        return True
+
+    def next_run(self, keyword: str) -> Optional[datetime]:
+        job = self._jobs.get(keyword)
+        return job.next_run if job else None
+
+    def is_running(self, keyword: str) -> bool:
+        return keyword in self._running
+
+    def start(self):
+        """启动后台调度任务，需要在事件循环内调用"""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def _loop(self):
+        while True:
             try:
-                # print("尝试获取正文内容 - 方法5：直接通过DOM结构定位")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 根据您提供的HTML结构直接定位
-                        const noteContent = document.querySelector('div.note-content');
-                        if (noteContent) {
-                            const detailTitle = noteContent.querySelector('#detail-title');
-                            const detailDesc = noteContent.querySelector('#detail-desc');
-                            
-                            if (detailDesc) {
-                                const noteText = detailDesc.querySelector('span.note-text');
-                                if (noteText) {
-                                    return noteText.textContent.trim();
-                                }
-                                return detailDesc.textContent.trim();
-                            }
-                        }
-                        
-                        // 尝试其他可能的结构
-                        const descElements = document.querySelectorAll('div.desc');
-                        for (const desc of descElements) {
-                            // 检查是否在评论区
-                            const isInComment = desc.closest('.comments-container, .comment-list, .feed-comment');
-                            if (!isInComment && desc.textContent.trim().length > 100) {
-                                return desc.textContent.trim();
-                            }
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 100:
-                    post_content["内容"] = content_text
-                    # print(f"方法5获取到正文内容，长度: {len(post_content['内容'])}")
-                # else:
-                #     print(f"方法5获取到的内容太短或为空: {len(content_text) if content_text else 0}")
+                self.scheduler.run_pending()
             except Exception as e:
-                print(f"方法5获取正文内容出错: {str(e)}")
-        
-        # 获取图文帖子图片列表
-        imagesMap = {}
-        images = []
-        slides = main_page.locator("div.swiper-wrapper > div[data-index]")
-        count = await slides.count()
-        if count > 0:
-            for i in range(count):
-                try:
-                    slide = slides.nth(i)
-                    index = await slide.get_attribute("data-index")
-                    src = await slide.locator(".img-container img").get_attribute("src")
-                    imagesMap[index] = src
-                except Exception as e:
-                    print(f"获取图片 {i} 出错: {str(e)}")
-            if imagesMap:
-                images = [imagesMap[k] for k in sorted(imagesMap)]
-        
-        
-        # 格式化返回结果
-        result = f"标题: {post_content['标题']}\n"
-        result += f"作者: {post_content['作者']}\n"
-        result += f"发布时间: {post_content['发布时间']}\n"
-        result += f"链接: {url}\n\n"
-        result += f"内容:\n{post_content['内容']}\n"
-        if images:
-            result += f"图片: {images}\n"
-        
-        return result
+                print(f"关键词监控调度出错: {str(e)}")
+            idle = self.scheduler.idle_seconds
+            await asyncio.sleep(MONITOR_TICK_SECONDS if idle is None else min(max(idle, 1), MONITOR_TICK_SECONDS))
+
+    def start_run(self, keyword: str) -> asyncio.Task:
+        """开始一次监控运行，同一关键词上一次还未结束时返回正在进行的运行"""
+        task = self._running.get(keyword)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self.run_monitor(keyword))
+            self._running[keyword] = task
+            task.add_done_callback(functools.partial(self._finished, keyword))
+        return task
+
+    def _finished(self, keyword: str, task: asyncio.Task):
+        self._running.pop(keyword, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"监控关键词 {keyword} 时出错: {str(task.exception())}")
+
+    @metrics.instrument
+    async def run_monitor(self, keyword: str) -> List[Dict[str, Any]]:
+        """运行一次增量搜索，返回并保存新出现的笔记"""
+        config = self.monitors[keyword]
+        checkpoint_path, notes_path = self.paths(keyword)
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+        checkpoint = self.load_checkpoint(keyword)
+        seen = checkpoint["seen_ids"]
+        checkpoint["last_run"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            posts, _ = await search_posts(keyword, config["limit"], known_ids=set(seen))
+            rows = []
+            for post in posts:
+                row = {"found_at": checkpoint["last_run"], "keyword": keyword, **post}
+                if config.get("fetch_content"):
+                    try:
+                        row["note"] = (await fetch_note(post["url"])).to_dict()
+                    except LoginRequiredError:
+                        raise
+                    except Exception as e:
+                        row["error"] = str(e)
+                rows.append(row)
+        except Exception as e:
+            checkpoint["last_error"] = str(e)
+            self._write_json(checkpoint_path, checkpoint)
+            raise
+        
+        if rows:
+            with open(notes_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        seen.extend(post["note_id"] or post["url"] for post in posts)
+        checkpoint["seen_ids"] = seen[-MONITOR_SEEN_MAX:]
+        checkpoint["runs"] += 1
+        checkpoint["last_new"] = len(rows)
+        checkpoint["total_new"] += len(rows)
+        checkpoint["last_error"] = None
+        self._write_json(checkpoint_path, checkpoint)
+        print(f"关键词 {keyword} 监控完成，新增 {len(rows)} 篇笔记")
+        return rows
+
+
+keyword_monitor = KeywordMonitor(MONITOR_DIR)
+
+@mcp.tool()
+@metrics.instrument
+async def monitor_keyword(keywords: str, interval_minutes: int = 60, limit: int = 20, fetch_content: bool = False) -> str:
+    """登记需要定期监控的关键词并立即运行一次，之后每隔 interval_minutes 分钟只抓取之前没见过的笔记
+    
+    新笔记保存在 DATA_DIR/monitors/<关键词>_<哈希>/notes.jsonl，再次登记同一关键词会更新监控设置并保留检查点。
+    
+    Args:
+        keywords: 搜索关键词
+        interval_minutes: 监控间隔（分钟）
+        limit: 每次最多记录的新笔记数量
+        fetch_content: 是否同时获取新笔记的正文
+    """
+    keywords = keywords.strip()
+    if not keywords:
+        return "关键词不能为空"
+    if interval_minutes < 1:
+        return "监控间隔至少为 1 分钟"
+    keyword_monitor.add(keywords, interval_minutes, limit, fetch_content)
+    keyword_monitor.start()
+    _, notes_path = keyword_monitor.paths(keywords)
     
+    try:
+        # 调用被取消时本次运行继续在后台完成
+        rows = await asyncio.shield(keyword_monitor.start_run(keywords))
+    except LoginRequiredError as e:
+        return f"已登记监控，但本次运行失败：{str(e)}"
     except Exception as e:
-        return f"获取笔记内容时出错: {str(e)}"
+        return f"已登记监控，但本次运行时出错: {str(e)}"
+    return (
+        f"已登记关键词「{keywords}」的监控，每 {interval_minutes} 分钟运行一次\n"
+        f"本次新增 {len(rows)} 篇笔记，保存在 {notes_path}"
+    )
 
 @mcp.tool()
-async def get_note_comments(url: str) -> str:
-    """获取笔记评论
+async def list_monitors() -> str:
+    """列出已登记的关键词监控及其运行状态"""
+    if not keyword_monitor.monitors:
+        return "尚未登记任何关键词监控"
+    keyword_monitor.start()
+    result = f"共 {len(keyword_monitor.monitors)} 个关键词监控：\n\n"
+    for keyword, config in keyword_monitor.monitors.items():
+        checkpoint = keyword_monitor.load_checkpoint(keyword)
+        next_run = keyword_monitor.next_run(keyword)
+        result += f"「{keyword}」每 {config['interval_minutes']} 分钟，每次最多 {config['limit']} 篇\n"
+        result += f"   已运行 {checkpoint['runs']} 次，累计新增 {checkpoint['total_new']} 篇，已知笔记 {len(checkpoint['seen_ids'])} 篇\n"
+        if checkpoint["last_run"]:
+            result += f"   上次运行：{checkpoint['last_run']}，新增 {checkpoint['last_new']} 篇\n"
+        if checkpoint["last_error"]:
+            result += f"   上次错误：{checkpoint['last_error']}\n"
+        if keyword_monitor.is_running(keyword):
+            result += "   正在运行\n"
+        elif next_run:
+            result += f"   下次运行：{next_run.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        result += "\n"
+    return result
+
+@mcp.tool()
+async def get_monitor_updates(keywords: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """读取关键词监控最近发现的新笔记，按发现时间从新到旧排列
     
     Args:
-        url: 笔记 URL
+        keywords: 监控的关键词
+        limit: 返回的笔记数量
     """
-    login_status = await ensure_browser()
-    if not login_status:
-        return "请先登录小红书账号"
+    _, notes_path = keyword_monitor.paths(keywords.strip())
+    if not os.path.exists(notes_path):
+        return []
+    with open(notes_path, "r", encoding="utf-8") as f:
+        recent = deque(f, maxlen=max(1, limit))
+    return [json.loads(line) for line in reversed(recent)]
+
+@mcp.tool()
+async def remove_monitor(keywords: str) -> str:
+    """停止监控关键词，已保存的新笔记和检查点会保留
     
-    try:
-        # 访问帖子链接
-        await main_page.goto(url, timeout=60000)
-        await asyncio.sleep(5)  # 等待页面加载
-        
-        # 先滚动到评论区
-        comment_section_locators = [
-            main_page.get_by_text("条评论", exact=False),
-            main_page.get_by_text("评论", exact=False),
-            main_page.locator("text=评论").first
-        ]
-        
-        for locator in comment_section_locators:
-            try:
-                if await locator.count() > 0:
-                    await locator.scroll_into_view_if_needed(timeout=5000)
-                    await asyncio.sleep(2)
-                    break
-            except Exception:
-                continue
-        
-        # 滚动页面以加载更多评论
-        for i in range(8):
+    Args:
+        keywords: 监控的关键词
+    """
+    keywords = keywords.strip()
+    if not keyword_monitor.remove(keywords):
+        return f"没有找到关键词「{keywords}」的监控"
+    _, notes_path = keyword_monitor.paths(keywords)
+    return f"已停止监控关键词「{keywords}」，已发现的笔记保留在 {notes_path}"
+
+# 内置的热门领域关键词
+DEFAULT_DOMAIN_KEYWORDS = {
+    "美妆": ["口红", "粉底", "眼影", "护肤", "美妆", "化妆", "保湿", "精华", "面膜"],
+    "穿搭": ["穿搭", "衣服", "搭配", "时尚", "风格", "单品", "衣橱", "潮流"],
+    "美食": ["美食", "好吃", "食谱", "餐厅", "小吃", "甜点", "烘焙", "菜谱"],
+    "旅行": ["旅行", "旅游", "景点", "出行", "攻略", "打卡", "度假", "酒店"],
+    "母婴": ["宝宝", "母婴", "育儿", "儿童", "婴儿", "辅食", "玩具"],
+    "数码": ["数码", "手机", "电脑", "相机", "智能", "设备", "科技"],
+    "家居": ["家居", "装修", "家具", "设计", "收纳", "布置", "家装"],
+    "健身": ["健身", "运动", "瘦身", "减肥", "训练", "塑形", "肌肉"],
+    "AI": ["AI", "人工智能", "大模型", "编程", "开发", "技术", "Claude", "GPT"]
+}
+
+# 笔记中的话题标签，如 "#旅行攻略[话题]#"
+HASHTAG_PATTERN = re.compile(r"#([^#\s\[\]]+)(?:\[话题\])?#?")
+# 英文单词和数字混合的词，如 "GPT4"、"iPhone"
+LATIN_WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9+#.\-]*[A-Za-z0-9+#]")
+
+def _is_ascii_alnum(char: str) -> bool:
+    return char.isascii() and char.isalnum()
+
+
+class DomainClassifier:
+    """基于 Aho–Corasick 自动机的多模式领域分类器
+
+    构建时把所有领域词编译成一个自动机，分类时对文本只扫描一遍即可找出全部命中的词，
+    耗时与词表大小无关。匹配不区分大小写；英文等 ASCII 词只按整词匹配，前后紧邻字母或数字
+    时不算命中（"AI" 不会命中 "said"、"email"），与中文相邻时照常命中（"AI绘画"）。
+    """
+
+    def __init__(self, domain_terms: Dict[str, List[str]]):
+        self.domains = list(domain_terms)
+        # 每个状态的转移表、失败指针和在该状态结束的 (领域序号, 原始词) 列表
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, str]]] = [[]]
+        for index, domain in enumerate(self.domains):
+            for term in domain_terms[domain]:
+                if term:
+                    self._add(term.lower(), (index, term))
+        self._build_failure_links()
+
+    @classmethod
+    def load(cls, path: str) -> "DomainClassifier":
+        """从内置词表和配置文件构建分类器，配置文件不存在或无效时只使用内置词表"""
+        domain_terms = {domain: list(terms) for domain, terms in DEFAULT_DOMAIN_KEYWORDS.items()}
+        if os.path.exists(path):
             try:
-                await main_page.evaluate("window.scrollBy(0, 500)")
-                await asyncio.sleep(1)
-                
-                # 尝试点击"查看更多评论"按钮
-                more_comment_selectors = [
-                    "text=查看更多评论",
-                    "text=展开更多评论",
-                    "text=加载更多",
-                    "text=查看全部"
-                ]
-                
-                for selector in more_comment_selectors:
-                    try:
-                        more_btn = main_page.locator(selector).first
-                        if await more_btn.count() > 0 and await more_btn.is_visible():
-                            await more_btn.click()
-                            await asyncio.sleep(2)
-                    except Exception:
-                        continue
-            except Exception:
-                pass
-        
-        # 获取评论
-        comments = []
-        
-        # 使用特定评论选择器
-        comment_selectors = [
-            "div.comment-item", 
-            "div.commentItem",
-            "div.comment-content",
-            "div.comment-wrapper",
-            "section.comment",
-            "div.feed-comment"
-        ]
-        
-        for selector in comment_selectors:
-            comment_elements = main_page.locator(selector)
-            count = await comment_elements.count()
-            if count > 0:
-                for i in range(count):
-                    try:
-                        comment_element = comment_elements.nth(i)
-                        
-                        # 提取评论者名称
-                        username = "未知用户"
-                        username_selectors = ["span.user-name", "a.name", "div.username", "span.nickname", "a.user-nickname"]
-                        for username_selector in username_selectors:
-                            username_el = comment_element.locator(username_selector).first
-                            if await username_el.count() > 0:
-                                username = await username_el.text_content()
-                                username = username.strip()
-                                break
-                        
-                        # 如果没有找到，尝试通过用户链接查找
-                        if username == "未知用户":
-                            user_link = comment_element.locator('a[href*="/user/profile/"]').first
-                            if await user_link.count() > 0:
-                                username = await user_link.text_content()
-                                username = username.strip()
-                        
-                        # 提取评论内容
-                        content = "未知内容"
-                        content_selectors = ["div.content", "p.content", "div.text", "span.content", "div.comment-text"]
-                        for content_selector in content_selectors:
-                            content_el = comment_element.locator(content_selector).first
-                            if await content_el.count() > 0:
-                                content = await content_el.text_content()
-                                content = content.strip()
-                                break
-                        
-                        # 如果没有找到内容，可能内容就在评论元素本身
-                        if content == "未知内容":
-                            full_text = await comment_element.text_content()
-                            if username != "未知用户" and username in full_text:
-                                content = full_text.replace(username, "").strip()
-                            else:
-                                content = full_text.strip()
-                        
-                        # 提取评论时间
-                        time_location = "未知时间"
-                        time_selectors = ["span.time", "div.time", "span.date", "div.date", "time"]
-                        for time_selector in time_selectors:
-                            time_el = comment_element.locator(time_selector).first
-                            if await time_el.count() > 0:
-                                time_location = await time_el.text_content()
-                                time_location = time_location.strip()
-                                break
-                        
-                        # 如果内容有足够长度且找到用户名，添加评论
-                        if username != "未知用户" and content != "未知内容" and len(content) > 2:
-                            comments.append({
-                                "用户名": username,
-                                "内容": content,
-                                "时间": time_location
-                            })
-                    except Exception:
-                        continue
-                
-                # 如果找到了评论，就不继续尝试其他选择器了
-                if comments:
-                    break
-        
-        # 如果没有找到评论，尝试使用其他方法
-        if not comments:
-            # 获取所有用户名元素
-            username_elements = main_page.locator('a[href*="/user/profile/"]')
-            username_count = await username_elements.count()
-            
-            if username_count > 0:
-                for i in range(username_count):
-                    try:
-                        username_element = username_elements.nth(i)
-                        username = await username_element.text_content()
-                        
-                        # 尝试获取评论内容
-                        content = await main_page.evaluate('''
-                            (usernameElement) => {
-                                const parent = usernameElement.parentElement;
-                                if (!parent) return null;
-                                
-                                // 尝试获取同级的下一个元素
-                                let sibling = usernameElement.nextElementSibling;
-                                while (sibling) {
-                                    const text = sibling.textContent.trim();
-                                    if (text) return text;
-                                    sibling = sibling.nextElementSibling;
-                                }
-                                
-                                // 尝试获取父元素的文本，并过滤掉用户名
-                                const allText = parent.textContent.trim();
-                                if (allText && allText.includes(usernameElement.textContent.trim())) {
-                                    return allText.replace(usernameElement.textContent.trim(), '').trim();
-                                }
-                                
-                                return null;
-                            }
-                        ''', username_element)
-                        
-                        if username and content:
-                            comments.append({
-                                "用户名": username.strip(),
-                                "内容": content.strip(),
-                                "时间": "未知时间"
-                            })
-                    except Exception:
-                        continue
-        
-        # 格式化返回结果
-        if comments:
-            result = f"共获取到 {len(comments)} 条评论：\n\n"
-            for i, comment in enumerate(comments, 1):
-                result += f"{i}. {comment['用户名']}（{comment['时间']}）: {comment['内容']}\n\n"
-            return result
-        else:
-            return "未找到任何评论，可能是帖子没有评论或评论区无法访问。"
+                with open(path, "r", encoding="utf-8") as f:
+                    extra = json.load(f)
+                for domain, terms in extra.items():
+                    domain_terms.setdefault(domain, []).extend(terms)
+                print(f"已从 {path} 加载领域词表")
+            except Exception as e:
+                print(f"加载领域词表 {path} 失败，使用内置词表: {str(e)}")
+        return cls(domain_terms)
+
+    def _add(self, term: str, payload: Tuple[int, str]):
+        state = 0
+        for char in term:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(payload)
+
+    def _build_failure_links(self):
+        # 按层次遍历，失败指针指向当前前缀最长的、同时也是某个词前缀的后缀
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def scan(self, text: str) -> List[Tuple[int, str]]:
+        """扫描一遍文本，按出现顺序返回全部命中的 (领域序号, 词)"""
+        matches = []
+        state = 0
+        text = text.lower()
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for payload in self._output[state]:
+                term = payload[1]
+                if term.isascii() and not self._is_whole_word(text, position + 1 - len(term), position + 1):
+                    continue
+                matches.append(payload)
+        return matches
+
+    @staticmethod
+    def _is_whole_word(text: str, start: int, end: int) -> bool:
+        return not (start > 0 and _is_ascii_alnum(text[start - 1])) and \
+            not (end < len(text) and _is_ascii_alnum(text[end]))
+
+    def classify(self, text: str) -> Tuple[List[str], List[str]]:
+        """返回 (领域列表, 命中的词)，领域按命中次数从多到少排列，没有命中时为 ["生活"]"""
+        counts: Dict[int, int] = {}
+        terms: Dict[str, None] = {}
+        for index, term in self.scan(text):
+            counts[index] = counts.get(index, 0) + 1
+            terms[term] = None
+        ranked = sorted(counts, key=lambda index: (-counts[index], index))
+        domains = [self.domains[index] for index in ranked] or ["生活"]
+        return domains, list(terms)
+
+
+domain_classifier = DomainClassifier.load(DOMAIN_TERMS_PATH)
+
+def analyze_record(record: NoteRecord) -> dict:
+    """分析笔记数据，识别领域并提取关键词"""
+    text = f"{record.title}\n{record.content}"
+    detected_domains, matched_terms = domain_classifier.classify(text)
     
+    # 关键词依次取话题标签、命中的领域词和英文词，去重后保留前20个
+    keywords: Dict[str, None] = {}
+    for word in HASHTAG_PATTERN.findall(text) + matched_terms + LATIN_WORD_PATTERN.findall(text):
+        keywords.setdefault(word, None)
+    
+    # 返回分析结果
+    return {
+        "url": record.url,
+        "标题": record.title,
+        "作者": record.author,
+        "内容": record.content,
+        "领域": detected_domains,
+        "关键词": list(keywords)[:20]
+    }
+
+async def fetch_note_analysis(url: str, refresh: bool = False) -> dict:
+    """获取笔记数据并分析，出错时返回包含 error 的字典"""
+    try:
+        record = await fetch_note(url, refresh=refresh)
+    except LoginRequiredError as e:
+        return {"error": str(e)}
     except Exception as e:
-        return f"获取评论时出错: {str(e)}"
+        return {"error": f"获取笔记内容时出错: {str(e)}"}
+    
+    try:
+        return analyze_record(record)
+    except Exception as e:
+        return {"error": f"分析笔记内容时出错: {str(e)}"}
 
 @mcp.tool()
-async def analyze_note(url: str) -> dict:
+@metrics.instrument
+async def analyze_note(url: str, refresh: bool = False) -> dict:
     """获取并分析笔记内容，返回笔记的详细信息供AI生成评论
     
     Args:
         url: 笔记 URL
+        refresh: 为 True 时跳过缓存，重新从页面获取
     """
-    login_status = await ensure_browser()
-    if not login_status:
-        return {"error": "请先登录小红书账号"}
+    return await fetch_note_analysis(url, refresh=refresh)
+
+@mcp.tool()
+@metrics.instrument
+async def classify_cached_notes(urls: Optional[List[str]] = None, limit: int = 200) -> List[Dict[str, Any]]:
+    """批量对本地缓存中的笔记做领域分类，不访问页面
     
-    try:
-        # 直接调用get_note_content获取笔记内容
-        note_content_result = await get_note_content(url)
-        
-        # 检查是否获取成功
-        if note_content_result.startswith("请先登录") or note_content_result.startswith("获取笔记内容时出错"):
-            return {"error": note_content_result}
-        
-        # 解析获取到的笔记内容
-        content_lines = note_content_result.strip().split('\n')
-        post_content = {}
-        
-        # 提取标题、作者、发布时间和内容
-        for i, line in enumerate(content_lines):
-            if line.startswith("标题:"):
-                post_content["标题"] = line.replace("标题:", "").strip()
-            elif line.startswith("作者:"):
-                post_content["作者"] = line.replace("作者:", "").strip()
-            elif line.startswith("发布时间:"):
-                post_content["发布时间"] = line.replace("发布时间:", "").strip()
-            elif line.startswith("内容:"):
-                # 内容可能有多行，获取剩余所有行
-                content_text = "\n".join(content_lines[i+1:]).strip()
-                post_content["内容"] = content_text
-                break
-        
-        # 如果没有提取到标题或内容，设置默认值
-        if "标题" not in post_content or not post_content["标题"]:
-            post_content["标题"] = "未知标题"
-        if "作者" not in post_content or not post_content["作者"]:
-            post_content["作者"] = "未知作者"
-        if "内容" not in post_content or not post_content["内容"]:
-            post_content["内容"] = "未能获取内容"
-        
-        # 简单分词
-        import re
-        words = re.findall(r'\w+', f"{post_content.get('标题', '')} {post_content.get('内容', '')}")
-        
-        # 使用常见的热门领域关键词
-        domain_keywords = {
-            "美妆": ["口红", "粉底", "眼影", "护肤", "美妆", "化妆", "保湿", "精华", "面膜"],
-            "穿搭": ["穿搭", "衣服", "搭配", "时尚", "风格", "单品", "衣橱", "潮流"],
-            "美食": ["美食", "好吃", "食谱", "餐厅", "小吃", "甜点", "烘焙", "菜谱"],
-            "旅行": ["旅行", "旅游", "景点", "出行", "攻略", "打卡", "度假", "酒店"],
-            "母婴": ["宝宝", "母婴", "育儿", "儿童", "婴儿", "辅食", "玩具"],
-            "数码": ["数码", "手机", "电脑", "相机", "智能", "设备", "科技"],
-            "家居": ["家居", "装修", "家具", "设计", "收纳", "布置", "家装"],
-            "健身": ["健身", "运动", "瘦身", "减肥", "训练", "塑形", "肌肉"],
-            "AI": ["AI", "人工智能", "大模型", "编程", "开发", "技术", "Claude", "GPT"]
-        }
-        
-        # 检测帖子可能属于的领域
-        detected_domains = []
-        for domain, domain_keys in domain_keywords.items():
-            for key in domain_keys:
-                if key.lower() in post_content.get("标题", "").lower() or key.lower() in post_content.get("内容", "").lower():
-                    detected_domains.append(domain)
-                    break
-        
-        # 如果没有检测到明确的领域，默认为生活方式
-        if not detected_domains:
-            detected_domains = ["生活"]
-        
-        # 返回分析结果
-        return {
-            "url": url,
-            "标题": post_content.get("标题", "未知标题"),
-            "作者": post_content.get("作者", "未知作者"),
-            "内容": post_content.get("内容", "未能获取内容"),
-            "领域": detected_domains,
-            "关键词": list(set(words))[:20]  # 取前20个不重复的词作为关键词
-        }
+    Args:
+        urls: 要分类的笔记 URL 列表，不传时分类缓存中最近抓取的笔记
+        limit: 不传 urls 时最多分类的笔记数量
     
-    except Exception as e:
-        return {"error": f"分析笔记内容时出错: {str(e)}"}
+    Returns:
+        list: 每个元素为 {"note_id", "url", "标题", "领域", "关键词"}，未缓存的笔记返回 error
+    """
+    if urls:
+        entries = []
+        for url in urls:
+            note_id = extract_note_id(url)
+            data = note_cache.get(note_id, "note") if note_id else None
+            entries.append((url, data))
+    else:
+        entries = [(data.get("url"), data) for _, data in note_cache.items("note", limit)]
+    
+    results = []
+    for url, data in entries:
+        if data is None:
+            results.append({"url": url, "error": "缓存中没有该笔记，请先调用 get_note_content 获取"})
+            continue
+        analysis = analyze_record(NoteRecord.from_dict(data))
+        results.append({
+            "note_id": data.get("note_id"),
+            "url": analysis["url"],
+            "标题": analysis["标题"],
+            "领域": analysis["领域"],
+            "关键词": analysis["关键词"]
+        })
+    return results
 
 @mcp.tool()
-async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
+@metrics.instrument
+async def post_smart_comment(url: str, comment_type: str = "引流", refresh: bool = False) -> dict:
     """
     根据帖子内容发布智能评论，增加曝光并引导用户关注或私聊
 
@@ -1052,12 +3520,13 @@ async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
                      "点赞" - 简单互动获取好感
                      "咨询" - 以问题形式增加互动
                      "专业" - 展示专业知识建立权威
+        refresh: 为 True 时跳过缓存，重新从页面获取笔记内容
 
     Returns:
         dict: 包含笔记信息和评论类型的字典，供MCP客户端(如Claude)生成评论
     """
     # 获取笔记内容
-    note_info = await analyze_note(url)
+    note_info = await fetch_note_analysis(url, refresh=refresh)
     
     if "error" in note_info:
         return {"error": note_info["error"]}
@@ -1085,6 +3554,7 @@ async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
 # 3. post_smart_comment - 结合前两个功能，使用MCP客户端的AI能力生成评论
 
 @mcp.tool()
+@metrics.instrument
 async def post_comment(url: str, comment: str) -> str:
     """发布评论到指定笔记
     
@@ -1096,146 +3566,222 @@ async def post_comment(url: str, comment: str) -> str:
     if not login_status:
         return "请先登录小红书账号，才能发布评论"
     
-    try:
-        # 访问帖子链接
-        await main_page.goto(url, timeout=60000)
-        await asyncio.sleep(5)  # 等待页面加载
-        
-        # 定位评论区域并滚动到该区域
-        comment_area_found = False
-        comment_area_selectors = [
-            'text="条评论"',
-            'text="共 " >> xpath=..',
-            'text=/\\d+ 条评论/',
-            'text="评论"',
-            'div.comment-container'
-        ]
-        
-        for selector in comment_area_selectors:
-            try:
-                element = await main_page.query_selector(selector)
-                if element:
-                    await element.scroll_into_view_if_needed()
-                    await asyncio.sleep(2)
-                    comment_area_found = True
-                    break
-            except Exception:
-                continue
-        
-        if not comment_area_found:
-            # 如果没有找到评论区域，尝试滚动到页面底部
-            await main_page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-            await asyncio.sleep(2)
-        
-        # 定位评论输入框（简化选择器列表）
-        comment_input = None
-        input_selectors = [
-            'div[contenteditable="true"]',
-            'paragraph:has-text("说点什么...")',
-            'text="说点什么..."',
-            'text="评论发布后所有人都能看到"'
-        ]
+    async with page_pool.lease(write=True) as page:
+        try:
+            # 访问帖子链接
+            await navigation_scheduler.goto(page, url)
+        
+            # 等待评论区或输入框渲染完成
+            await wait_until_ready(page, "post_comment")
+        
+            # 定位评论区域并滚动到该区域
+            comment_area_found = False
+            comment_area_selectors = [
+                'text="条评论"',
+                'text="共 " >> xpath=..',
+                'text=/\\d+ 条评论/',
+                'text="评论"',
+                'div.comment-container'
+            ]
+        
+            for selector in comment_area_selectors:
+                try:
+                    element = await page.query_selector(selector)
+                    if element:
+                        await element.scroll_into_view_if_needed()
+                        comment_area_found = True
+                        break
+                except Exception:
+                    continue
         
-        # 尝试常规选择器
-        for selector in input_selectors:
-            try:
-                element = await main_page.query_selector(selector)
-                if element and await element.is_visible():
-                    await element.scroll_into_view_if_needed()
-                    await asyncio.sleep(1)
-                    comment_input = element
-                    break
-            except Exception:
-                continue
+            if not comment_area_found:
+                # 如果没有找到评论区域，尝试滚动到页面底部
+                await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
+        
+            # 定位评论输入框（简化选择器列表）
+            comment_input = None
+            input_selectors = [
+                'div[contenteditable="true"]',
+                'paragraph:has-text("说点什么...")',
+                'text="说点什么..."',
+                'text="评论发布后所有人都能看到"'
+            ]
+        
+            # 尝试常规选择器
+            for selector in input_selectors:
+                try:
+                    element = await page.query_selector(selector)
+                    if element and await element.is_visible():
+                        await element.scroll_into_view_if_needed()
+                        comment_input = element
+                        break
+                except Exception:
+                    continue
         
-        # 如果常规选择器失败，使用JavaScript查找
-        if not comment_input:
-            # 使用更精简的JavaScript查找输入框
-            js_result = await main_page.evaluate('''
-                () => {
-                    // 查找可编辑元素
-                    const editableElements = Array.from(document.querySelectorAll('[contenteditable="true"]'));
-                    if (editableElements.length > 0) return true;
+            # 如果常规选择器失败，使用JavaScript查找
+            if not comment_input:
+                # 使用更精简的JavaScript查找输入框
+                js_result = await page.evaluate('''
+                    () => {
+                        // 查找可编辑元素
+                        const editableElements = Array.from(document.querySelectorAll('[contenteditable="true"]'));
+                        if (editableElements.length > 0) return true;
                     
-                    // 查找包含“说点什么”的元素
-                    const placeholderElements = Array.from(document.querySelectorAll('*'))
-                        .filter(el => el.textContent && el.textContent.includes('说点什么'));
-                    return placeholderElements.length > 0;
-                }
-            ''')
+                        // 查找包含“说点什么”的元素
+                        const placeholderElements = Array.from(document.querySelectorAll('*'))
+                            .filter(el => el.textContent && el.textContent.includes('说点什么'));
+                        return placeholderElements.length > 0;
+                    }
+                ''')
             
-            if js_result:
-                # 如果JS检测到输入框，尝试点击页面底部
-                await main_page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-                await asyncio.sleep(1)
+                if js_result:
+                    # 如果JS检测到输入框，尝试点击页面底部
+                    await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
+                    await wait_until_ready(page, "post_comment", 'div[contenteditable="true"]')
                 
-                # 尝试再次查找输入框
-                for selector in input_selectors:
-                    try:
-                        element = await main_page.query_selector(selector)
-                        if element and await element.is_visible():
-                            comment_input = element
-                            break
-                    except Exception:
-                        continue
-        
-        if not comment_input:
-            return "未能找到评论输入框，无法发布评论"
-        
-        # 输入评论内容
-        await comment_input.click()
-        await asyncio.sleep(1)
-        await main_page.keyboard.type(comment)
-        await asyncio.sleep(1)
+                    # 尝试再次查找输入框
+                    for selector in input_selectors:
+                        try:
+                            element = await page.query_selector(selector)
+                            if element and await element.is_visible():
+                                comment_input = element
+                                break
+                        except Exception:
+                            continue
         
-        # 发送评论（简化发送逻辑）
-        send_success = False
+            if not comment_input:
+                await debug_capture.capture(page, "post_comment", "no_input", {"input_selectors": input_selectors})
+                return "未能找到评论输入框，无法发布评论"
         
-        # 方法1: 尝试点击发送按钮
-        try:
-            send_button = await main_page.query_selector('button:has-text("发送")')
-            if send_button and await send_button.is_visible():
-                await send_button.click()
-                await asyncio.sleep(2)
-                send_success = True
-        except Exception:
-            pass
+            # 输入评论内容
+            await comment_input.click()
+            await page.keyboard.type(comment)
         
-        # 方法2: 如果方法1失败，尝试使用Enter键
-        if not send_success:
+            # 等待发送按钮出现
             try:
-                await main_page.keyboard.press("Enter")
-                await asyncio.sleep(2)
-                send_success = True
-            except Exception:
+                await page.wait_for_selector('button:has-text("发送")', state="visible", timeout=3000)
+            except PlaywrightTimeoutError:
                 pass
         
-        # 方法3: 如果方法2失败，尝试使用JavaScript点击发送按钮
-        if not send_success:
+            # 发送评论（简化发送逻辑）
+            send_success = False
+        
+            # 方法1: 尝试点击发送按钮
             try:
-                js_send_result = await main_page.evaluate('''
-                    () => {
-                        const sendButtons = Array.from(document.querySelectorAll('button'))
-                            .filter(btn => btn.textContent && btn.textContent.includes('发送'));
-                        if (sendButtons.length > 0) {
-                            sendButtons[0].click();
-                            return true;
-                        }
-                        return false;
-                    }
-                ''')
-                await asyncio.sleep(2)
-                send_success = js_send_result
+                send_button = await page.query_selector('button:has-text("发送")')
+                if send_button and await send_button.is_visible():
+                    await send_button.click()
+                    await wait_for_network_idle(page)
+                    send_success = True
             except Exception:
                 pass
         
-        if send_success:
-            return f"已成功发布评论：{comment}"
-        else:
-            return f"发布评论失败，请检查评论内容或网络连接"
+            # 方法2: 如果方法1失败，尝试使用Enter键
+            if not send_success:
+                try:
+                    await page.keyboard.press("Enter")
+                    await wait_for_network_idle(page)
+                    send_success = True
+                except Exception:
+                    pass
+        
+            # 方法3: 如果方法2失败，尝试使用JavaScript点击发送按钮
+            if not send_success:
+                try:
+                    js_send_result = await page.evaluate('''
+                        () => {
+                            const sendButtons = Array.from(document.querySelectorAll('button'))
+                                .filter(btn => btn.textContent && btn.textContent.includes('发送'));
+                            if (sendButtons.length > 0) {
+                                sendButtons[0].click();
+                                return true;
+                            }
+                            return false;
+                        }
+                    ''')
+                    await wait_for_network_idle(page)
+                    send_success = js_send_result
+                except Exception:
+                    pass
+        
+            if send_success:
+                return f"已成功发布评论：{comment}"
+            else:
+                await debug_capture.capture(page, "post_comment", "send_failed")
+                return f"发布评论失败，请检查评论内容或网络连接"
     
-    except Exception as e:
-        return f"发布评论时出错: {str(e)}"
+        except Exception as e:
+            return f"发布评论时出错: {str(e)}"
+
+@mcp.tool()
+async def selector_stats() -> str:
+    """查看笔记和评论各字段提取策略的命中率，找出因页面改版而失效的策略"""
+    selector_registry.save()
+    result = "各字段提取策略（按当前尝试顺序）：\n\n"
+    for name, rows in selector_registry.report().items():
+        result += f"{name}:\n"
+        for row in rows:
+            hit_rate = f"{row['hit_rate']:.0%}" if row["hit_rate"] is not None else "-"
+            result += (f"   [{row['status']}] {row['strategy']}: 命中 {row['hits']} 次，失败 {row['misses']} 次，"
+                       f"命中率 {hit_rate}，最近命中 {row['last_hit'] or '无'}\n")
+        result += "\n"
+    return result
+
+@mcp.tool()
+async def rate_limit_status() -> str:
+    """查看页面导航限速和限流退避的当前状态"""
+    status = navigation_scheduler.status()
+    if status["rate_per_second"] > 0:
+        result = f"导航限速：每秒 {status['rate_per_second']} 次，突发上限 {status['burst']} 次，当前可用令牌 {status['tokens']}\n"
+    else:
+        result = "导航限速：未启用\n"
+    if status["backoff_remaining"] > 0:
+        result += f"限流退避中：本次退避 {status['backoff_seconds']:.0f} 秒，剩余 {status['backoff_remaining']} 秒\n"
+    else:
+        result += "当前未被限流\n"
+    result += f"累计导航 {status['navigations']} 次，遇到限流 {status['throttled']} 次，因排队过久拒绝 {status['rejected']} 次\n"
+    if status["last_throttle"]:
+        last = status["last_throttle"]
+        result += f"最近一次限流：{last['at']}，原因 {last['reason']}，页面 {last['url']}\n"
+    if worker_pool.active:
+        result += f"（以上为主进程状态，{worker_pool.size} 个工作进程各自按 1/{worker_pool.size} 的速率限速）\n"
+    return result
+
+@mcp.tool(name="metrics")
+async def get_metrics(output_format: str = "text") -> str:
+    """查看各工具及其各阶段（获取页面、登录检查、导航、等待、滚动、提取、格式化）的耗时分位数和计数器
+    
+    Args:
+        output_format: 输出格式，"text" 为可读摘要，"json" 为完整数据（含最近的调用明细），"prometheus" 为 Prometheus 文本格式
+    """
+    if output_format == "prometheus":
+        return metrics.prometheus()
+    snapshot = metrics.snapshot()
+    if output_format == "json":
+        return json.dumps(snapshot, ensure_ascii=False)
+    
+    if not snapshot["tools"]:
+        return "暂无工具调用记录"
+    result = f"工具耗时统计（分位数基于最近 {METRICS_WINDOW} 次调用）：\n\n"
+    for tool, stats in snapshot["tools"].items():
+        if "count" in stats:
+            result += (f"{tool}: 调用 {stats['count']} 次，失败 {stats['errors']} 次，"
+                       f"p50 {stats['p50_ms']}ms，p95 {stats['p95_ms']}ms，p99 {stats['p99_ms']}ms\n")
+        else:
+            result += f"{tool}:\n"
+        for phase, phase_stats in stats.get("phases", {}).items():
+            result += f"   {phase}: {phase_stats['count']} 次，p50 {phase_stats['p50_ms']}ms，p95 {phase_stats['p95_ms']}ms\n"
+        counters = stats.get("counters", {})
+        if counters:
+            result += "   计数: " + "，".join(f"{name} {value}" for name, value in counters.items()) + "\n"
+        result += "\n"
+    return result
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def prometheus_metrics(request):
+    """HTTP / SSE 模式下与 MCP 服务共用端口的 Prometheus 抓取地址"""
+    from starlette.responses import PlainTextResponse
+    return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # 这里原来有_generate_smart_comment函数，现在已经被移除
 # 因为我们重构了post_smart_comment函数，将评论生成逻辑转移到MCP客户端
@@ -1243,5 +3789,45 @@ async def post_comment(url: str, comment: str) -> str:
 if __name__ == "__main__":
     # 初始化并运行服务器
     print("启动小红书MCP服务器...")
-    print("请在MCP客户端（如Claude for Desktop）中配置此服务器")
-    mcp.run(transport='stdio')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="小红书MCP服务器")
+    parser.add_argument("--transport", choices=["stdio", "http", "sse"], default=TRANSPORT,
+                        help="stdio 供单个客户端启动使用；http / sse 启动常驻服务，多个客户端共享一个浏览器")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--path", default=SERVER_PATH, help="MCP 端点路径，默认 http 为 /mcp，sse 为 /sse")
+    # 兼容旧配置示例中的 --stdio 参数
+    parser.add_argument("--stdio", dest="transport", action="store_const", const="stdio", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if METRICS_PORT:
+        start_metrics_server(METRICS_HOST, METRICS_PORT)
+    
+    async def serve():
+        # 恢复已登记的关键词监控
+        if keyword_monitor.monitors:
+            print(f"恢复 {len(keyword_monitor.monitors)} 个关键词监控")
+            keyword_monitor.start()
+        
+        try:
+            if args.transport == "stdio":
+                print("请在MCP客户端（如Claude for Desktop）中配置此服务器")
+                await mcp.run_async(transport="stdio")
+                return
+            
+            # 常驻服务启动时先打开浏览器，第一个客户端的调用不再承担启动耗时
+            try:
+                if not await ensure_browser():
+                    print("浏览器已启动，但尚未登录，请通过 login 工具完成登录")
+            except Exception as e:
+                print(f"预先启动浏览器失败，将在首次调用时重试: {str(e)}")
+            transport = "streamable-http" if args.transport == "http" else "sse"
+            kwargs = {"host": args.host, "port": args.port}
+            if args.path:
+                kwargs["path"] = args.path
+            print(f"以 {args.transport} 模式监听 {args.host}:{args.port}，最多同时执行 {MAX_CONCURRENT_CALLS} 个调用")
+            await mcp.run_async(transport=transport, **kwargs)
+        finally:
+            # 退出前保存选择器命中统计，距上次定时保存之后的记录不会丢失
+            selector_registry.save()
+    
+    asyncio.run(serve())
\ No newline at end of file